@@ -0,0 +1,405 @@
+"""
+Офлайн микро-бенчмарки горячих путей calculator / utils / main.
+
+Цены берутся из детерминированного синтетического провайдера, сеть не используется.
+
+    python benchmarks.py                                   # прогон и таблица результатов
+    python benchmarks.py --save bench_baseline.json        # сохранить baseline
+    python benchmarks.py --compare bench_baseline.json --max-slowdown 1.3
+    python benchmarks.py -k calculate                      # только бенчмарки с подстрокой в имени
+
+В режиме --compare код возврата 1, если хоть один бенчмарк медленнее baseline больше чем в max-slowdown раз.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date
+
+BENCHMARKS = {}
+
+# Даты начала торгов для синтетических рядов: часть символов появляется позже 1970 года
+LISTINGS = {
+    "VTI": "2001-06-15", "QQQ": "1999-03-10", "GOOGL": "2004-08-19", "AMZN": "1997-05-15",
+    "TSLA": "2010-06-29", "NVDA": "1999-01-22", "BRK-B": "1996-05-09",
+}
+
+
+def benchmark(name: str):
+    """Зарегистрировать бенчмарк. Функция делает подготовку и возвращает измеряемый callable."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class _DownRemote:
+    """Удалённый провайдер с открытым circuit breaker'ом."""
+
+    name = "down"
+
+    def history(self, symbol, start=None, end=None):
+        from clients import CircuitOpen
+
+        raise CircuitOpen("simulated open breaker")
+
+
+def use_fake_market():
+    """Подменить хранилище цен, индекс истории и таблицу роста синтетическими данными."""
+    import numpy as np
+
+    from cross_section import PriceMatrix, set_price_matrix
+    from growth_table import ROW_DTYPE, GrowthTable, set_growth_table
+    from history_index import HistoryIndex, set_history_index
+    from price_store import FixturePriceProvider, set_price_provider
+    from utils import STOCKS
+
+    provider = FixturePriceProvider.synthetic(list(STOCKS), start="1970-01-01", end="2025-01-01", listings=LISTINGS)
+    set_price_provider(provider)
+    set_history_index(HistoryIndex.build(provider, list(STOCKS)))
+    set_growth_table(GrowthTable(np.array([], dtype=ROW_DTYPE), date.today()))
+    set_price_matrix(PriceMatrix.build(provider, list(STOCKS)))
+    return provider
+
+
+@benchmark("calculate_investment[normal]")
+def bench_calculate_normal():
+    from calculator import calculate_investment
+
+    use_fake_market()
+    return lambda: calculate_investment(start_year=1990, daily_spend=300, symbol="AAPL")
+
+
+@benchmark("calculate_investment[last_known_good]")
+def bench_calculate_last_known_good():
+    from calculator import calculate_investment
+    from price_chain import TieredPriceProvider
+
+    source = use_fake_market()
+    chain = TieredPriceProvider(None, source, cache_ttl=0)
+    chain.fetch("AAPL")
+    chain.remote = _DownRemote()
+
+    def run():
+        result = calculate_investment(start_year=1990, daily_spend=300, symbol="AAPL", provider=chain)
+        assert result["freshness"] == "last_known_good"
+        return result
+    return run
+
+
+@benchmark("calculate_investment[growth_table]")
+def bench_calculate_table():
+    from calculator import calculate_investment
+    from growth_table import GrowthTable, set_growth_table
+
+    provider = use_fake_market()
+    set_growth_table(GrowthTable.build(["AAPL"], provider))
+    return lambda: calculate_investment(start_year=1990, daily_spend=300, symbol="AAPL")
+
+
+@benchmark("cross_section.dca[all symbols]")
+def bench_cross_section():
+    from cross_section import get_price_matrix
+
+    use_fake_market()
+    matrix = get_price_matrix()
+    return lambda: matrix.dca(1990)
+
+
+@benchmark("cross_section.compare")
+def bench_cross_section_compare():
+    from cross_section import get_price_matrix
+
+    use_fake_market()
+    matrix = get_price_matrix()
+    return lambda: matrix.compare(1990, "AAPL")
+
+
+@benchmark("run_bulk[1000 scenarios]")
+def bench_bulk():
+    import bulk
+    from utils import STOCKS
+
+    use_fake_market()
+    rng = random.Random(0)
+    symbols = list(STOCKS)
+    lines = [
+        json.dumps({"year": rng.randint(1990, 2020), "daily_spend": rng.randint(1, 1000),
+                    "symbol": rng.choice(symbols)})
+        for _ in range(1000)
+    ]
+    return lambda: sum(1 for _ in bulk.run_bulk(lines))
+
+
+@benchmark("get_random_stock")
+def bench_random_stock():
+    from utils import get_random_stock
+
+    use_fake_market()
+    random.seed(0)
+    return lambda: get_random_stock(start_year=2005)
+
+
+@benchmark("words_to_number")
+def bench_words_to_number():
+    from utils import words_to_number
+
+    return lambda: words_to_number("две тысячи пятьсот")
+
+
+# Реализации разбора ввода до matchers.py — для сравнения в бенчмарках
+def _legacy_words_to_number(text: str):
+    num_words = {
+        "ноль": 0, "один": 1, "два": 2, "три": 3, "четыре": 4, "пять": 5, "шесть": 6, "семь": 7, "восемь": 8,
+        "девять": 9, "десять": 10, "двадцать": 20, "тридцать": 30, "сорок": 40, "пятьдесят": 50,
+        "шестьдесят": 60, "семьдесят": 70, "восемьдесят": 80, "девяносто": 90,
+        "сто": 100, "двести": 200, "триста": 300, "четыреста": 400, "пятьсот": 500, "шестьсот": 600,
+        "семьсот": 700, "восемьсот": 800, "девятьсот": 900, "тысяча": 1000, "тысячи": 1000, "тысяч": 1000,
+        "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+        "nine": 9, "ten": 10, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70,
+        "eighty": 80, "ninety": 90, "hundred": 100, "thousand": 1000,
+    }
+    total = current = 0
+    for word in text.lower().replace("-", " ").split():
+        if word in num_words:
+            scale = num_words[word]
+            if scale == 1000:
+                total += (current or 1) * 1000
+                current = 0
+            elif scale == 100:
+                current = (current or 1) * 100
+            else:
+                current += scale
+    total += current
+    return float(total) if total > 0 else None
+
+
+def _legacy_match_currency(text: str):
+    currency_map = {
+        "usd": ["usd", "доллар", "доллары", "dollar", "dollars", "бакс", "баксы"],
+        "eur": ["eur", "евро", "euro"],
+        "rub": ["rub", "рубль", "руб", "рубли", "ruble", "rubles"],
+        "amd": ["amd", "драм", "dram"],
+        "kzt": ["kzt", "тенге", "tenge"],
+        "uah": ["uah", "гривна", "гривны", "hryvnia"],
+        "byn": ["byn", "белрубль", "бел.рубль", "белорусский рубль", "byrub", "byr"],
+        "gbp": ["gbp", "фунт", "фунты", "pound", "pounds"],
+        "cny": ["cny", "юань", "yuan"],
+    }
+    for code, synonyms in currency_map.items():
+        if any(s in text for s in synonyms):
+            return code.upper()
+    return None
+
+
+def _legacy_is_confirmation(text: str) -> bool:
+    return any(word in text for word in ["да", "готов", "ок", "согласен", "yes", "go"])
+
+
+INPUT_SAMPLES = {
+    "currency": ["белорусский рубль", "в долларах", "юани", "тенге наверное", "фунты стерлингов", "не знаю"],
+    "confirm": ["да", "ну ок", "около того", "согласен, давай", "нет", "готов!"],
+    "number": ["две тысячи пятьсот", "пятьсот", "three hundred twenty", "сто двадцать пять", "много"],
+}
+
+
+def _each(fn, samples):
+    return lambda: [fn(text) for text in samples]
+
+
+@benchmark("match_currency[legacy]")
+def bench_currency_legacy():
+    return _each(_legacy_match_currency, INPUT_SAMPLES["currency"])
+
+
+@benchmark("match_currency")
+def bench_currency():
+    from matchers import match_currency
+
+    return _each(match_currency, INPUT_SAMPLES["currency"])
+
+
+@benchmark("is_confirmation[legacy]")
+def bench_confirm_legacy():
+    return _each(_legacy_is_confirmation, INPUT_SAMPLES["confirm"])
+
+
+@benchmark("is_confirmation")
+def bench_confirm():
+    from matchers import is_confirmation
+
+    return _each(is_confirmation, INPUT_SAMPLES["confirm"])
+
+
+@benchmark("words_to_number[legacy]")
+def bench_words_legacy():
+    return _each(_legacy_words_to_number, INPUT_SAMPLES["number"])
+
+
+@benchmark("words_to_number[samples]")
+def bench_words_samples():
+    from utils import words_to_number
+
+    return _each(words_to_number, INPUT_SAMPLES["number"])
+
+
+@benchmark("parse_number_words_many[1000]")
+def bench_words_batch():
+    from matchers import parse_number_words_many
+
+    texts = [INPUT_SAMPLES["number"][i % len(INPUT_SAMPLES["number"])] for i in range(1000)]
+    return lambda: parse_number_words_many(texts)
+
+
+@benchmark("format_currency")
+def bench_format_currency():
+    from utils import format_currency
+
+    return lambda: format_currency(1234567.5, "RUB")
+
+
+@benchmark("generate_final_message")
+def bench_final_message():
+    from main import generate_final_message
+    from utils import get_stock_info
+
+    info = get_stock_info("AAPL")
+    return lambda: generate_final_message(
+        "AAPL", info, "пью кофе", 2005, 300, "RUB", 2500000, 1200000, 1300000, 108.3
+    )
+
+
+def habit_templates(count: int):
+    """Шаблоны ru с count привычками: шесть настоящих и синтетические до нужного числа."""
+    from matchers import HABIT_STEMS, PhraseMatcher
+    from templates import RU, MessageTemplates
+
+    templates = MessageTemplates(RU, PhraseMatcher(HABIT_STEMS, prefix=True))
+    for i in range(count - len(RU["habits"])):
+        templates.register_habit(f"привычка{i}", [f"хобби{i:04d}"], f"хобби {i}", f"на хобби {i}", "Мог бы!")
+    return templates
+
+
+def _bench_render(count: int):
+    """Промах кэша: каждый вызов — другая привычка из count и компиляция шаблона заново."""
+    from itertools import cycle
+
+    from utils import get_stock_info
+
+    templates, info = habit_templates(count), get_stock_info("AAPL")
+    habits = cycle(["пью кофе", "курю сигареты", "ем сладкое"] + [f"хобби{i:04d} по вечерам" for i in range(count - 6)])
+
+    def run():
+        templates._compiled.clear()
+        return templates.render(
+            "AAPL", info, next(habits), 2005, 300, "RUB", 2500000, 1200000, 1300000, 108.3
+        )
+    return run
+
+
+@benchmark("generate_final_message[6 habits]")
+def bench_final_message_6_habits():
+    return _bench_render(6)
+
+
+@benchmark("generate_final_message[600 habits]")
+def bench_final_message_600_habits():
+    return _bench_render(600)
+
+
+@benchmark("process_user_input[dialog]")
+def bench_dialog():
+    import main
+    from session_store import MemorySessionStore
+
+    use_fake_market()
+    main.user_sessions = MemorySessionStore()
+    random.seed(0)
+    messages = ["2005", "кофе", "300", "рубли", "да"]
+
+    def run():
+        for text in messages:
+            reply = main.process_user_input("bench-user", text)
+        assert reply.startswith("💡")
+    return run
+
+
+def measure(fn, min_time: float = 0.2, repeat: int = 5) -> dict:
+    """Подобрать число повторов на ~min_time и взять лучшее время на вызов из repeat замеров."""
+    fn()
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / repeat or loops >= 1 << 20:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, time.perf_counter() - started)
+    return {"per_call_us": best / loops * 1e6, "loops": loops}
+
+
+def run(names=None, min_time: float = 0.2, repeat: int = 5) -> dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        results[name] = measure(setup(), min_time, repeat)
+    return results
+
+
+def compare(results: dict, baseline: dict, max_slowdown: float) -> list:
+    """Список (name, baseline_us, current_us, ratio) для бенчмарков медленнее baseline больше чем в max_slowdown раз."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = current["per_call_us"] / base["per_call_us"]
+        if ratio > max_slowdown:
+            regressions.append((name, base["per_call_us"], current["per_call_us"], ratio))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="names", action="append", help="запускать только бенчмарки с этой подстрокой")
+    parser.add_argument("--save", metavar="PATH", help="сохранить результаты как baseline")
+    parser.add_argument("--compare", metavar="PATH", help="сравнить с baseline")
+    parser.add_argument("--max-slowdown", type=float, default=1.25, help="допустимое замедление (по умолчанию 1.25)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="секунд на один бенчмарк")
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.min_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    for name, r in results.items():
+        line = f"{name:40} {r['per_call_us']:12.2f} us"
+        if baseline and name in baseline:
+            line += f"   x{r['per_call_us'] / baseline[name]['per_call_us']:.2f} vs baseline"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2, ensure_ascii=False)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.max_slowdown)
+        for name, base, current, ratio in regressions:
+            print(f"REGRESSION {name}: {base:.2f} us -> {current:.2f} us (x{ratio:.2f} > x{args.max_slowdown})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Массовый расчёт сценариев (year, daily_spend, currency, symbol) для превью кампаний.
+
+Вход и выход — NDJSON, по одному сценарию на строку. Сценарии читаются порциями
+по CHUNK_SIZE; внутри порции они группируются по (symbol, currency), а вся группа считается
+одним вызовом dca.simulate_many. История символа и курсы загружаются один раз на запрос
+и переиспользуются следующими порциями. Результаты порции отдаются сразу, поэтому память
+зависит только от числа символов, а их набор ограничен utils.STOCKS: произвольный символ
+не уходит ни в удалённый источник, ни в снимки last_known_good на диске.
+"""
+import json
+import os
+from datetime import datetime
+from itertools import islice
+
+CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+MAX_SCENARIOS = int(os.getenv("BULK_MAX_SCENARIOS", "100000"))
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+def parse_scenario(line) -> dict:
+    """Сценарий из строки NDJSON. ScenarioError, если поля неверны."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise ScenarioError("Строка не является JSON")
+    if not isinstance(data, dict):
+        raise ScenarioError("Ожидается JSON-объект")
+    try:
+        year = int(data["year"])
+        daily_spend = float(data["daily_spend"])
+        symbol = str(data["symbol"]).upper()
+    except (KeyError, TypeError, ValueError):
+        raise ScenarioError("Нужны поля year, daily_spend и symbol")
+    if not 1970 <= year <= datetime.now().year:
+        raise ScenarioError(f"Год вне диапазона 1970-{datetime.now().year}")
+    if daily_spend <= 0:
+        raise ScenarioError("daily_spend должен быть положительным")
+    return {
+        "id": data.get("id"),
+        "year": year,
+        "daily_spend": daily_spend,
+        "symbol": symbol,
+        "currency": str(data.get("currency") or "USD").upper(),
+    }
+
+
+class _Histories:
+    """История символа и курсы по (symbol, currency), загруженные один раз на запрос."""
+
+    def __init__(self, provider, fx_rates, now):
+        self.provider = provider
+        self.fx_rates = fx_rates
+        self.now = now
+        self._series = {}
+        self._rates = {}
+
+    def series(self, symbol: str):
+        """Ряд символа или None, если данных нет."""
+        if symbol not in self._series:
+            try:
+                self._series[symbol] = self.provider.history(symbol, end=self.now)
+            except KeyError:
+                self._series[symbol] = None
+        return self._series[symbol]
+
+    def rates(self, symbol: str, currency: str):
+        key = (symbol, currency)
+        if key not in self._rates:
+            series = self._series[symbol]
+            self._rates[key] = self.fx_rates.rates(currency, series.dates) if currency != "USD" else None
+        return self._rates[key]
+
+
+def _compute_group(histories: _Histories, symbol: str, currency: str, scenarios: list, schedule: str) -> list:
+    """Результаты группы сценариев одного символа и валюты — один проход по истории."""
+    import numpy as np
+
+    from dca import simulate_many
+
+    series, now, fx_rates = histories.series(symbol), histories.now, histories.fx_rates
+    if series is None:
+        return [{"error": f"Нет данных по {symbol}"}] * len(scenarios)
+    rates = histories.rates(symbol, currency)
+
+    years = np.array([s["year"] for s in scenarios])
+    spend = np.array([s["daily_spend"] for s in scenarios])
+    starts = np.array([f"{y}-01-01" for y in years], dtype="datetime64[D]")
+    months = (now.year - years) * 12 + now.month
+    r = simulate_many(series.dates, series.close, starts, months, schedule, fx=rates)
+    # Как в calculate_investment: сценарии с покупками до начала курсов считаются без пересчёта
+    fx_adjusted = np.full(len(scenarios), currency == "USD")
+    if rates is not None and len(series):
+        first = np.maximum(starts, series.dates[0])
+        fx_adjusted = fx_rates.covers(currency, first)
+        if not fx_adjusted.all():
+            plain = simulate_many(series.dates, series.close, starts, months, schedule)
+            r = {key: np.where(fx_adjusted, r[key], plain[key]) for key in r}
+
+    invested = r["total_invested"] * spend
+    value = r["total_value"] * spend
+    results = []
+    for i in range(len(scenarios)):
+        if not r["valid"][i]:
+            results.append({"error": f"Нет истории {symbol} с {years[i]} года"})
+            continue
+        results.append({
+            "months": int(months[i]),
+            "total_invested": float(invested[i]),
+            "total_value": float(value[i]),
+            "profit_percent": float(r["profit_percent"][i]),
+            "cagr": float(r["cagr"][i]),
+            "volatility": float(r["volatility"][i]),
+            "sharpe_ratio": float(r["sharpe_ratio"][i]),
+            "fx_adjusted": bool(fx_adjusted[i]),
+        })
+    return results
+
+
+def run_bulk(lines, provider=None, fx_rates=None, schedule: str = "monthly", chunk_size: int = CHUNK_SIZE,
+             max_scenarios: int = MAX_SCENARIOS, symbols=None, currencies=None):
+    """
+    Генератор результатов (dict) по строкам NDJSON в порядке входа.
+    К каждому результату добавляются line (номер строки), id и поля сценария.
+    symbols — допустимые символы (по умолчанию utils.STOCKS), currencies — валюты (по умолчанию
+    main.CURRENCIES, как в диалоге); остальные получают ошибку.
+    """
+    from fx import get_fx_rates
+    from main import CURRENCIES
+    from price_store import get_price_provider
+    from utils import STOCKS
+
+    allowed = set(STOCKS if symbols is None else symbols)
+    allowed_currencies = set(CURRENCIES if currencies is None else currencies)
+    now = datetime.now()
+    histories = _Histories(provider or get_price_provider(), fx_rates or get_fx_rates(), now)
+    numbered = ((n, line) for n, line in enumerate(lines, 1) if line.strip())
+    total = 0
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            return
+        results = [None] * len(chunk)
+        groups = {}
+        for i, (n, line) in enumerate(chunk):
+            total += 1
+            if total > max_scenarios:
+                results[i] = {"line": n, "error": f"Больше {max_scenarios} сценариев за запрос"}
+                continue
+            try:
+                scenario = parse_scenario(line)
+            except ScenarioError as e:
+                results[i] = {"line": n, "error": str(e)}
+                continue
+            if scenario["symbol"] not in allowed:
+                results[i] = {"line": n, **scenario, "error": f"Символ {scenario['symbol']} не поддерживается"}
+                continue
+            if scenario["currency"] not in allowed_currencies:
+                results[i] = {"line": n, **scenario, "error": f"Валюта {scenario['currency']} не поддерживается"}
+                continue
+            groups.setdefault((scenario["symbol"], scenario["currency"]), []).append((i, n, scenario))
+
+        for (symbol, currency), items in groups.items():
+            computed = _compute_group(histories, symbol, currency, [s for _, _, s in items], schedule)
+            for (i, n, scenario), result in zip(items, computed):
+                results[i] = {"line": n, **scenario, **result}
+        yield from results
+        if total > max_scenarios:
+            return
+
+
+def to_ndjson(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
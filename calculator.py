@@ -1,86 +1,84 @@
-import yfinance as yf
+import time
 from datetime import datetime, timedelta
-import pandas as pd
-import numpy as np
+from metrics import CACHE_REQUESTS, CALCULATION_SECONDS
 
-def calculate_investment(start_year: int, daily_spend: float, symbol: str, currency: str = "USD") -> dict:
+def calculate_investment(start_year: int, daily_spend: float, symbol: str, currency: str = "USD", provider=None,
+                         schedule: str = "monthly") -> dict:
     """
     Рассчитать инвестиционную доходность по заданным параметрам.
+    Цены берутся из цепочки источников (price_chain): сначала локальное хранилище.
+    schedule — график покупок по дневным барам: "daily", "weekly" или "monthly".
+    Если для (symbol, start_year) есть актуальная строка в таблице роста — история не загружается.
+    freshness в результате — откуда данные: local, cache, live, last_known_good (см. price_chain)
+    или unavailable.
+    daily_spend задан в currency: каждая покупка пересчитывается в USD по курсу своего дня
+    из локального хранилища курсов (fx). Без курсов валюты или если они начинаются позже первой
+    покупки расчёт идёт как в USD, fx_adjusted=False.
     """
-    try:
-        # 1. Определяем даты
-        start_date = datetime(start_year, 1, 1)
-        now = datetime.now()
-        months = (now.year - start_date.year) * 12 + (now.month - start_date.month) + 1
-        monthly_spend = daily_spend * 30
+    # numpy и хранилища загружаются при первом расчёте (или заранее — в warmup)
+    from dca import simulate
+    from fx import BASE_CURRENCY, get_fx_rates
+    from growth_table import get_growth_table
+    from price_chain import fetch_history
+    from price_store import get_price_provider
 
-        # 2. Получаем исторические данные
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(start=start_date.strftime("%Y-%m-%d"), end=now.strftime("%Y-%m-%d"), interval="1mo")
+    started = time.perf_counter()
+    fx_rates = get_fx_rates()
+    # Таблица роста посчитана в USD: подходит для USD и для валют без курсов
+    if provider is None and (currency == BASE_CURRENCY or not fx_rates.has(currency)):
+        table = get_growth_table(schedule)
+        result = table.lookup(symbol, start_year, daily_spend) if table is not None else None
+        CACHE_REQUESTS.inc(cache="growth_table", result="hit" if result is not None else "miss")
+        if result is not None:
+            result["fx_adjusted"] = currency == BASE_CURRENCY
+            CALCULATION_SECONDS.observe(time.perf_counter() - started, path="growth_table")
+            return result
+    provider = provider or get_price_provider()
+    # 1. Определяем даты
+    start_date = datetime(start_year, 1, 1)
+    now = datetime.now()
+    months = (now.year - start_date.year) * 12 + (now.month - start_date.month) + 1
+    hist = None
+    freshness = "unavailable"
+    try:
+        # 2. Исторические данные (дневные бары) из цепочки источников — один запрос, без повторов
+        hist, freshness = fetch_history(provider, symbol, start_date, now)
         
         if hist.empty:
             raise ValueError("Нет данных по активу")
 
-        # 3. Для каждого месяца: покупаем на первое число месяца
-        total_units = 0
-        total_invested = 0
-        monthly_returns = []
-        
-        for date, row in hist.iterrows():
-            price = row['Close']
-            units = monthly_spend / price
-            total_units += units
-            total_invested += monthly_spend
-            monthly_returns.append((price / hist['Close'].iloc[0]) - 1)
-
-        # 4. Текущая цена и расчеты
-        current_price = hist['Close'].iloc[-1]
-        total_value = total_units * current_price
-        
-        # Расчет дополнительных метрик
-        years = months / 12
-        cagr = (total_value / total_invested) ** (1 / years) - 1 if total_invested > 0 else 0
-        volatility = np.std(monthly_returns) * np.sqrt(12) if len(monthly_returns) > 1 else 0
-        sharpe_ratio = (cagr - 0.02) / volatility if volatility > 0 else 0  # Assuming 2% risk-free rate
-        
-        profit_percent = ((total_value - total_invested) / total_invested * 100) if total_invested > 0 else 0
+        # 3. Курс валюты на дату каждого бара (as-of join) — одна операция над массивом;
+        # если курсы начинаются позже первой покупки, пересчёта нет (fx_adjusted=False)
+        if currency != BASE_CURRENCY and fx_rates.covers(currency, hist.dates[0]):
+            rates = fx_rates.rates(currency, hist.dates)
+        else:
+            rates = None
 
-        return {
-            "months": months,
-            "total_invested": total_invested,
-            "total_units": total_units,
-            "current_price": current_price,
-            "total_value": total_value,
-            "profit_percent": profit_percent,
-            "cagr": cagr * 100,  # Convert to percentage
-            "volatility": volatility * 100,  # Convert to percentage
-            "sharpe_ratio": sharpe_ratio,
-            "fallback": False
-        }
+        # 4. Покупки по графику (monthly — в первый торговый день месяца) и метрики — векторно
+        result = simulate(hist.dates, hist.close, daily_spend, months, schedule, fx=rates)
+        result["fx_adjusted"] = currency == BASE_CURRENCY or rates is not None
+        result["freshness"] = freshness
+        CALCULATION_SECONDS.observe(time.perf_counter() - started, path="normal")
+        return result
     except Exception as e:
-        # Fallback: используем CAGR (реальную среднегодовую доходность)
-        now = datetime.now()
-        start_date = datetime(start_year, 1, 1)
-        months = (now.year - start_date.year) * 12 + (now.month - start_date.month) + 1
+        # Fallback: оценка по CAGR на уже загруженном ряде; источник повторно не запрашивается
         monthly_spend = daily_spend * 30
         total_invested = months * monthly_spend
         years = months / 12
 
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(start=start_date.strftime("%Y-%m-%d"), end=now.strftime("%Y-%m-%d"))
-            
-            if hist.empty or len(hist['Close']) < 2:
-                raise ValueError("Недостаточно данных для расчета")
+            if hist is None or len(hist) < 2:
+                raise ValueError(f"Недостаточно данных для расчета: {e}")
 
-            price_start = hist['Close'].iloc[0]
-            price_end = hist['Close'].iloc[-1]
+            price_start = float(hist.close[0])
+            price_end = float(hist.close[-1])
             cagr = (price_end / price_start) ** (1 / years) - 1
             
             # Считаем итоговую сумму с реальной средней доходностью
             total_value = total_invested * ((1 + cagr) ** years)
             profit_percent = ((total_value - total_invested) / total_invested * 100) if total_invested > 0 else 0
             
+            CALCULATION_SECONDS.observe(time.perf_counter() - started, path="fallback")
             return {
                 "months": months,
                 "total_invested": total_invested,
@@ -92,9 +90,12 @@ def calculate_investment(start_year: int, daily_spend: float, symbol: str, curre
                 "volatility": None,
                 "sharpe_ratio": None,
                 "fallback": True,
+                "fx_adjusted": currency == BASE_CURRENCY,
+                "freshness": freshness,
                 "error": str(e)
             }
         except Exception as e:
+            CALCULATION_SECONDS.observe(time.perf_counter() - started, path="error")
             return {
                 "months": months,
                 "total_invested": total_invested,
@@ -106,5 +107,7 @@ def calculate_investment(start_year: int, daily_spend: float, symbol: str, curre
                 "volatility": None,
                 "sharpe_ratio": None,
                 "fallback": True,
+                "fx_adjusted": False,
+                "freshness": "unavailable",
                 "error": str(e)
-            } 
\ No newline at end of file
+            }
@@ -0,0 +1,387 @@
+"""
+Слой исходящих вызовов: рыночные данные (yfinance), OpenAI и произвольный HTTP.
+
+Каждый upstream имеет:
+- жёсткий дедлайн на вызов (UpstreamTimeout, даже если библиотека сама не умеет таймауты);
+- ограничение числа одновременных вызовов (UpstreamBusy, если слот не освободился до дедлайна);
+- переиспользуемые keep-alive соединения (один клиент/сессия на процесс);
+- circuit breaker: после серии ошибок вызовы сразу отклоняются (CircuitOpen) на время
+  экспоненциально растущей паузы, затем один пробный вызов;
+- async-варианты для будущей ASGI-точки входа.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from metrics import UPSTREAM_SECONDS, Gauge
+from singleflight import create_single_flight
+
+
+# upstream name -> CircuitBreaker, для метрик
+BREAKERS = {}
+
+
+class UpstreamError(Exception):
+    """Ошибка внешнего сервиса."""
+
+
+class UpstreamTimeout(UpstreamError):
+    """Вызов не уложился в дедлайн."""
+
+
+class UpstreamBusy(UpstreamError):
+    """Превышен лимит одновременных вызовов к сервису."""
+
+
+class CircuitOpen(UpstreamError):
+    """Сервис временно отключён circuit breaker'ом."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open после failure_threshold ошибок подряд; open длится base_backoff * 2^(n-1)
+    секунд (n — число открытий подряд, не больше max_backoff), затем half-open: пропускается
+    один пробный вызов. Успех закрывает breaker и сбрасывает паузу.
+    """
+
+    def __init__(self, failure_threshold: int = 3, base_backoff: float = 1.0, max_backoff: float = 300.0,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.failures = 0
+        self.trips = 0
+        self.open_until = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.open_until is None:
+            return "closed"
+        return "open" if self.clock() < self.open_until else "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.open_until is None:
+                return True
+            if self.clock() < self.open_until or self._probe:
+                return False
+            self._probe = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = self.trips = 0
+            self.open_until = None
+            self._probe = False
+
+    def release_probe(self):
+        """Пробный вызов не дошёл до сервиса (например, нет свободного слота): пропустить следующий."""
+        with self._lock:
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe or self.failures >= self.failure_threshold:
+                self.trips += 1
+                backoff = min(self.base_backoff * 2 ** (self.trips - 1), self.max_backoff)
+                self.open_until = self.clock() + backoff
+                self.failures = 0
+                self._probe = False
+
+
+class Upstream:
+    """Пул потоков + семафор + дедлайн + circuit breaker для одного внешнего сервиса."""
+
+    def __init__(self, name: str, timeout: float, max_concurrency: int, breaker: CircuitBreaker = None):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        BREAKERS[name] = self.breaker
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"upstream-{name}")
+
+    def _submit(self, fn, args, kwargs, wait: float):
+        if not self._slots.acquire(timeout=max(wait, 0)):
+            raise UpstreamBusy(f"{self.name}: все {self.max_concurrency} слотов заняты")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Слот освобождается, когда вызов реально завершился, даже если ответ уже не ждут
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            UPSTREAM_SECONDS.observe(0.0, upstream=self.name, op="call", outcome="open")
+            raise CircuitOpen(f"{self.name}: сервис временно отключён после серии ошибок")
+
+    def _record(self, outcome: str):
+        # Занятые слоты — локальная перегрузка, а не отказ сервиса; пробный вызов не состоялся
+        if outcome == "ok":
+            self.breaker.record_success()
+        elif outcome == "busy":
+            self.breaker.release_probe()
+        else:
+            self.breaker.record_failure()
+
+    def _observe(self, fn, started: float, outcome: str):
+        op = getattr(fn, "__name__", "call").lstrip("_")
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=self.name, op=op, outcome=outcome)
+
+    def call(self, fn, *args, timeout: float = None, **kwargs):
+        """Выполнить fn с дедлайном timeout (по умолчанию — таймаут upstream)."""
+        timeout = timeout if timeout is not None else self.timeout
+        started = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        outcome = "error"
+        self._check_breaker()
+        try:
+            future = self._submit(fn, args, kwargs, timeout)
+            try:
+                result = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeout:
+                future.cancel()
+                outcome = "timeout"
+                raise UpstreamTimeout(f"{self.name}: нет ответа за {timeout} с")
+            outcome = "ok"
+            return result
+        except UpstreamBusy:
+            outcome = "busy"
+            raise
+        finally:
+            self._record(outcome)
+            self._observe(fn, started, outcome)
+
+    async def acall(self, fn, *args, timeout: float = None, **kwargs):
+        """Async-вариант call: ожидание не блокирует event loop."""
+        timeout = timeout if timeout is not None else self.timeout
+        started = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        outcome = "error"
+        self._check_breaker()
+        try:
+            loop = asyncio.get_running_loop()
+            future = await loop.run_in_executor(None, self._submit, fn, args, kwargs, timeout)
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise UpstreamTimeout(f"{self.name}: нет ответа за {timeout} с")
+            outcome = "ok"
+            return result
+        except UpstreamBusy:
+            outcome = "busy"
+            raise
+        finally:
+            self._record(outcome)
+            self._observe(fn, started, outcome)
+
+
+class HttpClient:
+    """JSON по HTTP через пул keep-alive соединений (requests.Session)."""
+
+    def __init__(self, base_url: str, timeout: float = 5.0, max_concurrency: int = 8, name: str = "http"):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url.rstrip("/")
+        self.upstream = Upstream(name, timeout, max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method: str, path: str, timeout: float, **kwargs):
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs)
+        if response.status_code >= 400:
+            raise UpstreamError(f"{self.upstream.name}: HTTP {response.status_code}")
+        return response.json()
+
+    def get_json(self, path: str, params: dict = None, timeout: float = None):
+        timeout = timeout if timeout is not None else self.upstream.timeout
+        return self.upstream.call(self._request, "GET", path, timeout, params=params, timeout=timeout)
+
+    def post_json(self, path: str, payload, timeout: float = None):
+        timeout = timeout if timeout is not None else self.upstream.timeout
+        return self.upstream.call(self._request, "POST", path, timeout, json=payload, timeout=timeout)
+
+    async def aget_json(self, path: str, params: dict = None, timeout: float = None):
+        timeout = timeout if timeout is not None else self.upstream.timeout
+        return await self.upstream.acall(self._request, "GET", path, timeout, params=params, timeout=timeout)
+
+    async def apost_json(self, path: str, payload, timeout: float = None):
+        timeout = timeout if timeout is not None else self.upstream.timeout
+        return await self.upstream.acall(self._request, "POST", path, timeout, json=payload, timeout=timeout)
+
+
+class MarketDataClient:
+    """
+    Вызовы yfinance с дедлайном и ограничением параллельности. Ticker-объекты переиспользуются.
+    Одинаковые одновременные запросы истории (symbol, диапазон, интервал) объединяются single-flight.
+    """
+
+    def __init__(self, timeout: float = 10.0, max_concurrency: int = 8, single_flight=None):
+        self.upstream = Upstream("yfinance", timeout, max_concurrency)
+        self.single_flight = single_flight or create_single_flight()
+        self._tickers = {}
+
+    def _ticker(self, symbol: str):
+        ticker = self._tickers.get(symbol)
+        if ticker is None:
+            import yfinance as yf
+
+            ticker = self._tickers.setdefault(symbol, yf.Ticker(symbol))
+        return ticker
+
+    def _history(self, symbol: str, kwargs: dict):
+        return self._ticker(symbol).history(timeout=self.upstream.timeout, **kwargs)
+
+    def _info(self, symbol: str):
+        return self._ticker(symbol).info
+
+    def history(self, symbol: str, timeout: float = None, **kwargs):
+        key = (
+            "history", symbol, kwargs.get("start"), kwargs.get("end"),
+            kwargs.get("period"), kwargs.get("interval", "1d"),
+        )
+        return self.single_flight.do(key, self.upstream.call, self._history, symbol, kwargs, timeout=timeout)
+
+    def info(self, symbol: str, timeout: float = None) -> dict:
+        return self.upstream.call(self._info, symbol, timeout=timeout)
+
+    async def ahistory(self, symbol: str, timeout: float = None, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.history, symbol, timeout=timeout, **kwargs))
+
+    async def ainfo(self, symbol: str, timeout: float = None) -> dict:
+        return await self.upstream.acall(self._info, symbol, timeout=timeout)
+
+
+class LLMClient:
+    """
+    OpenAI chat completions. Клиент создаётся лениво и переиспользует соединения;
+    base_url можно направить на локальный тестовый сервер (OPENAI_BASE_URL).
+    Async-вариант рассчитан на один event loop на процесс.
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = "gpt-3.5-turbo",
+                 timeout: float = 15.0, max_concurrency: int = 4):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.upstream = Upstream("openai", timeout, max_concurrency)
+        self._async_slots = None
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _options(self) -> dict:
+        return {
+            "api_key": self.api_key or os.getenv("OPENAI_API_KEY"),
+            "base_url": self.base_url or os.getenv("OPENAI_BASE_URL") or None,
+            "timeout": self.timeout,
+            "max_retries": 0,
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+
+                    self._client = OpenAI(**self._options())
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    from openai import AsyncOpenAI
+
+                    self._async_client = AsyncOpenAI(**self._options())
+        return self._async_client
+
+    def _create(self, messages, kwargs):
+        model = kwargs.pop("model", self.model)
+        response = self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        return response.choices[0].message.content
+
+    def chat(self, messages: list, timeout: float = None, **kwargs) -> str:
+        """Текст ответа модели."""
+        return self.upstream.call(self._create, messages, kwargs, timeout=timeout)
+
+    async def achat(self, messages: list, timeout: float = None, **kwargs) -> str:
+        """Async-вариант chat на AsyncOpenAI; дедлайн и лимит параллельности те же."""
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.upstream.max_concurrency)
+        timeout = timeout if timeout is not None else self.timeout
+        started = time.perf_counter()
+        outcome = "error"
+        self.upstream._check_breaker()
+        try:
+            async with self._async_slots:
+                response = await asyncio.wait_for(
+                    self.async_client.chat.completions.create(
+                        model=kwargs.pop("model", self.model), messages=messages, **kwargs
+                    ),
+                    timeout,
+                )
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise UpstreamTimeout(f"openai: нет ответа за {timeout} с")
+        finally:
+            self.upstream._record(outcome)
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream="openai", op="achat", outcome=outcome)
+        return response.choices[0].message.content
+
+
+_market_data = None
+_llm = None
+_singletons_lock = threading.Lock()
+
+
+def get_market_data() -> MarketDataClient:
+    """Общий клиент рыночных данных процесса."""
+    global _market_data
+    if _market_data is None:
+        with _singletons_lock:
+            if _market_data is None:
+                _market_data = MarketDataClient(
+                    timeout=float(os.getenv("MARKET_DATA_TIMEOUT", "10")),
+                    max_concurrency=int(os.getenv("MARKET_DATA_CONCURRENCY", "8")),
+                )
+    return _market_data
+
+
+def get_llm() -> LLMClient:
+    """Общий клиент OpenAI процесса."""
+    global _llm
+    if _llm is None:
+        with _singletons_lock:
+            if _llm is None:
+                _llm = LLMClient(
+                    timeout=float(os.getenv("OPENAI_TIMEOUT", "15")),
+                    max_concurrency=int(os.getenv("OPENAI_CONCURRENCY", "4")),
+                )
+    return _llm
+
+
+CIRCUIT_STATE = Gauge(
+    "circuit_breaker_open", "1 while the upstream circuit breaker rejects calls (open or half-open)", ["upstream"],
+    fn=lambda: {name: int(b.state != "closed") for name, b in BREAKERS.items()},
+)
@@ -0,0 +1,130 @@
+"""
+Сравнение всех активов STOCKS: лучший и худший с года X и место выбранного символа.
+
+Ряды всех символов выровнены в одну матрицу symbols x months: цена первого бара
+каждого месяца (как покупки monthly в dca.simulate), NaN до начала торгов.
+DCA по всем символам с года X — одна операция над срезом матрицы; рейтинг по году
+кэшируется, поэтому сравнение в финальном сообщении стоит как поиск в словаре.
+
+Рейтинг считается в USD при daily_spend = 1: доходность в процентах от суммы трат не зависит.
+Матрица строится из локального хранилища цен и пересобирается раз в день. Сравнение
+согласуется с расчётом, только если тот тоже в USD и по тому же источнику (comparable_with).
+"""
+import threading
+from datetime import date
+
+import numpy as np
+
+from dca import SCHEDULES, contribution_points
+
+DAYS_PER_PURCHASE = SCHEDULES["monthly"][0]
+
+
+class PriceMatrix:
+    """prices[i, j] — цена символа i в первый торговый день месяца months[j]; last[i] — последняя цена."""
+
+    def __init__(self, symbols: list, months: np.ndarray, prices: np.ndarray, last: np.ndarray,
+                 built_on: date = None, source: str = None):
+        self.symbols = symbols
+        self.months = months
+        self.prices = prices
+        self.last = last
+        self.built_on = built_on or date.today()
+        self.source = source
+        self._rankings = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, provider, symbols) -> "PriceMatrix":
+        source = getattr(provider, "name", None)
+        firsts = {}
+        for symbol in symbols:
+            try:
+                series = provider.history(symbol)
+            except KeyError:
+                continue
+            if series.empty:
+                continue
+            points = contribution_points(series.dates, "monthly")
+            firsts[symbol] = (series.dates[points].astype("datetime64[M]"), series.close[points], series.close[-1])
+        if not firsts:
+            return cls([], np.array([], dtype="datetime64[M]"), np.empty((0, 0)), np.empty(0), source=source)
+
+        lo = min(m[0] for m, _, _ in firsts.values())
+        hi = max(m[-1] for m, _, _ in firsts.values())
+        months = np.arange(lo, hi + 1, dtype="datetime64[M]")
+        prices = np.full((len(firsts), len(months)), np.nan)
+        for i, (m, close, _) in enumerate(firsts.values()):
+            prices[i, (m - lo).astype(np.int64)] = close
+        last = np.array([last for _, _, last in firsts.values()], dtype=np.float64)
+        return cls(list(firsts), months, prices, last, source=source)
+
+    def comparable_with(self, result: dict, currency: str) -> bool:
+        """
+        Можно ли ставить рейтинг рядом с результатом calculate_investment: доходность того тоже
+        в USD (без пересчёта взносов) и по тем же ценам, иначе проценты противоречат друг другу.
+        """
+        if result.get("fallback") or result.get("freshness") != self.source:
+            return False
+        return currency == "USD" or not result.get("fx_adjusted")
+
+    def dca(self, start_year: int) -> dict:
+        """Вложено, стоимость и доходность (%) каждого символа при покупках с января start_year."""
+        start = int(np.searchsorted(self.months, np.datetime64(f"{start_year}-01", "M")))
+        part = self.prices[:, start:]
+        bought = ~np.isnan(part)
+        invested = bought.sum(axis=1) * float(DAYS_PER_PURCHASE)
+        units = np.where(bought, DAYS_PER_PURCHASE / np.where(bought, part, 1.0), 0.0).sum(axis=1)
+        value = units * self.last
+        valid = invested > 0
+        profit = np.where(valid, (value - invested) / np.where(valid, invested, 1.0) * 100, np.nan)
+        return {"valid": valid, "total_invested": invested, "total_value": value, "profit_percent": profit}
+
+    def ranking(self, start_year: int) -> list:
+        """[(symbol, profit_percent), ...] от лучшего к худшему; кэшируется по году."""
+        cached = self._rankings.get(start_year)
+        if cached is not None:
+            return cached
+        r = self.dca(start_year)
+        order = [i for i in np.argsort(-r["profit_percent"], kind="stable") if r["valid"][i]]
+        ranking = [(self.symbols[i], float(r["profit_percent"][i])) for i in order]
+        with self._lock:
+            self._rankings[start_year] = ranking
+        return ranking
+
+    def compare(self, start_year: int, symbol: str = None):
+        """
+        {"count", "best", "worst", "rank"}: best/worst — (symbol, profit_percent),
+        rank — место symbol (1 — лучший) или None. None, если сравнивать не с чем.
+        """
+        ranking = self.ranking(start_year)
+        if len(ranking) < 2:
+            return None
+        places = {s: i + 1 for i, (s, _) in enumerate(ranking)}
+        return {"count": len(ranking), "best": ranking[0], "worst": ranking[-1], "rank": places.get(symbol)}
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def get_price_matrix() -> PriceMatrix:
+    """Матрица процесса по STOCKS из локального уровня цепочки цен (без сети); пересобирается раз в день."""
+    global _matrix
+    matrix = _matrix
+    if matrix is not None and matrix.built_on == date.today():
+        return matrix
+    with _matrix_lock:
+        if _matrix is None or _matrix.built_on != date.today():
+            from price_store import get_price_provider
+            from utils import STOCKS
+
+            provider = get_price_provider()
+            _matrix = PriceMatrix.build(getattr(provider, "local", None) or provider, list(STOCKS))
+        return _matrix
+
+
+def set_price_matrix(matrix: PriceMatrix):
+    """Подменить матрицу процесса (тесты, бенчмарки). None — построить заново."""
+    global _matrix
+    _matrix = matrix
@@ -0,0 +1,155 @@
+"""
+Векторизованный движок усреднения (DCA) по дневным барам.
+
+Все величины — единицы актива, вложенная сумма, стоимость, CAGR, волатильность
+и Sharpe — считаются операциями над массивами NumPy, без цикла по строкам.
+"""
+import numpy as np
+
+RISK_FREE_RATE = 0.02
+
+# schedule -> (сколько дней трат в одной покупке, покупок в год для аннуализации)
+SCHEDULES = {
+    "daily": (1, 252),
+    "weekly": (7, 52),
+    "monthly": (30, 12),
+}
+
+
+def contribution_points(dates, schedule: str = "monthly") -> np.ndarray:
+    """
+    Индексы баров, в которые делается покупка:
+    daily — каждый бар, weekly — первый бар недели (с понедельника), monthly — первый бар месяца.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Неизвестный график покупок: {schedule}")
+    if schedule == "daily" or len(dates) == 0:
+        return np.arange(len(dates))
+    days = dates.astype("datetime64[D]").astype(np.int64)
+    if schedule == "weekly":
+        key = (days + 3) // 7  # 1970-01-01 — четверг; сдвиг делает неделю с понедельника
+    else:
+        key = dates.astype("datetime64[M]").astype(np.int64)
+    return np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+
+
+def contributions(dates, points: np.ndarray, daily_spend: float, schedule: str = "monthly") -> np.ndarray:
+    """
+    Сумма каждой покупки. Для weekly/monthly — фиксированные 7/30 дней трат,
+    для daily — траты за календарные дни с прошлого бара (выходные переносятся на понедельник).
+    """
+    if schedule == "daily":
+        days = dates[points].astype("datetime64[D]").astype(np.int64)
+        return daily_spend * np.diff(days, prepend=days[:1] - 1).astype(np.float64)
+    return np.full(len(points), daily_spend * SCHEDULES[schedule][0], dtype=np.float64)
+
+
+def simulate(dates, close, daily_spend: float, months: int, schedule: str = "monthly", fx=None) -> dict:
+    """
+    Смоделировать регулярные покупки по ряду (dates, close).
+    months — длительность периода в месяцах (для CAGR, как в calculate_investment).
+    fx — курс валюты трат за 1 USD на каждый бар: каждая покупка конвертируется по курсу
+    своего дня, итоговая стоимость — по последнему курсу. Суммы тогда в валюте трат.
+    """
+    points = contribution_points(dates, schedule)
+    if len(points) == 0:
+        raise ValueError("Нет данных по активу")
+    prices = np.asarray(close[points], dtype=np.float64)
+    current_price = float(close[-1])
+    final_price = current_price
+    if fx is not None:
+        # цена актива в валюте трат на дату покупки и на сегодня
+        prices = prices * fx[points]
+        final_price = current_price * float(fx[-1])
+    amounts = contributions(dates, points, daily_spend, schedule)
+
+    total_units = float(np.sum(amounts / prices))
+    total_invested = float(np.sum(amounts))
+    total_value = total_units * final_price
+
+    years = months / 12
+    cagr = (total_value / total_invested) ** (1 / years) - 1 if total_invested > 0 else 0
+    returns = prices / prices[0] - 1
+    volatility = float(np.std(returns)) * np.sqrt(SCHEDULES[schedule][1]) if len(returns) > 1 else 0
+    sharpe_ratio = (cagr - RISK_FREE_RATE) / volatility if volatility > 0 else 0
+    profit_percent = ((total_value - total_invested) / total_invested * 100) if total_invested > 0 else 0
+
+    return {
+        "months": months,
+        "total_invested": total_invested,
+        "total_units": total_units,
+        "current_price": current_price,
+        "total_value": total_value,
+        "profit_percent": profit_percent,
+        "cagr": cagr * 100,
+        "volatility": volatility * 100,
+        "sharpe_ratio": sharpe_ratio,
+        "fallback": False,
+    }
+
+
+def simulate_many(dates, close, starts, months, schedule: str = "monthly", fx=None) -> dict:
+    """
+    simulate() для многих дат начала по одному ряду за один проход, при daily_spend = 1
+    (суммы линейны по daily_spend). starts — массив дат начала, months — длительность для каждой.
+    Суммы по покупкам берутся из суффиксных сумм, поэтому стоимость не зависит от числа дат начала.
+    Возвращает массивы по starts; valid=False там, где после даты начала нет баров.
+    """
+    dates = np.asarray(dates)
+    close = np.asarray(close, dtype=np.float64)
+    starts = np.asarray(starts, dtype="datetime64[D]")
+    months = np.asarray(months, dtype=np.float64)
+    n = len(starts)
+    if not len(dates):
+        nan = np.full(n, np.nan)
+        return {"valid": np.zeros(n, dtype=bool), "total_invested": nan, "total_units": nan, "total_value": nan,
+                "current_price": nan, "profit_percent": nan, "cagr": nan, "volatility": nan, "sharpe_ratio": nan}
+    lo = np.searchsorted(dates, starts, side="left")
+    valid = lo < len(dates)
+    first = np.minimum(lo, len(dates) - 1)
+
+    prices = close * fx if fx is not None else close
+    final_price = float(close[-1]) * (float(fx[-1]) if fx is not None else 1.0)
+    points = contribution_points(dates, schedule)
+    amounts = contributions(dates, points, 1.0, schedule)
+    p = prices[points]
+
+    def suffix(values):
+        return np.r_[np.cumsum(values[::-1])[::-1], 0.0]
+
+    s_units, s_amounts = suffix(amounts / p), suffix(amounts)
+    s_p, s_p2, s_count = suffix(p), suffix(p * p), suffix(np.ones(len(p)))
+
+    # Первый бар после даты начала — всегда покупка; её сумма как у первой покупки в simulate()
+    k = np.searchsorted(points, first, side="left")
+    k = np.where((k < len(points)) & (points[np.minimum(k, len(points) - 1)] == first), k + 1, k)
+    first_amount = 1.0 if schedule == "daily" else float(SCHEDULES[schedule][0])
+    p0 = prices[first]
+
+    total_units = first_amount / p0 + s_units[k]
+    total_invested = first_amount + s_amounts[k]
+    total_value = total_units * final_price
+    count = 1 + s_count[k]
+    mean = (p0 + s_p[k]) / count
+    variance = np.maximum((p0 * p0 + s_p2[k]) / count - mean * mean, 0)
+    volatility = np.where(count > 1, np.sqrt(variance) / p0 * np.sqrt(SCHEDULES[schedule][1]), 0.0)
+
+    years = months / 12
+    cagr = (total_value / total_invested) ** (1 / years) - 1
+    sharpe_ratio = np.where(volatility > 0, (cagr - RISK_FREE_RATE) / np.where(volatility > 0, volatility, 1), 0.0)
+    profit_percent = (total_value - total_invested) / total_invested * 100
+
+    def masked(values):
+        return np.where(valid, values, np.nan)
+
+    return {
+        "valid": valid,
+        "total_invested": masked(total_invested),
+        "total_units": masked(total_units),
+        "total_value": masked(total_value),
+        "current_price": masked(np.full(n, float(close[-1]))),
+        "profit_percent": masked(profit_percent),
+        "cagr": masked(cagr * 100),
+        "volatility": masked(volatility * 100),
+        "sharpe_ratio": masked(sharpe_ratio),
+    }
@@ -0,0 +1,138 @@
+"""
+Локальные курсы валют для пересчёта взносов.
+
+Курс каждой валюты хранится как дневной ряд "единиц валюты за 1 USD" в том же
+колоночном формате, что и цены (LocalPriceStore, каталог data/fx). Ряд
+дополняется инкрементально: скачиваются только бары после последнего сохранённого.
+
+Курс на дату покупки берётся векторно (as-of join через searchsorted): последний
+известный курс на эту дату или раньше. Ряды начинаются с DEFAULT_FX_START: если первая
+покупка раньше начала ряда (covers), пересчёт не делается и расчёт идёт как в USD.
+
+    python fx.py            # обновить курсы для main.CURRENCIES
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+
+from price_store import DEFAULT_STORE_DIR, LocalPriceStore, YFinancePriceProvider
+
+BASE_CURRENCY = "USD"
+DEFAULT_FX_DIR = os.getenv("FX_STORE_DIR", os.path.join(os.path.dirname(DEFAULT_STORE_DIR), "fx"))
+DEFAULT_FX_START = "2000-01-01"
+# Ряд считается покрывающим дату, если начинается не позже чем через столько дней (выходные, праздники)
+COVERAGE_SLACK_DAYS = 7
+
+
+def fx_symbol(currency: str) -> str:
+    """Тикер yfinance с курсом currency за 1 USD."""
+    return f"{BASE_CURRENCY}{currency}=X"
+
+
+class FxRates:
+    """Курсы валют к USD из локального хранилища."""
+
+    def __init__(self, store: LocalPriceStore = None):
+        self.store = store or LocalPriceStore(DEFAULT_FX_DIR)
+
+    def series(self, currency: str):
+        """Ряд курса или None, если валюта не USD и курсов по ней нет."""
+        try:
+            series = self.store.load(currency)
+        except KeyError:
+            return None
+        return None if series.empty else series
+
+    def has(self, currency: str) -> bool:
+        return currency == BASE_CURRENCY or self.series(currency) is not None
+
+    def coverage(self, currency: str):
+        """(первая, последняя) дата ряда курса; None для USD и валют без курсов."""
+        series = None if currency == BASE_CURRENCY else self.series(currency)
+        return None if series is None else (series.dates[0], series.dates[-1])
+
+    def covers(self, currency: str, since) -> bool:
+        """Есть ли курс currency на каждую дату начиная с since (для USD — всегда); since — дата или массив дат."""
+        since = np.asarray(since, dtype="datetime64[D]")
+        if currency == BASE_CURRENCY:
+            return np.ones(since.shape, dtype=bool) if since.ndim else True
+        coverage = self.coverage(currency)
+        if coverage is None:
+            return np.zeros(since.shape, dtype=bool) if since.ndim else False
+        return coverage[0] <= since + COVERAGE_SLACK_DAYS
+
+    def rates(self, currency: str, dates) -> np.ndarray:
+        """
+        Курс currency за 1 USD на каждую дату из dates; None, если курсов нет.
+        Датам до начала ряда достаётся первый курс: покрыт ли диапазон, проверяет covers.
+        """
+        if currency == BASE_CURRENCY:
+            return np.ones(len(dates), dtype=np.float64)
+        series = self.series(currency)
+        if series is None:
+            return None
+        idx = np.searchsorted(series.dates, np.asarray(dates, dtype="datetime64[D]"), side="right") - 1
+        return np.asarray(series.close, dtype=np.float64)[np.clip(idx, 0, None)]
+
+
+def refresh_fx(currencies, source=None, store: LocalPriceStore = None, start=DEFAULT_FX_START) -> dict:
+    """
+    Дописать в хранилище новые бары курсов. Возвращает {currency: число новых баров}.
+    Для валюты без сохранённого ряда скачивается история с start.
+    """
+    source = source or YFinancePriceProvider()
+    store = store or LocalPriceStore(DEFAULT_FX_DIR)
+    added = {}
+    for currency in currencies:
+        if currency == BASE_CURRENCY:
+            continue
+        try:
+            current = store.load(currency)
+        except KeyError:
+            current = None
+        since = start if current is None or current.empty else current.dates[-1] + np.timedelta64(1, "D")
+        fresh = source.history(fx_symbol(currency), start=since)
+        if current is not None and not current.empty:
+            keep = fresh.dates > current.dates[-1]
+            fresh_dates, fresh_close = fresh.dates[keep], fresh.close[keep]
+        else:
+            fresh_dates, fresh_close = fresh.dates, fresh.close
+        valid = np.isfinite(fresh_close) & (fresh_close > 0)
+        fresh_dates, fresh_close = fresh_dates[valid], fresh_close[valid]
+        added[currency] = len(fresh_dates)
+        if not len(fresh_dates):
+            continue
+        if current is not None:
+            fresh_dates = np.concatenate([current.dates, fresh_dates])
+            fresh_close = np.concatenate([current.close, fresh_close])
+        store.write(currency, fresh_dates, fresh_close)
+    return added
+
+
+_rates = None
+_rates_lock = threading.Lock()
+
+
+def get_fx_rates() -> FxRates:
+    """Курсы процесса (по умолчанию — локальное хранилище data/fx)."""
+    global _rates
+    if _rates is None:
+        with _rates_lock:
+            if _rates is None:
+                _rates = FxRates()
+    return _rates
+
+
+def set_fx_rates(rates: FxRates):
+    """Подменить курсы (тесты, бенчмарки); None — вернуть хранилище по умолчанию."""
+    global _rates
+    _rates = rates
+
+
+if __name__ == "__main__":
+    from main import CURRENCIES
+
+    for currency, bars in refresh_fx(sys.argv[1:] or CURRENCIES).items():
+        print(f"{currency}: +{bars} bars")
@@ -0,0 +1,185 @@
+"""
+Материализованная таблица роста по (symbol, start_year).
+
+total_value и total_invested линейны по daily_spend, а процентные метрики от него
+не зависят. Поэтому таблица хранит результат для daily_spend = 1, и любой расчёт
+сводится к одному умножению — без загрузки истории.
+
+Таблица пересобирается по расписанию (`python growth_table.py`, например по cron
+после обновления цен) и действительна в течение месяца сборки.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from dca import simulate
+from price_store import DEFAULT_STORE_DIR, get_price_provider
+
+DEFAULT_TABLE_DIR = os.getenv("GROWTH_TABLE_DIR", os.path.dirname(DEFAULT_STORE_DIR))
+FIRST_YEAR = 1970
+
+ROW_DTYPE = np.dtype([
+    ("symbol", "U12"),
+    ("year", np.int16),
+    ("months", np.int32),
+    ("invested_per_unit", np.float64),
+    ("units_per_unit", np.float64),
+    ("value_per_unit", np.float64),
+    ("current_price", np.float64),
+    ("profit_percent", np.float64),
+    ("cagr", np.float64),
+    ("volatility", np.float64),
+    ("sharpe_ratio", np.float64),
+])
+
+
+def _months(start_year: int, today: date) -> int:
+    return (today.year - start_year) * 12 + today.month
+
+
+class GrowthTable:
+    """Строки ROW_DTYPE + месяц сборки. Поиск по (symbol, year) — словарь в памяти."""
+
+    def __init__(self, rows: np.ndarray, built_at: date, schedule: str = "monthly"):
+        self.rows = rows
+        self.built_at = built_at
+        self.schedule = schedule
+        self._pos = {(str(r["symbol"]), int(r["year"])): i for i, r in enumerate(rows)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def is_current(self, today: date = None) -> bool:
+        today = today or date.today()
+        return (self.built_at.year, self.built_at.month) == (today.year, today.month)
+
+    def lookup(self, symbol: str, start_year: int, daily_spend: float) -> dict:
+        """Результат в формате calculate_investment или None, если строки нет или таблица устарела."""
+        i = self._pos.get((symbol, start_year))
+        if i is None or not self.is_current():
+            return None
+        row = self.rows[i]
+        return {
+            "months": int(row["months"]),
+            "total_invested": float(row["invested_per_unit"]) * daily_spend,
+            "total_units": float(row["units_per_unit"]) * daily_spend,
+            "current_price": float(row["current_price"]),
+            "total_value": float(row["value_per_unit"]) * daily_spend,
+            "profit_percent": float(row["profit_percent"]),
+            "cagr": float(row["cagr"]),
+            "volatility": float(row["volatility"]),
+            "sharpe_ratio": float(row["sharpe_ratio"]),
+            "fallback": False,
+            "fx_adjusted": True,  # строки посчитаны в USD
+            "freshness": "local",
+        }
+
+    @staticmethod
+    def symbol_rows(series, years, today: date, schedule: str = "monthly") -> list:
+        """Строки таблицы для одного символа по списку лет начала."""
+        rows = []
+        end = np.datetime64(today, "D")
+        for year in years:
+            part = series.between(f"{year}-01-01", end)
+            if part.empty:
+                continue
+            months = _months(year, today)
+            r = simulate(part.dates, part.close, 1.0, months, schedule)
+            rows.append((
+                series.symbol, year, months, r["total_invested"], r["total_units"], r["total_value"],
+                r["current_price"], r["profit_percent"], r["cagr"], r["volatility"], r["sharpe_ratio"],
+            ))
+        return rows
+
+    @classmethod
+    def build(cls, symbols, provider=None, schedule: str = "monthly", today: date = None) -> "GrowthTable":
+        provider = provider or get_price_provider()
+        today = today or date.today()
+        years = range(FIRST_YEAR, today.year + 1)
+        rows = []
+        for symbol in symbols:
+            try:
+                series = provider.history(symbol)
+            except KeyError:
+                continue
+            rows.extend(cls.symbol_rows(series, years, today, schedule))
+        return cls(np.array(rows, dtype=ROW_DTYPE), today, schedule)
+
+    @staticmethod
+    def paths(directory: str = DEFAULT_TABLE_DIR, schedule: str = "monthly"):
+        base = os.path.join(directory, f"growth_table.{schedule}")
+        return base + ".npy", base + ".json"
+
+    def save(self, directory: str = DEFAULT_TABLE_DIR):
+        """Атомарно сохранить таблицу (метаданные пишутся последними)."""
+        os.makedirs(directory, exist_ok=True)
+        rows_path, meta_path = self.paths(directory, self.schedule)
+        tmp = f"{rows_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, self.rows)
+        os.replace(tmp, rows_path)
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"built_at": self.built_at.isoformat(), "schedule": self.schedule, "rows": len(self.rows)}, f)
+        os.replace(tmp, meta_path)
+
+    @classmethod
+    def load(cls, directory: str = DEFAULT_TABLE_DIR, schedule: str = "monthly") -> "GrowthTable":
+        rows_path, meta_path = cls.paths(directory, schedule)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(np.load(rows_path, mmap_mode="r"), date.fromisoformat(meta["built_at"]), schedule)
+
+
+def rebuild_table(symbols, provider=None, schedule: str = "monthly", directory: str = DEFAULT_TABLE_DIR):
+    """Пересобрать и сохранить таблицу. Запускается по расписанию, вне пути запроса."""
+    table = GrowthTable.build(symbols, provider, schedule)
+    table.save(directory)
+    return table
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+RELOAD_INTERVAL = 30.0
+
+
+def get_growth_table(schedule: str = "monthly", directory: str = DEFAULT_TABLE_DIR) -> GrowthTable:
+    """
+    Таблица процесса для графика покупок. Перечитывается при изменении файла
+    (проверка не чаще RELOAD_INTERVAL). None, если таблица ещё не собрана.
+    """
+    now = time.monotonic()
+    cached = _tables.get(schedule)
+    if cached is not None and now - cached[2] < RELOAD_INTERVAL:
+        return cached[0]
+    with _tables_lock:
+        meta_path = GrowthTable.paths(directory, schedule)[1]
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            _tables[schedule] = (None, None, now)
+            return None
+        if cached is None or cached[1] != mtime:
+            cached = (GrowthTable.load(directory, schedule), mtime, now)
+        _tables[schedule] = (cached[0], cached[1], now)
+        return cached[0]
+
+
+def set_growth_table(table: GrowthTable, schedule: str = "monthly"):
+    """Подменить таблицу процесса (тесты, бенчмарки). None — снова читать файл."""
+    if table is None:
+        _tables.pop(schedule, None)
+    else:
+        _tables[schedule] = (table, None, float("inf"))
+
+
+if __name__ == "__main__":
+    from utils import STOCKS
+
+    table = rebuild_table(sys.argv[1:] or list(STOCKS))
+    print(f"{len(table)} rows, built at {datetime.now():%Y-%m-%d %H:%M}")
@@ -0,0 +1,51 @@
+"""
+Gunicorn config: gunicorn wsgi:app -c gunicorn.conf.py
+
+With preload (default) the app is imported and warmed up once in the master
+before fork, so workers share modules and price data copy-on-write.
+Without preload each worker warms up itself before accepting requests.
+"""
+import os
+import shutil
+import tempfile
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+# Dialog sessions in memory:// live in one worker: a second worker would see half of every dialog
+shared_sessions = not os.getenv("SESSION_STORE_URL", "memory://").startswith("memory://")
+workers = int(os.getenv("GUNICORN_WORKERS", "2" if shared_sessions else "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Per-worker metric snapshots are summed by /metrics; set before the app (and metrics.py) is imported
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "fun-investor-metrics"))
+
+
+def on_starting(server):
+    if workers > 1 and not shared_sessions:
+        server.log.error(
+            f"GUNICORN_WORKERS={workers} with the in-process session store: consecutive dialog turns land on "
+            "different workers and sessions are lost. Set SESSION_STORE_URL to sqlite:/// or redis://"
+        )
+    if workers > 1:
+        # idempotency.py keeps delivered responses per process
+        server.log.warning(f"{workers} workers: a webhook retry routed to another worker is not deduplicated")
+    # Drop snapshots left by a previous master so counters start from zero
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+def when_ready(server):
+    # Runs in the master before workers are forked
+    if server.cfg.preload_app:
+        import warmup
+
+        warmup.warmup()
+
+
+def post_worker_init(worker):
+    # No-op when the master already warmed up; the worker accepts requests only after this returns
+    import profiler
+    import warmup
+
+    warmup.warmup()
+    # gunicorn resets worker signal handlers on init; kill -USR2 <worker pid> starts a capture
+    profiler.install_signal_handler()
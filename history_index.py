@@ -0,0 +1,129 @@
+"""
+Индекс доступности истории: первая и последняя дата бара по каждому символу.
+
+Индекс обновляется вне пути запроса (`python history_index.py`, например по cron
+после обновления хранилища цен), а выбор символа по году — это поиск в памяти.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from price_store import DEFAULT_STORE_DIR, get_price_provider
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "HISTORY_INDEX_PATH",
+    os.path.join(os.path.dirname(DEFAULT_STORE_DIR), "history_index.json"),
+)
+RECENT_DAYS = 31  # аналог period="1mo" в yfinance
+
+
+class HistoryIndex:
+    """{symbol: (first_bar, last_bar)} + дата обновления индекса."""
+
+    def __init__(self, entries: dict, refreshed_at: date = None):
+        self.entries = entries
+        self.refreshed_at = refreshed_at or date.today()
+
+    def symbols_since(self, start_year: int, symbols=None) -> list:
+        """
+        Символы, у которых есть бары начиная с 1 января start_year
+        (то же условие, что непустой ticker.history(start=...)).
+        """
+        start = date(start_year, 1, 1)
+        symbols = self.entries if symbols is None else symbols
+        return [s for s in symbols if s in self.entries and self.entries[s][1] >= start]
+
+    def recent_symbols(self, symbols=None) -> list:
+        """Символы с барами за последний месяц до обновления индекса."""
+        since = self.refreshed_at - timedelta(days=RECENT_DAYS)
+        symbols = self.entries if symbols is None else symbols
+        return [s for s in symbols if s in self.entries and self.entries[s][1] >= since]
+
+    @classmethod
+    def build(cls, provider=None, symbols=None) -> "HistoryIndex":
+        provider = provider or get_price_provider()
+        entries = {}
+        for symbol in symbols if symbols is not None else provider.symbols():
+            try:
+                series = provider.history(symbol)
+            except Exception:
+                continue
+            if series.empty:
+                continue
+            entries[symbol] = (series.dates[0].item(), series.dates[-1].item())
+        return cls(entries)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH) -> "HistoryIndex":
+        with open(path, encoding="utf-8") as f:
+            raw = json.load(f)
+        entries = {
+            symbol: (date.fromisoformat(first), date.fromisoformat(last))
+            for symbol, (first, last) in raw["symbols"].items()
+        }
+        return cls(entries, date.fromisoformat(raw["refreshed_at"]))
+
+    def save(self, path: str = DEFAULT_INDEX_PATH):
+        """Атомарно сохранить индекс на диск."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        raw = {
+            "refreshed_at": self.refreshed_at.isoformat(),
+            "symbols": {s: [first.isoformat(), last.isoformat()] for s, (first, last) in self.entries.items()},
+        }
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+def refresh_index(provider=None, symbols=None, path: str = DEFAULT_INDEX_PATH) -> HistoryIndex:
+    """Пересобрать индекс и сохранить его. Запускается вне пути запроса."""
+    index = HistoryIndex.build(provider, symbols)
+    index.save(path)
+    return index
+
+
+_index = None
+_index_mtime = None
+_index_checked = 0.0
+_index_lock = threading.Lock()
+RELOAD_INTERVAL = 30.0
+
+
+def get_history_index(path: str = DEFAULT_INDEX_PATH) -> HistoryIndex:
+    """
+    Индекс процесса. Файл перечитывается, если его обновили (проверка не чаще RELOAD_INTERVAL).
+    Если файла нет — индекс строится в памяти из локального хранилища цен.
+    """
+    global _index, _index_mtime, _index_checked
+    now = time.monotonic()
+    if _index is not None and now - _index_checked < RELOAD_INTERVAL:
+        return _index
+    with _index_lock:
+        _index_checked = now
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if _index is None or mtime != _index_mtime:
+            _index = HistoryIndex.load(path) if mtime is not None else HistoryIndex.build()
+            _index_mtime = mtime
+        return _index
+
+
+def set_history_index(index: HistoryIndex):
+    """Подменить индекс процесса (тесты, бенчмарки)."""
+    global _index, _index_mtime, _index_checked
+    _index, _index_mtime, _index_checked = index, None, float("inf")
+
+
+if __name__ == "__main__":
+    from utils import STOCKS
+
+    index = refresh_index(symbols=sys.argv[1:] or list(STOCKS))
+    for symbol, (first, last) in index.entries.items():
+        print(f"{symbol}: {first} — {last}")
+    print(f"refreshed at {datetime.now():%Y-%m-%d %H:%M}")
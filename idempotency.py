@@ -0,0 +1,142 @@
+"""
+Идемпотентная обработка повторных доставок webhook'а.
+
+ManyChat повторяет запрос, если ответ задержался (чаще всего на подтверждении, где
+идёт расчёт). Повтор не должен снова проходить диалог: сессия к этому времени уже
+удалена, и он начал бы диалог заново и пересчитал бы результат.
+
+Ключ доставки — id сообщения или доставки, если ManyChat его передал; иначе
+(user_id, текст) в пределах окна WINDOW секунд. Ответ первой доставки хранится в
+ограниченном кэше с TTL: повтор получает его сразу, а одновременные дубликаты ждут
+доставку, которая ещё обрабатывается. Ошибки не кэшируются — повтор после ошибки
+обрабатывается заново.
+
+Заголовки прокси вроде X-Request-Id (Heroku, Render, nginx) для ключа не годятся: они
+новые у каждого запроса, включая повторы, и отключили бы запасной ключ (user_id, текст).
+
+Кэш живёт в памяти процесса: повтор, попавший в другой воркер, его не увидит. Дедупликация
+работает только с одним воркером (gunicorn.conf.py предупреждает при запуске с несколькими).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+WINDOW = float(os.getenv("IDEMPOTENCY_WINDOW", "30"))
+MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+# где искать id доставки: поля payload'а и заголовки, одинаковые у всех повторов одной доставки
+DELIVERY_FIELDS = (("message", "id"), ("message", "mid"), ("id",), ("event_id",))
+DELIVERY_HEADERS = ("Idempotency-Key", "X-Delivery-Id")
+
+
+def delivery_id(payload: dict, headers=None):
+    """Id доставки из payload'а или заголовков; None, если его нет."""
+    for path in DELIVERY_FIELDS:
+        value = payload
+        for field in path:
+            value = value.get(field) if isinstance(value, dict) else None
+        if value not in (None, ""):
+            return str(value)
+    for header in DELIVERY_HEADERS:
+        value = (headers or {}).get(header)
+        if value:
+            return value
+    return None
+
+
+def delivery_key(endpoint: str, user_id, text: str, delivery: str = None):
+    """(ключ, ttl): по id доставки на TTL, иначе по (user_id, текст) на WINDOW."""
+    if delivery:
+        return (endpoint, str(user_id), "id", delivery), TTL
+    return (endpoint, str(user_id), "text", " ".join(text.split())), WINDOW
+
+
+class _InFlight:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    """LRU ответов по ключу доставки, у каждой записи свой срок жизни."""
+
+    def __init__(self, maxsize: int = MAX_ENTRIES, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = OrderedDict()  # ключ -> (ответ, истекает)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, ttl: float, fn):
+        """Ответ fn() для первой доставки ключа; повторы и дубликаты получают тот же ответ."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self._entries.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="idempotency", result="hit")
+                return entry[0]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+        if not leader:
+            CACHE_REQUESTS.inc(cache="idempotency", result="coalesced")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        CACHE_REQUESTS.inc(cache="idempotency", result="miss")
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            self._put(key, call.result, ttl)
+            return call.result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def _put(self, key, result, ttl: float):
+        with self._lock:
+            now = self.clock()
+            self._entries[key] = (result, now + ttl)
+            self._entries.move_to_end(key)
+            # сначала истёкшие записи с начала очереди, затем самые старые сверх лимита
+            while self._entries:
+                oldest_key, (_, expires) = next(iter(self._entries.items()))
+                if expires > now and len(self._entries) <= self.maxsize:
+                    break
+                del self._entries[oldest_key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def set_response_cache(cache: ResponseCache):
+    """Подменить кэш ответов (тесты); None — создать заново."""
+    global _cache
+    _cache = cache
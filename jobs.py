@@ -0,0 +1,410 @@
+"""
+Фоновые задачи для расчёта на шаге подтверждения.
+
+При ASYNC_CONFIRMATION=1 webhook не считает результат в потоке запроса: он ставит задачу
+в очередь и сразу отвечает коротким подтверждением (id задачи — в поле job_id ответа,
+не в тексте для пользователя). Расчёт идёт в ограниченном пуле процессов (spawn: воркеры
+не наследуют потоки и соединения gunicorn-воркера). Результат приходит POST-запросом на
+JOB_CALLBACK_URL, который и доставляет его в чат; без него режим не включается.
+Статус можно также узнать через GET /jobs/<id>. Если расчёт не удался, сессия
+восстанавливается, и пользователь может подтвердить ещё раз — как в синхронном режиме.
+
+Состояние задач хранится в SQLite (JOBS_DB) и переживает перезапуск: незавершённые
+задачи умершего процесса подхватывают другие воркеры. Владелец задачи — pid и boot id
+процесса (uuid): в контейнере перезапущенный воркер часто получает тот же pid. Владелец
+продлевает аренду (lease_until) своих задач каждые JOB_LEASE/3 секунд; задачу, чей владелец
+умер или не продлил аренду (например, его pid достался новому процессу), забирает
+любой воркер. Завершённые задачи хранятся
+JOB_RETENTION секунд (сутки), затем удаляются — не чаще раза в PURGE_INTERVAL.
+Если в процессе уже JOB_MAX_PENDING незавершённых задач, новая отклоняется (QueueFull):
+лучше попросить пользователя повторить, чем копить очередь дольше таймаута ManyChat.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import SLOW_GAUGE_INTERVAL, Counter, Gauge, Histogram
+
+DEFAULT_JOBS_PATH = os.getenv("JOBS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs.db"))
+MAX_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "50"))
+RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+PURGE_INTERVAL = 300.0
+LEASE = float(os.getenv("JOB_LEASE", "60"))
+CALLBACK_URL = os.getenv("JOB_CALLBACK_URL")
+ENABLED = os.getenv("ASYNC_CONFIRMATION", "0") == "1"
+if ENABLED and not CALLBACK_URL:
+    # Без callback результат никто не доставит в чат: пользователь остался бы без ответа
+    logging.error("ASYNC_CONFIRMATION=1 requires JOB_CALLBACK_URL; the confirmation step stays synchronous")
+    ENABLED = False
+STATES = ("queued", "running", "done", "failed")
+
+JOBS = Counter("jobs_total", "Background jobs per outcome (submitted, done, failed, rejected)", ["outcome"])
+JOB_SECONDS = Histogram("job_seconds", "Time from enqueue to job result", ["outcome"])
+
+
+class QueueFull(RuntimeError):
+    """Слишком много незавершённых задач в процессе."""
+
+
+class Acknowledgement(str):
+    """Текст подтверждения для чата; id задачи — отдельно, для JSON-ответа webhook'а."""
+
+    def __new__(cls, text: str, job_id: str):
+        ack = super().__new__(cls, text)
+        ack.job_id = job_id
+        return ack
+
+
+_boot = (None, None)
+
+
+def boot_id() -> str:
+    """Id этого процесса; после fork — новый, как и pid."""
+    global _boot
+    if _boot[0] != os.getpid():
+        _boot = (os.getpid(), uuid.uuid4().hex)
+    return _boot[1]
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Задачи в SQLite (WAL): состояние, результат, владелец (pid и boot id процесса) и срок его аренды."""
+
+    def __init__(self, path: str = DEFAULT_JOBS_PATH, busy_timeout: float = 5.0, lease: float = LEASE):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.lease = lease
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL, "
+            "result TEXT, error TEXT, callback_url TEXT, owner INTEGER, "
+            "created_at REAL NOT NULL, finished_at REAL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        columns = {row[1] for row in self._conn().execute("PRAGMA table_info(jobs)")}
+        for column in ("owner_boot TEXT", "lease_until REAL"):
+            if column.split()[0] not in columns:
+                self._conn().execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def put(self, job_id: str, user_id, payload: dict, callback_url: str = None):
+        self._conn().execute(
+            "INSERT INTO jobs (id, user_id, payload, state, callback_url, owner, owner_boot, lease_until, created_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, str(user_id), json.dumps(payload, ensure_ascii=False), callback_url, os.getpid(), boot_id(),
+             time.time() + self.lease, time.time()),
+        )
+
+    def set_state(self, job_id: str, state: str, result: str = None, error: str = None):
+        finished = time.time() if state in ("done", "failed") else None
+        self._conn().execute(
+            "UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (state, result, error, finished, job_id),
+        )
+
+    def get(self, job_id: str):
+        row = self._conn().execute(
+            "SELECT id, user_id, payload, state, result, error, callback_url, created_at, finished_at "
+            "FROM jobs WHERE id = ?", (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "user_id", "payload", "state", "result", "error", "callback_url", "created_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def depth(self) -> dict:
+        """{state: число задач} для незавершённых состояний."""
+        rows = self._conn().execute(
+            "SELECT state, COUNT(*) FROM jobs WHERE state IN ('queued', 'running') GROUP BY state"
+        ).fetchall()
+        return {"queued": 0, "running": 0, **dict(rows)}
+
+    def renew(self) -> int:
+        """Продлить аренду незавершённых задач этого процесса."""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE owner = ? AND owner_boot = ? AND state IN ('queued', 'running')",
+            (time.time() + self.lease, os.getpid(), boot_id()),
+        )
+        return cursor.rowcount
+
+    @staticmethod
+    def _abandoned(owner, owner_boot, lease_until, now: float) -> bool:
+        if owner == os.getpid() and owner_boot == boot_id():
+            return False
+        if owner == os.getpid() or not _alive(owner):
+            # свой pid с чужим boot id — прежний процесс с этим pid уже умер
+            return True
+        # pid занят другим процессом или владелец жив: решает аренда
+        return lease_until is None or lease_until < now
+
+    def orphaned(self) -> list:
+        """Незавершённые задачи, чей владелец умер, сменился (тот же pid, другой boot id) или не продлил аренду."""
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT id, owner, owner_boot, lease_until FROM jobs WHERE state IN ('queued', 'running')"
+        ).fetchall()
+        return [row[0] for row in rows if self._abandoned(*row[1:], now)]
+
+    def adopt(self, job_id: str) -> bool:
+        """Забрать брошенную задачу; False, если её уже забрал другой."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, owner_boot, lease_until, state FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            now = time.time()
+            adopted = row is not None and row[3] in ("queued", "running") and self._abandoned(*row[:3], now)
+            if adopted:
+                conn.execute(
+                    "UPDATE jobs SET owner = ?, owner_boot = ?, lease_until = ?, state = 'queued' WHERE id = ?",
+                    (os.getpid(), boot_id(), now + self.lease, job_id),
+                )
+            conn.execute("COMMIT")
+            return adopted
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge(self, older_than: float) -> int:
+        """Удалить завершённые задачи старше older_than секунд."""
+        cursor = self._conn().execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished_at < ?", (time.time() - older_than,)
+        )
+        return cursor.rowcount
+
+
+def compute_final_answer(session: dict) -> str:
+    """Расчёт в процессе пула: тот же финальный ответ, что и в синхронном режиме."""
+    import main
+
+    return main.build_final_answer(session)
+
+
+def restore_session(job: dict):
+    """Вернуть сессию неудавшейся задачи, чтобы пользователь мог подтвердить ещё раз."""
+    import main
+
+    session = job["payload"]
+    main.user_sessions.update(job["user_id"], lambda current: (current or session, None))
+
+
+def _init_worker():
+    import warmup
+
+    warmup.warmup()
+
+
+def post_callback(url: str, job: dict):
+    from clients import HttpClient
+
+    client = _callback_clients.get(url)
+    if client is None:
+        client = _callback_clients[url] = HttpClient(url, timeout=5.0, max_concurrency=2, name="job_callback")
+    client.post_json("", job)
+
+
+_callback_clients = {}
+
+
+class JobRunner:
+    """
+    Отправляет задачи очереди в пул процессов и записывает результат.
+    fn(payload) -> str выполняется в пуле; notify(url, job) вызывается после результата, если задан url;
+    on_failure(job) — после ошибки расчёта (по умолчанию восстанавливает сессию).
+    Завершённые задачи старше retention секунд удаляются после результатов, не чаще раза в purge_interval.
+    """
+
+    def __init__(self, queue: JobQueue, fn=compute_final_answer, max_workers: int = MAX_WORKERS,
+                 max_pending: int = MAX_PENDING, executor=None, notify=post_callback,
+                 callback_url: str = CALLBACK_URL, on_failure=restore_session,
+                 retention: float = RETENTION, purge_interval: float = PURGE_INTERVAL):
+        self.queue = queue
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._purged_at = float("-inf")
+        self.fn = fn
+        self.on_failure = on_failure
+        self.max_pending = max_pending
+        self.notify = notify
+        self.callback_url = callback_url
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+        )
+        self._notifier = ThreadPoolExecutor(max_workers=2, thread_name_prefix="job-callback")
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, payload: dict, callback_url: str = None) -> str:
+        """Поставить задачу и вернуть её id. QueueFull, если незавершённых задач уже max_pending."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                JOBS.inc(outcome="rejected")
+                raise QueueFull(f"В очереди уже {self.pending} задач")
+            self.pending += 1
+        job_id = uuid.uuid4().hex
+        try:
+            self.queue.put(job_id, user_id, payload, callback_url or self.callback_url)
+            self._dispatch(job_id, payload, time.time())
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+        JOBS.inc(outcome="submitted")
+        return job_id
+
+    def _dispatch(self, job_id: str, payload: dict, created_at: float):
+        future = self.executor.submit(self.fn, payload)
+        self.queue.set_state(job_id, "running")
+        future.add_done_callback(lambda f: self._finish(job_id, f, created_at))
+
+    def _finish(self, job_id: str, future, created_at: float):
+        try:
+            error = future.exception()
+            if error is None:
+                self.queue.set_state(job_id, "done", result=future.result())
+                outcome = "done"
+            else:
+                logging.error(f"Job {job_id} failed: {error}")
+                self.queue.set_state(job_id, "failed", error=str(error))
+                outcome = "failed"
+            JOBS.inc(outcome=outcome)
+            JOB_SECONDS.observe(time.time() - created_at, outcome=outcome)
+            job = self.queue.get(job_id)
+            if outcome == "failed" and self.on_failure is not None:
+                try:
+                    self.on_failure(job)
+                except Exception as e:
+                    logging.error(f"Job {job_id}: could not restore the session: {e}")
+            if job["callback_url"] and self.notify is not None:
+                self._notifier.submit(self._deliver, job)
+        finally:
+            with self._lock:
+                self.pending -= 1
+        self.maybe_purge()
+
+    def maybe_purge(self) -> int:
+        """Удалить завершённые задачи старше retention, если с прошлой чистки прошло purge_interval."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._purged_at < self.purge_interval:
+                return 0
+            self._purged_at = now
+        try:
+            return self.queue.purge(self.retention)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not purge finished jobs: {e}")
+            return 0
+
+    def _deliver(self, job: dict):
+        try:
+            self.notify(job["callback_url"], public_view(job))
+        except Exception as e:
+            logging.warning(f"Job {job['id']} callback failed, result stays available by polling: {e}")
+
+    def start_keeper(self):
+        """Фоновый поток: каждые lease/3 секунд продлевает аренду своих задач и подхватывает брошенные."""
+        threading.Thread(target=self._keep, name="job-lease", daemon=True).start()
+
+    def _keep(self):
+        while True:
+            time.sleep(self.queue.lease / 3)
+            try:
+                self.queue.renew()
+                recovered = self.recover()
+                if recovered:
+                    logging.info(f"Recovered {recovered} unfinished jobs")
+            except Exception as e:
+                logging.warning(f"Job lease renewal failed: {e}")
+
+    def recover(self) -> int:
+        """Подхватить брошенные незавершённые задачи. Возвращает число подхваченных."""
+        recovered = 0
+        for job_id in self.queue.orphaned():
+            if not self.queue.adopt(job_id):
+                continue
+            job = self.queue.get(job_id)
+            with self._lock:
+                self.pending += 1
+            self._dispatch(job_id, job["payload"], job["created_at"])
+            recovered += 1
+        return recovered
+
+
+def public_view(job: dict) -> dict:
+    """Поля задачи для GET /jobs/<id> и callback (без payload)."""
+    return {
+        "id": job["id"],
+        "user_id": job["user_id"],
+        "state": job["state"],
+        "text": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """
+    Пул процесса; создаётся при первой задаче (после fork gunicorn) и подхватывает брошенные задачи:
+    сразу и затем в фоне, вместе с продлением аренды своих.
+    """
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                runner = JobRunner(JobQueue())
+                runner.maybe_purge()
+                recovered = runner.recover()
+                if recovered:
+                    logging.info(f"Recovered {recovered} unfinished jobs")
+                runner.start_keeper()
+                _runner = runner
+    return _runner
+
+
+def set_job_runner(runner: JobRunner):
+    """Подменить пул (тесты); None — создать заново при следующей задаче."""
+    global _runner
+    _runner = runner
+
+
+JOBS_PENDING = Gauge(
+    "jobs_pending", "Unfinished jobs submitted by this process", fn=lambda: _runner.pending if _runner else 0
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "Unfinished jobs in the shared queue per state", ["state"],
+    fn=lambda: _runner.queue.depth() if _runner else {}, mode="max", refresh=SLOW_GAUGE_INTERVAL,
+)
@@ -0,0 +1,211 @@
+"""
+Нагрузочный прогон диалогов через WSGI-приложение: запись и воспроизведение трафика.
+
+Источники диалогов:
+- запись продакшена: при заданном WEBHOOK_CAPTURE_PATH /webhook дописывает туда
+  обезличенные сообщения (хэш пользователя, текст без телефонов, почты и ссылок);
+- синтетика: много пользователей проходят диалог с опечатками и неверным вводом.
+
+Воспроизведение идёт через app.test_client() с синтетическим рынком (benchmarks.use_fake_market),
+без LLM и сети. Сообщения одного пользователя отправляются по порядку, пользователи — параллельно
+в concurrency потоков; speedup сжимает записанные паузы (0 — без пауз).
+Отчёт: пропускная способность и p50/p95/p99 по состоянию диалога.
+
+    python loadtest.py --users 500 --concurrency 16                  # синтетика
+    python loadtest.py --input capture.jsonl --concurrency 8 --speedup 20
+    python loadtest.py --users 1000 --save dialogs.jsonl             # только сохранить синтетику
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CAPTURE_PATH = os.getenv("WEBHOOK_CAPTURE_PATH")
+CAPTURE_SALT = os.getenv("WEBHOOK_CAPTURE_SALT", "")
+MAX_TEXT = 200
+
+_SENSITIVE = [
+    (re.compile(r"\S+@\S+"), "<email>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<url>"),
+    (re.compile(r"\+?\d[\d\s()-]{8,}\d"), "<phone>"),
+]
+_capture_lock = threading.Lock()
+
+
+def anonymize(user_id, text: str, message_id=None, ts: float = None) -> dict:
+    """Запись для захвата: хэш пользователя (с солью WEBHOOK_CAPTURE_SALT) и текст без личных данных."""
+    for pattern, mask in _SENSITIVE:
+        text = pattern.sub(mask, text)
+    record = {
+        "t": round(time.time() if ts is None else ts, 3),
+        "user": hashlib.sha256(f"{CAPTURE_SALT}{user_id}".encode()).hexdigest()[:16],
+        "text": text[:MAX_TEXT],
+    }
+    if message_id is not None:
+        record["id"] = hashlib.sha256(f"{CAPTURE_SALT}{message_id}".encode()).hexdigest()[:16]
+    return record
+
+
+def capture(user_id, text: str, message_id=None, path: str = None):
+    """Дописать обезличенное сообщение в файл захвата (одна строка — атомарная запись)."""
+    path = path or CAPTURE_PATH
+    line = json.dumps(anonymize(user_id, text, message_id), ensure_ascii=False) + "\n"
+    with _capture_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def load_records(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+YEARS = ["2005", "2010", "1999", "в 2015 году", "2020", "1985", "двадцатый", "1960", "2001"]
+HABITS = ["кофе", "курю пачку в день", "пиво по пятницам", "сладкое", "фастфуд", "доставка еды", "нет"]
+AMOUNTS = ["300", "500 рублей", "полторы тысячи", "1000", "двести", "-5", "5$"]
+CURRENCY_ANSWERS = ["рубли", "доллары", "евро", "тенге", "в драмах", "USD", "тугрики"]
+CONFIRMS = ["да", "ок", "готов", "давай", "yes"]
+
+
+def synthetic_dialogs(users: int, seed: int = 0, think_time: float = 3.0) -> list:
+    """Записи диалогов users пользователей; паузы между сообщениями ~ think_time секунд."""
+    rng = random.Random(seed)
+    records = []
+    for n in range(users):
+        user = f"synthetic-{n}"
+        t = rng.uniform(0, users * think_time / 10)
+        texts = [rng.choice(YEARS), rng.choice(HABITS), rng.choice(AMOUNTS),
+                 rng.choice(CURRENCY_ANSWERS), rng.choice(CONFIRMS)]
+        for i, text in enumerate(texts):
+            records.append({"t": round(t, 3), "user": user, "id": f"{user}-{i}", "text": text})
+            t += rng.expovariate(1 / think_time)
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Перцентиль по ближайшему рангу."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(samples: dict, errors: int, elapsed: float) -> dict:
+    """samples: состояние -> список длительностей в секундах."""
+    states = {}
+    for state, values in sorted(samples.items()):
+        values = sorted(values)
+        states[state] = {
+            "count": len(values),
+            **{f"p{q}_ms": round(percentile(values, q) * 1000, 3) for q in (50, 95, 99)},
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    total = sum(s["count"] for s in states.values())
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        "states": states,
+    }
+
+
+def replay(records: list, concurrency: int = 8, speedup: float = 0.0, app=None) -> dict:
+    """Воспроизвести записи через WSGI-приложение и вернуть отчёт summarize()."""
+    import main
+
+    app = app or main.app
+    by_user = {}
+    for record in sorted(records, key=lambda r: r.get("t", 0)):
+        by_user.setdefault(record["user"], []).append(record)
+    origin = min((r.get("t", 0) for r in records), default=0)
+
+    samples, errors = {}, [0]
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def run_dialog(user, messages):
+        client = app.test_client()
+        for record in messages:
+            if speedup > 0:
+                delay = (record.get("t", 0) - origin) / speedup - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            session = main.user_sessions.get(user)
+            state = session["state"] if session else "waiting_for_year"
+            message = {"text": record["text"]}
+            if record.get("id"):
+                message["id"] = record["id"]
+            t0 = time.perf_counter()
+            response = client.post("/webhook", json={"message": message, "user": {"id": user}})
+            duration = time.perf_counter() - t0
+            with lock:
+                samples.setdefault(state, []).append(duration)
+                if response.status_code != 200:
+                    errors[0] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(run_dialog, user, messages) for user, messages in by_user.items()]:
+            future.result()
+    return summarize(samples, errors[0], time.perf_counter() - started)
+
+
+def prepare_app():
+    """Синтетический рынок, пустые сессии и кэш ответов, валидация без LLM."""
+    import benchmarks
+    import idempotency
+    import main
+    import validation
+    from session_store import MemorySessionStore
+
+    benchmarks.use_fake_market()
+    main.user_sessions = MemorySessionStore()
+    idempotency.set_response_cache(None)
+    validation.set_validator(validation.Validator())
+    return main.app
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['requests']} requests, {report['errors']} errors in {report['seconds']} s "
+        f"({report['throughput_rps']} req/s)",
+        f"{'state':28} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+    ]
+    for state, s in report["states"].items():
+        lines.append(f"{state:28} {s['count']:7} {s['p50_ms']:9.2f} {s['p95_ms']:9.2f} "
+                     f"{s['p99_ms']:9.2f} {s['max_ms']:9.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", metavar="PATH", help="файл захвата (JSONL); по умолчанию — синтетика")
+    parser.add_argument("--users", type=int, default=200, help="число синтетических пользователей")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=8, help="параллельных диалогов")
+    parser.add_argument("--speedup", type=float, default=0.0, help="ускорение пауз записи; 0 — без пауз")
+    parser.add_argument("--save", metavar="PATH", help="сохранить синтетические диалоги и выйти")
+    parser.add_argument("--json", action="store_true", help="отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.input) if args.input else synthetic_dialogs(args.users, args.seed)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        return 0
+
+    prepare_app()
+    report = replay(records, args.concurrency, args.speedup)
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
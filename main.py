@@ -1,13 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import logging
 from dotenv import load_dotenv
-from utils import get_random_stock, words_to_number, get_stock_info, format_currency
+from utils import get_random_stock, words_to_number, get_stock_info
+from matchers import is_confirmation, match_currency
 from calculator import calculate_investment
-from openai import OpenAI
+from session_store import CompactSessionStore, MemorySessionStore, create_session_store
+import warmup
+import metrics
+import profiler
+import bulk
+import validation
+import idempotency
+import loadtest
+import jobs
+import speculation
+import templates
+from validation import STATE_STAGES
 from datetime import datetime
 import re
+import time
 
 # Load environment variables
 load_dotenv()
@@ -19,108 +32,137 @@ logging.basicConfig(level=logging.INFO)
 app = Flask(__name__)
 CORS(app)
 
-# OpenAI client
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
-
 # Constants
 CURRENCIES = ["RUB", "USD", "EUR", "AMD", "KZT", "UAH", "BYN", "GBP", "CNY"]
-CONFIRM_WORDS = ["да", "готов", "ок", "согласен", "yes", "go"]
 
-# User sessions storage (in production use Redis or database)
-user_sessions = {}
+# User sessions storage: memory:// by default, sqlite:///... or redis://... via SESSION_STORE_URL
+user_sessions = create_session_store()
 
-def generate_final_message(symbol, stock_info, habit, year, daily_spend, currency, total_value, total_invested, missed_profit, profit_percent):
-    """Generate final motivational message"""
-    # Словарь склонений и уникальных фраз для популярных привычек
-    habit_data = {
-        "сигареты": {
-            "habit_acc": "сигареты",
-            "habit_prep": "на сигареты",
-            "joke": "Мог бы дышать полной грудью и купить себе яхту!"
-        },
-        "кофе": {
-            "habit_acc": "кофе",
-            "habit_prep": "на кофе",
-            "joke": "Мог бы открыть свою кофейню!"
-        },
-        "алкоголь": {
-            "habit_acc": "алкоголь",
-            "habit_prep": "на алкоголь",
-            "joke": "Мог бы купить виноградник и пить только своё!"
-        },
-        "девочки": {
-            "habit_acc": "девочек",
-            "habit_prep": "на девочек",
-            "joke": "Мог бы купить себе остров и пригласить всех!"
-        },
-        "фастфуд": {
-            "habit_acc": "фастфуд",
-            "habit_prep": "на фастфуд",
-            "joke": "Мог бы открыть свою бургерную!"
-        },
-        "сладкое": {
-            "habit_acc": "сладкое",
-            "habit_prep": "на сладкое",
-            "joke": "Мог бы построить шоколадную фабрику!"
-        }
-    }
-    
-    h = habit.lower()
-    for key in habit_data:
-        if key in h:
-            hd = habit_data[key]
-            break
-    else:
-        hd = {"habit_acc": habit, "habit_prep": f"на {habit}", "joke": "Мог бы инвестировать с умом!"}
-    
-    # Юмор по году
-    if int(year) < 2000:
-        year_joke = f"С {year} года ты мог бы стать легендой инвестиций!"
-    elif int(year) < 2010:
-        year_joke = f"С {year} года ты бы уже мог купить квартиру!"
-    else:
-        year_joke = f"С {year} года ты мог бы накопить на мечту!"
-    
-    return (
-        f"💡 {symbol} ({stock_info.get('description', symbol)})\n\n"
-        f"🚬 Вместо {hd['habit_acc']} ты мог бы инвестировать {format_currency(daily_spend, currency)} в день в {symbol} с {year} года.\n"
-        f"💰 Сегодня у тебя было бы: {format_currency(total_value, currency)}!\n\n"
-        f"🔥 Вместо того чтобы потратить {format_currency(total_invested, currency)} {hd['habit_prep']}, ты мог бы заработать +{format_currency(missed_profit, currency)}!\n"
-        f"📈 Это целых {profit_percent:.1f}% прибыли!\n\n"
-        f"❗️ Не упусти возможность увеличить свой капитал! {hd['joke']} {year_joke}\n\n"
-        f"🤓 Если хочешь быть умнее, чем ты был в {year} — углубись в инвестиции, следи за моим инстаграмом!\n\n"
-        f"🚨 У тебя есть вредные привычки, которые съедают твои деньги. Пора задуматься!\n\n"
-        f"*Все цифры примерные, расчёт основан только на динамике актива, без учёта валютных колебаний.*"
+# A shared store reports the same count from every worker, a per-process one is summed;
+# counting a shared store is a query, so it runs at most once per SLOW_GAUGE_INTERVAL
+_in_process_sessions = isinstance(user_sessions, (CompactSessionStore, MemorySessionStore))
+SESSIONS_ACTIVE = metrics.Gauge(
+    "sessions_active", "Dialog sessions in the session store", fn=lambda: len(user_sessions),
+    mode="sum" if _in_process_sessions else "max",
+    refresh=0 if _in_process_sessions else metrics.SLOW_GAUGE_INTERVAL,
+)
+# Live sessions and estimated bytes of the in-process store; expired/evicted totals are the
+# session_store_removed_total counter (session_store.py)
+SESSION_STORE_STATS = metrics.Gauge(
+    "session_store", "In-process session store: live sessions and estimated bytes", ["stat"],
+    fn=lambda: session_store_gauges(user_sessions)
+)
+
+def session_store_gauges(store):
+    if not isinstance(store, CompactSessionStore):
+        return {}
+    stats = store.stats()
+    return {"live": stats["live"], "bytes": stats["bytes"]}
+
+def generate_final_message(symbol, stock_info, habit, year, daily_spend, currency, total_value, total_invested, missed_profit, profit_percent, fx_adjusted=False, comparison=None):
+    """Generate final motivational message from the compiled template of (symbol, habit, year band)"""
+    return templates.get_templates().render(
+        symbol, stock_info, habit, year, daily_spend, currency, total_value, total_invested,
+        missed_profit, profit_percent, fx_adjusted, comparison
     )
 
 def process_user_input(user_id, message_text):
     """Process user input and return appropriate response"""
-    if user_id not in user_sessions:
-        user_sessions[user_id] = {"state": "waiting_for_year"}
+    started = time.perf_counter()
+    step = {"state": "waiting_for_year"}
+    
+    # Validate outside the store transaction: an LLM escalation may take a while
+    current = user_sessions.get(user_id)
+    stage = STATE_STAGES.get(current["state"] if current else "waiting_for_year")
+    verdict = validation.get_validator().validate(stage, message_text)
+    
+    def run_step(session):
+        if session is not None:
+            step["state"] = session["state"]
+        # A concurrent message may have moved the dialog on; the verdict is then for another stage
+        same_stage = STATE_STAGES.get(step["state"]) == stage
+        new_session, reply = advance_dialog(session, message_text, verdict if same_stage else None)
+        if step["state"] == "waiting_for_year" and new_session and "year" in new_session:
+            step["year"] = new_session["year"]
+        return new_session, reply
+    
+    try:
+        result = user_sessions.update(user_id, run_step)
+        if isinstance(result, str):
+            # The year is known: pick the stock and calculate in the background while the user answers the rest
+            if speculation.ENABLED and "year" in step:
+                speculation.get_speculator().start(user_sessions, user_id, step["year"])
+            return result
+        
+        if speculation.ENABLED:
+            speculation.get_speculator().cancel(user_id)
+        if jobs.ENABLED and jobs.get_job_runner().callback_url:
+            return enqueue_final_answer(user_id, result)
+        
+        # Confirmation accepted: the session is already removed, calculate outside the store transaction
+        try:
+            return build_final_answer(result)
+        except Exception:
+            # Restore the session so that the user can confirm again
+            user_sessions.update(user_id, lambda session: (session or result, None))
+            raise
+    finally:
+        metrics.DIALOG_SECONDS.observe(time.perf_counter() - started, state=step["state"])
+
+def enqueue_final_answer(user_id, session):
+    """Async confirmation: calculate in the job pool and acknowledge right away; the result goes to the callback"""
+    try:
+        job_id = jobs.get_job_runner().submit(user_id, session)
+    except jobs.QueueFull:
+        # Backpressure: keep the session so that the user can confirm again a bit later
+        user_sessions.update(user_id, lambda current: (current or session, None))
+        return "Сейчас слишком много расчётов одновременно 😅 Напиши 'да' ещё раз через минуту!"
+    return jobs.Acknowledgement("⏳ Считаю, сколько ты мог бы заработать... Результат пришлю через пару секунд!", job_id)
+
+def rejection(verdict, default):
+    """Reply for input the validator rejected: its reason and suggestion, or the default prompt"""
+    reason = verdict.get("reason") or default
+    suggestion = verdict.get("suggestion")
+    return f"{reason}. {suggestion}" if suggestion else reason
+
+def advance_dialog(session, message_text, verdict=None):
+    """
+    One dialog step. Returns (new_session, reply); new_session None removes the session.
+    When the confirmation is accepted the reply is the completed session instead of text.
+    verdict (validation.Validator) may reject the input or supply the value the local parsers missed.
+    """
+    if session is None:
+        session = {"state": "waiting_for_year"}
     
-    session = user_sessions[user_id]
     state = session["state"]
+    verdict = verdict or {}
+    rejected = verdict.get("is_valid") is False
+    value = verdict.get("value") if verdict.get("is_valid") else None
     
     if state == "waiting_for_year":
         year_match = re.search(r"\d{4}", message_text)
-        if year_match:
-            year = int(year_match.group())
+        year = int(year_match.group()) if year_match else None
+        if year is None and isinstance(value, (int, float)):
+            year = int(value)
+        if year is not None and not rejected:
             if 1970 <= year <= datetime.now().year:
                 session["year"] = year
                 session["state"] = "waiting_for_habits"
-                return "Хорошо, спасибо за информацию. Какая вредная привычка у тебя есть?"
+                return session, "Хорошо, спасибо за информацию. Какая вредная привычка у тебя есть?"
         
-        return f"Пожалуйста, укажи год цифрами от 1970 до {datetime.now().year}"
+        prompt = f"Пожалуйста, укажи год цифрами от 1970 до {datetime.now().year}"
+        return session, rejection(verdict, prompt) if rejected else prompt
     
     elif state == "waiting_for_habits":
         habit = message_text.strip().lower()
         if len(habit) < 2 or habit in ["нет", "-"] or habit.isdigit():
-            return "Опиши привычку чуть подробнее!"
+            return session, "Опиши привычку чуть подробнее!"
+        if rejected:
+            return session, rejection(verdict, "Опиши привычку чуть подробнее!")
         
         session["habit"] = habit
         session["state"] = "waiting_for_daily_cost"
-        return "Сколько примерно ты тратишь на эту вредную привычку в день?"
+        return session, "Сколько примерно ты тратишь на эту вредную привычку в день?"
     
     elif state == "waiting_for_daily_cost":
         text = message_text.lower().replace(",", ".")
@@ -134,75 +176,89 @@ def process_user_input(user_id, message_text):
         
         if daily_spend is None:
             daily_spend = words_to_number(text)
+        if daily_spend is None and isinstance(value, (int, float)):
+            daily_spend = float(value)
         
-        if not daily_spend or daily_spend <= 0:
-            return "Пожалуйста, укажи сумму в день (например: 500 или пятьсот)"
+        if not daily_spend or daily_spend <= 0 or rejected:
+            prompt = "Пожалуйста, укажи сумму в день (например: 500 или пятьсот)"
+            return session, rejection(verdict, prompt) if rejected else prompt
         
         session["daily_spend"] = daily_spend
         session["state"] = "waiting_for_currency"
-        return "В какой валюте ты тратишь эти деньги?"
+        return session, "В какой валюте ты тратишь эти деньги?"
     
     elif state == "waiting_for_currency":
         text = message_text.strip().lower()
-        currency_map = {
-            "usd": ["usd", "доллар", "доллары", "dollar", "dollars", "бакс", "баксы"],
-            "eur": ["eur", "евро", "euro"],
-            "rub": ["rub", "рубль", "руб", "рубли", "ruble", "rubles"],
-            "amd": ["amd", "драм", "dram"],
-            "kzt": ["kzt", "тенге", "tenge"],
-            "uah": ["uah", "гривна", "гривны", "hryvnia"],
-            "byn": ["byn", "белрубль", "бел.рубль", "белорусский рубль", "byrub", "byr"],
-            "gbp": ["gbp", "фунт", "фунты", "pound", "pounds"],
-            "cny": ["cny", "юань", "yuan"]
-        }
-        
-        currency_code = None
-        for code, synonyms in currency_map.items():
-            if any(s in text for s in synonyms):
-                currency_code = code.upper()
-                break
+        currency_code = match_currency(text)
+        if currency_code is None and str(value).upper() in CURRENCIES:
+            currency_code = str(value).upper()
         
         if not currency_code:
-            return "Пожалуйста, выбери валюту из списка: USD, EUR, RUB, AMD, KZT, UAH, BYN, GBP, CNY"
+            prompt = "Пожалуйста, выбери валюту из списка: USD, EUR, RUB, AMD, KZT, UAH, BYN, GBP, CNY"
+            return session, rejection(verdict, prompt) if rejected else prompt
         
         session["currency"] = currency_code
         monthly = int(session["daily_spend"] * 30)
         session["state"] = "waiting_for_confirmation"
-        return f"Ты тратишь примерно {monthly} {currency_code} в месяц. Готов откладывать такую сумму?"
+        return session, f"Ты тратишь примерно {monthly} {currency_code} в месяц. Готов откладывать такую сумму?"
     
     elif state == "waiting_for_confirmation":
         text = message_text.strip().lower()
-        if not any(word in text for word in CONFIRM_WORDS):
-            return "Если готов — напиши 'да', 'готов', 'ок' или предложи свою сумму!"
-        
-        # Calculate investment
-        year = session["year"]
-        daily_spend = session["daily_spend"]
-        habit = session["habit"]
-        currency = session["currency"]
+        if not is_confirmation(text):
+            return session, "Если готов — напиши 'да', 'готов', 'ок' или предложи свою сумму!"
         
-        symbol = get_random_stock(start_year=year)
-        stock_info = get_stock_info(symbol)
+        # Clear session and hand its data over to the calculation
+        return None, session
+
+def build_final_answer(session):
+    """Pick a stock, calculate the investment and render the final message"""
+    year = session["year"]
+    daily_spend = session["daily_spend"]
+    habit = session["habit"]
+    currency = session["currency"]
+    
+    # A speculative result computed after the year step only needs scaling by daily_spend;
+    # a currency with FX rates is calculated here, for the symbol the speculation already picked
+    speculated = speculation.scale(session)
+    if speculated is not None:
+        symbol, result = speculated
+    else:
+        symbol = speculation.symbol(session) or get_random_stock(start_year=year)
         result = calculate_investment(
             start_year=year,
             daily_spend=daily_spend,
-            symbol=symbol
+            symbol=symbol,
+            currency=currency
         )
-        
-        total_invested = int(result["total_invested"])
-        total_value = int(result["total_value"])
-        missed_profit = int(total_value - total_invested)
-        profit_percent = result["profit_percent"]
-        
-        final_text = generate_final_message(
-            symbol, stock_info, habit, year, daily_spend, currency,
-            total_value, total_invested, missed_profit, profit_percent
-        )
-        
-        # Clear session
-        del user_sessions[user_id]
-        
-        return final_text
+    if speculation.ENABLED:
+        speculation.SPECULATIONS.inc(outcome="used" if speculated is not None else "missed")
+    stock_info = get_stock_info(symbol)
+    
+    total_invested = int(result["total_invested"])
+    total_value = int(result["total_value"])
+    missed_profit = int(total_value - total_invested)
+    profit_percent = result["profit_percent"]
+    
+    # The comparison is an extra: the answer is sent without it if the price matrix is unavailable
+    # or its USD local-tier percentages would contradict the headline (FX-adjusted or another source)
+    try:
+        from cross_section import get_price_matrix
+        matrix = get_price_matrix()
+        comparison = matrix.compare(year, symbol) if matrix.comparable_with(result, currency) else None
+    except Exception as e:
+        logging.warning(f"Cross-section comparison unavailable: {e}")
+        comparison = None
+    
+    return generate_final_message(
+        symbol, stock_info, habit, year, daily_spend, currency,
+        total_value, total_invested, missed_profit, profit_percent,
+        fx_adjusted=result.get("fx_adjusted", False), comparison=comparison
+    )
+
+def process_once(endpoint, user_id, message_text, delivery=None):
+    """Process a delivery once; a retry or a concurrent duplicate gets the first response"""
+    key, ttl = idempotency.delivery_key(endpoint, user_id, message_text, delivery)
+    return idempotency.get_response_cache().run(key, ttl, lambda: process_user_input(user_id, message_text))
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
@@ -218,21 +274,31 @@ def webhook():
         if not user_message or not user_id:
             return jsonify({"error": "Missing message or user ID"}), 400
         
-        # Process the message
-        response_text = process_user_input(user_id, user_message)
+        # Process the message once per delivery: ManyChat retries slow responses
+        delivery = idempotency.delivery_id(data, request.headers)
+        if loadtest.CAPTURE_PATH:
+            # Anonymized traffic capture for load replays (python loadtest.py --input ...)
+            loadtest.capture(user_id, user_message, delivery)
+        response_text = process_once("webhook", user_id, user_message, delivery)
+        metrics.HTTP_REQUESTS.inc(endpoint="webhook", status="200")
         
         # Return response for ManyChat
-        return jsonify({
+        response = {
             "messages": [
                 {
                     "type": "text",
                     "text": response_text
                 }
             ]
-        })
+        }
+        # Async confirmation: the job id for GET /jobs/<id>, kept out of the chat text
+        if getattr(response_text, "job_id", None):
+            response["job_id"] = response_text.job_id
+        return jsonify(response)
         
     except Exception as e:
         logging.error(f"Error processing webhook: {e}")
+        metrics.HTTP_REQUESTS.inc(endpoint="webhook", status="500")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/calculate', methods=['POST'])
@@ -247,23 +313,108 @@ def calculate():
         if not user_id or not message:
             return jsonify({"error": "Missing user_id or message"}), 400
             
-        response_text = process_user_input(user_id, message)
+        delivery = idempotency.delivery_id(data, request.headers)
+        response_text = process_once("calculate", user_id, message, delivery)
         
         response = {
             "text": response_text
         }
+        if getattr(response_text, "job_id", None):
+            response["job_id"] = response_text.job_id
+        metrics.HTTP_REQUESTS.inc(endpoint="calculate", status="200")
         
         return jsonify(response)
         
     except Exception as e:
         logging.error(f"Error in /calculate: {e}")
+        metrics.HTTP_REQUESTS.inc(endpoint="calculate", status="500")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.before_request
+def profile_request_start():
+    # Slow-request profiling samples only the dialog endpoints; a single flag check when it is off
+    if request.endpoint in ("webhook", "calculate"):
+        profiler.get_profiler().request_started(f"{request.method} {request.path}")
+
+@app.teardown_request
+def profile_request_end(exc):
+    profiler.get_profiler().request_finished()
+
+def admin_authorized():
+    """Admin endpoints are disabled unless ADMIN_TOKEN is set"""
+    token = os.environ.get("ADMIN_TOKEN")
+    return bool(token) and request.headers.get("X-Admin-Token") == token
+
+@app.route('/admin/profile', methods=['POST'])
+def start_profile():
+    """
+    Start sampling this worker: ?seconds=N samples every thread,
+    &slower_than_ms=M keeps only /webhook and /calculate requests slower than M.
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        slower_than = request.args.get("slower_than_ms")
+        threshold = float(slower_than) / 1000 if slower_than is not None else None
+    except ValueError:
+        return jsonify({"error": "seconds and slower_than_ms must be numbers"}), 400
+    try:
+        capture = profiler.get_profiler().start(seconds, threshold)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(capture.info()), 202
+
+@app.route('/admin/profile/<capture_id>', methods=['GET'])
+def get_profile(capture_id):
+    """Collapsed stacks of a finished capture (flamegraph.pl / speedscope input)"""
+    if not admin_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    p = profiler.get_profiler()
+    capture = p.captures.get(capture_id)
+    if capture is None:
+        return jsonify({"error": "Unknown capture on this worker"}), 404
+    if not capture.done.is_set():
+        return jsonify(capture.info()), 202
+    return Response(profiler.render(p.stacks(capture)), mimetype="text/plain")
+
+@app.route('/calculate/bulk', methods=['POST'])
+def calculate_bulk():
+    """
+    Bulk preview: NDJSON scenarios in ({"year", "daily_spend", "symbol", "currency", "id"} per line),
+    NDJSON results out in the same order, streamed chunk by chunk
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    metrics.HTTP_REQUESTS.inc(endpoint="bulk", status="200")
+    results = bulk.run_bulk(request.stream)
+    return Response(stream_with_context(bulk.to_ndjson(results)), mimetype="application/x-ndjson")
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll an async confirmation job: queued, running, done (with text) or failed"""
+    job = jobs.get_job_runner().queue.get(job_id) if jobs.ENABLED else None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(jobs.public_view(job))
+
 @app.route('/health', methods=['GET'])
+@app.route('/health/live', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up and serving HTTP"""
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: warmup has finished, the worker can take traffic"""
+    status = warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint, aggregated across workers when METRICS_DIR is set"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/', methods=['GET'])
 def home():
     """Home endpoint"""
@@ -272,10 +423,16 @@ def home():
         "status": "running",
         "endpoints": {
             "webhook": "/webhook (POST)",
-            "health": "/health (GET)"
+            "bulk": "/calculate/bulk (POST, NDJSON)",
+            "jobs": "/jobs/<id> (GET, with ASYNC_CONFIRMATION=1)",
+            "health": "/health (GET)",
+            "readiness": "/health/ready (GET)",
+            "metrics": "/metrics (GET)"
         }
     }), 200
 
 if __name__ == "__main__":
+    warmup.warmup()
+    profiler.install_signal_handler()
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
@@ -0,0 +1,210 @@
+"""
+Скомпилированные разборщики ввода для состояний диалога.
+
+Словари валют, слов подтверждения, привычек и числительных собираются в trie
+один раз при импорте. Сопоставление идёт по токенам, а не по подстрокам:
+"ок" не находится внутри "около", "белорусский рубль" (самое длинное совпадение)
+побеждает "рубль".
+
+Для каждого разборщика есть batch-вариант: одинаковые сообщения разбираются один раз.
+"""
+import re
+
+_TOKEN_RE = re.compile(r"[a-zа-яё]+|\d+(?:[.,]\d+)?")
+_VALUE = object()
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+class PhraseMatcher:
+    """
+    Trie по токенам фраз. prefix=True — токен фразы может быть началом слова во вводе
+    (основа слова: "доллар" находит "долларах"); иначе токен должен совпасть целиком.
+    """
+
+    def __init__(self, phrases: dict, prefix: bool = False):
+        self.prefix = prefix
+        self._root = {}
+        self._min_len = None
+        for phrase, value in phrases.items():
+            self.add(phrase, value)
+
+    def add(self, phrase: str, value):
+        """Добавить фразу; стоимость поиска от числа фраз не зависит."""
+        node = self._root
+        for token in tokenize(phrase):
+            node = node.setdefault(token, {})
+            self._min_len = len(token) if self._min_len is None else min(self._min_len, len(token))
+        node[_VALUE] = value
+
+    def _child(self, node: dict, token: str):
+        child = node.get(token)
+        if child is not None or not self.prefix:
+            return child
+        # самая длинная основа, с которой начинается токен
+        for end in range(len(token) - 1, self._min_len - 1, -1):
+            child = node.get(token[:end])
+            if child is not None:
+                return child
+        return None
+
+    def _match_at(self, tokens: list, i: int):
+        """(значение, длина) самой длинной фразы, начинающейся с токена i."""
+        node, best = self._root, None
+        for j in range(i, len(tokens)):
+            node = self._child(node, tokens[j])
+            if node is None:
+                break
+            if _VALUE in node:
+                best = (node[_VALUE], j - i + 1)
+        return best
+
+    def find(self, text: str, default=None):
+        """Значение самой левой (и среди них самой длинной) фразы во вводе."""
+        tokens = tokenize(text)
+        root = self._root
+        for i, token in enumerate(tokens):
+            if not self.prefix and token not in root:
+                continue
+            match = self._match_at(tokens, i)
+            if match is not None:
+                return match[0]
+        return default
+
+    def find_all(self, text: str) -> list:
+        tokens = tokenize(text)
+        found, i = [], 0
+        while i < len(tokens):
+            match = self._match_at(tokens, i)
+            if match is None:
+                i += 1
+            else:
+                found.append(match[0])
+                i += match[1]
+        return found
+
+    def find_many(self, texts, default=None) -> list:
+        return _batch(lambda text: self.find(text, default), texts)
+
+
+def _batch(fn, texts) -> list:
+    cache = {}
+    results = []
+    for text in texts:
+        if text not in cache:
+            cache[text] = fn(text)
+        results.append(cache[text])
+    return results
+
+
+CURRENCY_SYNONYMS = {
+    "USD": ["usd", "доллар", "dollar", "бакс"],
+    "EUR": ["eur", "евро", "euro"],
+    "RUB": ["rub", "руб", "ruble"],
+    "AMD": ["amd", "драм", "dram"],
+    "KZT": ["kzt", "тенге", "tenge"],
+    "UAH": ["uah", "гривн", "hryvnia"],
+    "BYN": ["byn", "белрубль", "бел руб", "белорус руб", "byrub", "byr"],
+    "GBP": ["gbp", "фунт", "pound"],
+    "CNY": ["cny", "юан", "yuan"],
+}
+
+CURRENCIES = PhraseMatcher(
+    {synonym: code for code, synonyms in CURRENCY_SYNONYMS.items() for synonym in synonyms},
+    prefix=True,
+)
+# Знаки валют не являются токенами — ищутся отдельно, если слова не нашлось
+CURRENCY_SIGNS = {"$": "USD", "€": "EUR", "₽": "RUB", "£": "GBP", "¥": "CNY", "₸": "KZT", "₴": "UAH", "֏": "AMD"}
+
+CONFIRM_WORDS = ["да", "готов", "готова", "ок", "окей", "согласен", "согласна", "yes", "ok", "go"]
+CONFIRM = PhraseMatcher({word: True for word in CONFIRM_WORDS})
+
+# основа слова -> ключ привычки (склонения: "пачка сигарет", "на алкоголе", "сладостях" и т.п.)
+HABIT_STEMS = {
+    "сигарет": "сигареты", "сигар": "сигареты", "курени": "сигареты", "курю": "сигареты",
+    "кофе": "кофе",
+    "алкогол": "алкоголь", "пив": "алкоголь", "водк": "алкоголь",
+    "девочк": "девочки",
+    "фастфуд": "фастфуд", "фаст фуд": "фастфуд", "бургер": "фастфуд",
+    "сладк": "сладкое", "сладост": "сладкое",
+}
+HABITS = PhraseMatcher(HABIT_STEMS, prefix=True)
+
+
+def match_currency(text: str):
+    """Код валюты из CURRENCY_SYNONYMS или None."""
+    code = CURRENCIES.find(text)
+    if code is None:
+        code = next((c for sign, c in CURRENCY_SIGNS.items() if sign in text), None)
+    return code
+
+
+def is_confirmation(text: str) -> bool:
+    return CONFIRM.find(text, False)
+
+
+def match_habit(text: str):
+    return HABITS.find(text)
+
+
+# Числительные: значение складывается, "hundred" умножает, тысяча/миллион закрывают разряд
+_UNITS = {
+    "ноль": 0, "один": 1, "одна": 1, "одно": 1, "одну": 1, "два": 2, "две": 2, "три": 3, "четыре": 4,
+    "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10,
+    "одиннадцать": 11, "двенадцать": 12, "тринадцать": 13, "четырнадцать": 14, "пятнадцать": 15,
+    "шестнадцать": 16, "семнадцать": 17, "восемнадцать": 18, "девятнадцать": 19,
+    "двадцать": 20, "тридцать": 30, "сорок": 40, "пятьдесят": 50, "шестьдесят": 60, "семьдесят": 70,
+    "восемьдесят": 80, "девяносто": 90,
+    "сто": 100, "двести": 200, "триста": 300, "четыреста": 400, "пятьсот": 500, "шестьсот": 600,
+    "семьсот": 700, "восемьсот": 800, "девятьсот": 900,
+    "полтора": 1.5, "полторы": 1.5,
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+_MULTIPLIERS = {"hundred": 100}
+_SCALES = {
+    "тысяча": 1000, "тысячи": 1000, "тысяч": 1000, "тысячу": 1000, "thousand": 1000,
+    "миллион": 1000000, "миллиона": 1000000, "миллионов": 1000000, "million": 1000000,
+}
+
+
+def parse_number_words(text: str):
+    """
+    Число, написанное словами (русский и английский, составные числа:
+    "две тысячи пятьсот", "полторы тысячи", "three hundred twenty"). Возвращает float или None.
+    Цифры перед словом разряда тоже учитываются: "2 тысячи".
+    """
+    total = current = 0
+    seen = False
+    for token in tokenize(text.replace("-", " ")):
+        if token in _UNITS:
+            current += _UNITS[token]
+        elif token in _MULTIPLIERS:
+            current = (current or 1) * _MULTIPLIERS[token]
+        elif token in _SCALES:
+            total += (current or 1) * _SCALES[token]
+            current = 0
+        elif token[0].isdigit():
+            current += float(token.replace(",", "."))
+            continue
+        else:
+            continue
+        seen = True
+    total += current
+    return float(total) if seen and total > 0 else None
+
+
+def parse_number_words_many(texts) -> list:
+    return _batch(parse_number_words, texts)
+
+
+def match_currency_many(texts) -> list:
+    return _batch(match_currency, texts)
+
+
+def is_confirmation_many(texts) -> list:
+    return _batch(is_confirmation, texts)
@@ -0,0 +1,282 @@
+"""
+Метрики: счётчики, гистограммы задержек и gauge в формате Prometheus.
+
+Каждый процесс считает метрики в памяти. Если задан METRICS_DIR, фоновый поток процесса
+раз в FLUSH_INTERVAL секунд (и сам процесс при каждом scrape) сохраняет снимок в
+<METRICS_DIR>/metrics-<pid>.json, а /metrics суммирует снимки всех воркеров. Gauge
+вычисляются при снимке, поэтому потоки запросов их callback'и (COUNT(*), DBSIZE) не вызывают.
+Callback, который ходит во внешнее хранилище, задаётся с refresh=SLOW_GAUGE_INTERVAL: между
+вычислениями снимки берут прошлое значение. Gauge суммируются только по живым процессам.
+
+METRICS_ENABLED=0 отключает сбор: observe/inc сразу возвращаются.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_DIR = os.getenv("METRICS_DIR")
+FLUSH_INTERVAL = 1.0
+SLOW_GAUGE_INTERVAL = float(os.getenv("METRICS_SLOW_GAUGE_INTERVAL", "30"))
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_SEP = "\x1f"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> str:
+        return _SEP.join(str(labels.get(label, "")) for label in self.labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: (list(v) if isinstance(v, list) else v) for k, v in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        REGISTRY.maybe_flush()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels)
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                # счётчики по бакетам (+Inf последний), затем sum и count
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+        REGISTRY.maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Gauge(_Metric):
+    """
+    Gauge, значение которого вычисляется при сборе: fn() -> число или {labels-tuple: число}.
+    mode — как складывать значения воркеров: "sum" (своё у каждого процесса) или "max" (общее значение).
+    refresh — fn вызывается не чаще раза в refresh секунд (0 — при каждом снимке).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=(), fn=None, mode: str = "sum", refresh: float = 0):
+        self.fn = fn
+        self.mode = mode
+        self.refresh = refresh
+        self._refreshed_at = float("-inf")
+        super().__init__(name, help, labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        if self.fn is not None and now - self._refreshed_at >= self.refresh:
+            self._refreshed_at = now
+            try:
+                value = self.fn()
+            except Exception:
+                value = None
+            if isinstance(value, dict):
+                with self._lock:
+                    self._values = {_SEP.join(map(str, k if isinstance(k, tuple) else (k,))): v
+                                    for k, v in value.items()}
+            elif value is not None:
+                self.set(value)
+        return super().snapshot()
+
+    def reset(self):
+        super().reset()
+        self._refreshed_at = float("-inf")
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._flusher_pid = None
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self) -> dict:
+        return {name: m.snapshot() for name, m in self.metrics.items()}
+
+    def maybe_flush(self):
+        """Запустить фоновый сброс снимков в этом процессе (после fork — заново); сам сброс не делает."""
+        if METRICS_DIR and self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._start_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f"Metrics flush failed: {e}")
+
+    def flush(self):
+        """Сохранить снимок процесса для агрегации по воркерам."""
+        if not METRICS_DIR or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        finally:
+            self._flush_lock.release()
+
+    def collect(self) -> dict:
+        """Снимки всех процессов, сложенные вместе."""
+        if not METRICS_DIR:
+            return self.snapshot()
+        self.flush()
+        total = {}
+        for name in os.listdir(METRICS_DIR):
+            if not (name.startswith("metrics-") and name.endswith(".json")):
+                continue
+            pid = int(name[len("metrics-"):-len(".json")])
+            try:
+                with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(pid)
+            for metric_name, values in snapshot.items():
+                metric = self.metrics.get(metric_name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                merged = total.setdefault(metric_name, {})
+                for key, value in values.items():
+                    if isinstance(value, list):
+                        prev = merged.get(key)
+                        merged[key] = value if prev is None else [a + b for a, b in zip(prev, value)]
+                    elif metric.kind == "gauge" and metric.mode == "max":
+                        merged[key] = max(merged.get(key, value), value)
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+        return total
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (version 0.0.4)."""
+        data = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(data.get(name, {}).items()):
+                labels = list(zip(metric.labels, key.split(_SEP))) if metric.labels else []
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), value[:-2]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value[-2]}")
+                    lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry()
+
+DIALOG_SECONDS = Histogram(
+    "dialog_step_seconds", "Time spent in process_user_input per dialog state", ["state"]
+)
+UPSTREAM_SECONDS = Histogram(
+    "upstream_call_seconds", "Outbound call latency per upstream and operation", ["upstream", "op", "outcome"]
+)
+CALCULATION_SECONDS = Histogram(
+    "calculation_seconds", "calculate_investment latency per path", ["path"]
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups per cache and result", ["cache", "result"]
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests per endpoint and status", ["endpoint", "status"]
+)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,121 @@
+"""
+Цепочка источников цен: локальное хранилище -> кэш в памяти -> удалённый провайдер.
+
+Удалённый провайдер (yfinance) вызывается только для символов, которых нет локально,
+и защищён circuit breaker'ом своего upstream (clients.CircuitBreaker): пока breaker
+открыт, запросы к сервису не уходят. Каждая удачная загрузка сохраняется как
+last-known-good снимок (в памяти и на диске) и отдаётся, когда сервис недоступен.
+
+Каждый ответ помечен свежестью данных (FRESHNESS):
+local — локальное хранилище; cache — кэш удалённых данных в пределах TTL;
+live — только что загружено; last_known_good — последний удачный снимок, сервис недоступен.
+"""
+import logging
+import os
+import threading
+import time
+
+from clients import CircuitOpen
+from price_store import DEFAULT_STORE_DIR, LocalPriceStore, PriceProvider, YFinancePriceProvider
+
+FRESHNESS = ("local", "cache", "live", "last_known_good")
+DEFAULT_SNAPSHOT_DIR = os.getenv("PRICE_SNAPSHOT_DIR", os.path.join(os.path.dirname(DEFAULT_STORE_DIR), "snapshots"))
+CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "3600"))
+
+
+class PriceUnavailable(LookupError):
+    """Ни один источник не дал ряд символа."""
+
+
+class TieredPriceProvider(PriceProvider):
+    """
+    history() — ряд из первого источника, который его дал; fetch() — (ряд, свежесть).
+    Полная история удалённого символа загружается один раз и режется по диапазону в памяти.
+    """
+
+    name = "tiered"
+
+    def __init__(self, local: PriceProvider = None, remote: PriceProvider = None,
+                 snapshots: LocalPriceStore = None, cache_ttl: float = CACHE_TTL, clock=time.monotonic):
+        self.local = local
+        self.remote = remote
+        self.snapshots = snapshots
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self._cache = {}  # symbol -> (полный ряд, время загрузки)
+        self._lock = threading.Lock()
+
+    def fetch(self, symbol: str, start=None, end=None):
+        if self.local is not None:
+            try:
+                series = self.local.history(symbol, start, end)
+                if not series.empty:
+                    return series, "local"
+            except KeyError:
+                pass
+
+        cached = self._cache.get(symbol)
+        if cached is not None and self.clock() - cached[1] < self.cache_ttl:
+            return cached[0].between(start, end), "cache"
+
+        error = None
+        if self.remote is not None:
+            try:
+                series = self.remote.history(symbol)
+            except CircuitOpen as e:
+                # сервис уже отключён breaker'ом — сразу к снимку
+                error = e
+            except Exception as e:
+                error = e
+                logging.warning(f"Remote prices for {symbol} unavailable: {e}")
+            else:
+                if not series.empty:
+                    self._remember(symbol, series)
+                    return series.between(start, end), "live"
+
+        snapshot = self._last_known_good(symbol, cached)
+        if snapshot is not None:
+            return snapshot.between(start, end), "last_known_good"
+        raise PriceUnavailable(f"Нет данных по {symbol}" + (f": {error}" if error else ""))
+
+    def history(self, symbol: str, start=None, end=None):
+        try:
+            return self.fetch(symbol, start, end)[0]
+        except PriceUnavailable as e:
+            raise KeyError(str(e))
+
+    def symbols(self) -> list:
+        return self.local.symbols() if self.local is not None else sorted(self._cache)
+
+    def _remember(self, symbol: str, series):
+        with self._lock:
+            self._cache[symbol] = (series, self.clock())
+        if self.snapshots is not None:
+            try:
+                self.snapshots.write(symbol, series.dates, series.close)
+            except OSError as e:
+                logging.warning(f"Price snapshot for {symbol} not saved: {e}")
+
+    def _last_known_good(self, symbol: str, cached):
+        if cached is not None:
+            return cached[0]
+        if self.snapshots is not None:
+            try:
+                return self.snapshots.load(symbol)
+            except KeyError:
+                return None
+        return None
+
+
+def fetch_history(provider: PriceProvider, symbol: str, start=None, end=None):
+    """(ряд, свежесть) от любого провайдера; у простых провайдеров свежесть — их имя."""
+    fetch = getattr(provider, "fetch", None)
+    if fetch is not None:
+        return fetch(symbol, start, end)
+    return provider.history(symbol, start, end), provider.name
+
+
+def create_price_chain() -> TieredPriceProvider:
+    """Цепочка по умолчанию; PRICE_REMOTE_FALLBACK=0 отключает обращения к yfinance."""
+    remote = YFinancePriceProvider() if os.getenv("PRICE_REMOTE_FALLBACK", "1") != "0" else None
+    return TieredPriceProvider(LocalPriceStore(), remote, LocalPriceStore(DEFAULT_SNAPSHOT_DIR))
@@ -0,0 +1,172 @@
+"""
+Инкрементальное обновление локального хранилища цен (вместо build_store с полной загрузкой).
+
+Для каждого символа скачиваются только бары после последней сохранённой даты плюс
+перекрытие из OVERLAP_BARS последних баров. По перекрытию проверяется, не пересчитал
+ли источник историю:
+- цены совпали — новые бары дописываются в конец;
+- совпали с постоянным множителем до некоторой даты (сплит или дивиденд: скорректированные
+  цены всех более ранних баров умножаются на одно число) — сохранённая часть до перекрытия
+  умножается на этот множитель, загружать всю историю не нужно;
+- иначе (нет общих дат, несколько событий в перекрытии) — символ загружается заново целиком.
+
+После обновления производные данные обновляются только для изменившихся символов:
+индекс истории, строки таблицы роста (если таблица этого месяца) и курсы валют.
+
+    python price_refresh.py            # все STOCKS + индекс, таблица роста, курсы
+    python price_refresh.py AAPL MSFT
+"""
+import logging
+import os
+import sys
+from datetime import date
+
+import numpy as np
+
+from price_store import DEFAULT_HISTORY_START, LocalPriceStore, PriceSeries, YFinancePriceProvider
+
+OVERLAP_BARS = int(os.getenv("PRICE_REFRESH_OVERLAP", "10"))
+RTOL = 1e-4  # повторная загрузка скорректированных цен может отличаться в последних знаках
+
+
+def _clean(series: PriceSeries) -> PriceSeries:
+    valid = np.isfinite(series.close) & (series.close > 0)
+    return PriceSeries(series.symbol, series.dates[valid], series.close[valid])
+
+
+def merge(current: PriceSeries, fresh: PriceSeries, rtol: float = RTOL):
+    """
+    (статус, даты, цены) после наложения fresh на хвост current.
+    статус: unchanged, appended, restated или None — перекрытие не объясняется одним множителем.
+    """
+    common, ci, fi = np.intersect1d(current.dates, fresh.dates, assume_unique=True, return_indices=True)
+    if not len(common):
+        return None, None, None
+    ratio = fresh.close[fi] / current.close[ci]
+    same = np.isclose(ratio, 1.0, rtol=rtol)
+    head = current.dates < common[0]
+    if same.all():
+        factor, status = 1.0, "appended"
+    else:
+        # скорректирован префикс: ratio = factor до события, затем 1
+        changed = np.flatnonzero(~same)
+        factor = float(ratio[0])
+        if changed[0] != 0 or not np.allclose(ratio[:changed[-1] + 1], factor, rtol=rtol) \
+                or not same[changed[-1] + 1:].all():
+            return None, None, None
+        status = "restated"
+    tail = fresh.dates >= common[0]
+    dates = np.concatenate([current.dates[head], fresh.dates[tail]])
+    close = np.concatenate([np.asarray(current.close[head], dtype=np.float64) * factor, fresh.close[tail]])
+    if status == "appended" and fresh.dates[-1] <= current.dates[-1]:
+        status = "unchanged"
+    return status, dates, close
+
+
+def refresh_symbol(symbol: str, source, store: LocalPriceStore, overlap: int = OVERLAP_BARS) -> dict:
+    """{"status", "bars", "downloaded"}: статус full, appended, restated, unchanged или empty."""
+    try:
+        current = store.load(symbol)
+    except KeyError:
+        current = None
+    if current is not None and not current.empty:
+        since = current.dates[max(0, len(current) - overlap)]
+        fresh = _clean(source.history(symbol, start=since))
+        status, dates, close = merge(current, fresh)
+        if status == "unchanged":
+            return {"status": status, "bars": len(current), "downloaded": len(fresh)}
+        if status is not None:
+            store.write(symbol, dates, close)
+            return {"status": status, "bars": len(dates), "downloaded": len(fresh)}
+        logging.warning(f"{symbol}: overlap does not match stored prices, downloading full history")
+
+    fresh = _clean(source.history(symbol, start=DEFAULT_HISTORY_START))
+    if fresh.empty:
+        return {"status": "empty", "bars": 0, "downloaded": 0}
+    store.write(symbol, fresh.dates, fresh.close)
+    return {"status": "full", "bars": len(fresh), "downloaded": len(fresh)}
+
+
+def refresh_prices(symbols, source=None, store: LocalPriceStore = None, overlap: int = OVERLAP_BARS) -> dict:
+    """{symbol: результат refresh_symbol}; ошибка одного символа не останавливает остальные."""
+    source = source or YFinancePriceProvider()
+    store = store or LocalPriceStore()
+    report = {}
+    for symbol in symbols:
+        try:
+            report[symbol] = refresh_symbol(symbol, source, store, overlap)
+        except Exception as e:
+            logging.warning(f"Price refresh for {symbol} failed: {e}")
+            report[symbol] = {"status": "failed", "bars": 0, "downloaded": 0, "error": str(e)}
+    return report
+
+
+def changed_symbols(report: dict) -> list:
+    return [s for s, r in report.items() if r["status"] in ("full", "appended", "restated")]
+
+
+def update_history_index(changed, store: LocalPriceStore, path: str = None):
+    """Обновить в индексе истории записи изменившихся символов."""
+    from history_index import DEFAULT_INDEX_PATH, HistoryIndex
+
+    path = path or DEFAULT_INDEX_PATH
+    try:
+        index = HistoryIndex.load(path)
+    except FileNotFoundError:
+        index = HistoryIndex.build(store)
+    for symbol in changed:
+        series = store.load(symbol)
+        index.entries[symbol] = (series.dates[0].item(), series.dates[-1].item())
+    index.refreshed_at = date.today()
+    index.save(path)
+    return index
+
+
+def update_growth_table(changed, store: LocalPriceStore, directory: str = None, schedule: str = "monthly"):
+    """
+    Пересчитать строки таблицы роста изменившихся символов. Таблица прошлого месяца
+    (или её отсутствие) — полная пересборка: длительность периода у всех строк другая.
+    """
+    from growth_table import DEFAULT_TABLE_DIR, FIRST_YEAR, ROW_DTYPE, GrowthTable
+
+    directory = directory or DEFAULT_TABLE_DIR
+    today = date.today()
+    try:
+        table = GrowthTable.load(directory, schedule)
+    except FileNotFoundError:
+        table = None
+    if table is None or not table.is_current(today):
+        table = GrowthTable.build(store.symbols(), store, schedule, today)
+    else:
+        keep = ~np.isin(table.rows["symbol"], list(changed))
+        rows = [tuple(row) for row in table.rows[keep]]
+        years = range(FIRST_YEAR, today.year + 1)
+        for symbol in changed:
+            rows.extend(GrowthTable.symbol_rows(store.load(symbol), years, today, schedule))
+        table = GrowthTable(np.array(rows, dtype=ROW_DTYPE), today, schedule)
+    table.save(directory)
+    return table
+
+
+def refresh_all(symbols, source=None, store: LocalPriceStore = None, currencies=None,
+                index_path: str = None, table_dir: str = None) -> dict:
+    """Цены, затем производные данные изменившихся символов и курсы валют."""
+    store = store or LocalPriceStore()
+    report = refresh_prices(symbols, source, store)
+    changed = changed_symbols(report)
+    if changed:
+        update_history_index(changed, store, index_path)
+        update_growth_table(changed, store, table_dir)
+    if currencies:
+        from fx import refresh_fx
+
+        refresh_fx(currencies)
+    return report
+
+
+if __name__ == "__main__":
+    from main import CURRENCIES
+    from utils import STOCKS
+
+    for symbol, r in refresh_all(sys.argv[1:] or list(STOCKS), currencies=CURRENCIES).items():
+        print(f"{symbol}: {r['status']}, {r['bars']} bars ({r['downloaded']} downloaded)")
@@ -0,0 +1,261 @@
+"""
+Локальное хранилище исторических цен.
+
+Каждый символ хранится в колоночном виде: два .npy файла (даты и цены закрытия),
+которые открываются через mmap. Воркеры gunicorn читают одни и те же страницы
+из page cache ОС, без копирования в память процесса.
+"""
+import os
+import sys
+import threading
+import time
+import zlib
+from datetime import date, datetime
+
+import numpy as np
+
+DEFAULT_STORE_DIR = os.getenv(
+    "PRICE_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prices"),
+)
+DEFAULT_HISTORY_START = "1970-01-01"
+
+
+def to_day(value) -> np.datetime64:
+    """Привести дату/строку/datetime к np.datetime64[D]."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        value = value.isoformat()
+    return np.datetime64(value, "D")
+
+
+class PriceSeries:
+    """Дневной ряд цен закрытия: массив дат (datetime64[D]) и массив цен (float64)."""
+
+    __slots__ = ("symbol", "dates", "close")
+
+    def __init__(self, symbol: str, dates, close):
+        self.symbol = symbol
+        self.dates = dates
+        self.close = close
+
+    def __len__(self):
+        return len(self.close)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.close) == 0
+
+    def between(self, start=None, end=None) -> "PriceSeries":
+        """Срез [start, end) — возвращает view, без копирования данных."""
+        lo = 0 if start is None else int(np.searchsorted(self.dates, to_day(start), side="left"))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, to_day(end), side="left"))
+        return PriceSeries(self.symbol, self.dates[lo:hi], self.close[lo:hi])
+
+    def monthly(self) -> "PriceSeries":
+        """Месячные бары: последняя цена закрытия каждого месяца (как interval='1mo' в yfinance)."""
+        if self.empty:
+            return self
+        months = self.dates.astype("datetime64[M]")
+        last = np.flatnonzero(months[1:] != months[:-1])
+        last = np.append(last, len(months) - 1)
+        return PriceSeries(self.symbol, months[last].astype("datetime64[D]"), self.close[last])
+
+
+class PriceProvider:
+    """Интерфейс источника дневных цен закрытия."""
+
+    name = "base"
+
+    def history(self, symbol: str, start=None, end=None) -> PriceSeries:
+        raise NotImplementedError
+
+    def symbols(self) -> list:
+        return []
+
+
+class LocalPriceStore(PriceProvider):
+    """
+    Хранилище на диске: <dir>/<SYMBOL>.dates.npy и <dir>/<SYMBOL>.close.npy.
+    Файлы перезаписываются атомарно (os.replace), поэтому уже открытые mmap
+    продолжают видеть старую версию, а новые чтения — новую.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str = DEFAULT_STORE_DIR, reload_interval: float = 5.0):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, symbol: str):
+        base = os.path.join(self.directory, symbol)
+        return base + ".dates.npy", base + ".close.npy"
+
+    def _load(self, symbol: str, now: float):
+        dates_path, close_path = self._paths(symbol)
+        mtime = os.stat(close_path).st_mtime_ns
+        series = PriceSeries(
+            symbol,
+            np.load(dates_path, mmap_mode="r"),
+            np.load(close_path, mmap_mode="r"),
+        )
+        self._cache[symbol] = (series, mtime, now)
+        return series
+
+    def load(self, symbol: str) -> PriceSeries:
+        """Полный ряд символа (mmap). KeyError, если символа нет в хранилище."""
+        now = time.monotonic()
+        cached = self._cache.get(symbol)
+        if cached is not None and now - cached[2] < self.reload_interval:
+            return cached[0]
+        with self._lock:
+            try:
+                if cached is not None and os.stat(self._paths(symbol)[1]).st_mtime_ns == cached[1]:
+                    self._cache[symbol] = (cached[0], cached[1], now)
+                    return cached[0]
+                return self._load(symbol, now)
+            except FileNotFoundError:
+                self._cache.pop(symbol, None)
+                raise KeyError(f"Нет данных по {symbol} в локальном хранилище")
+
+    def history(self, symbol: str, start=None, end=None) -> PriceSeries:
+        return self.load(symbol).between(start, end)
+
+    def symbols(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(f[:-len(".close.npy")] for f in os.listdir(self.directory) if f.endswith(".close.npy"))
+
+    def write(self, symbol: str, dates, close):
+        """Атомарно записать ряд символа."""
+        os.makedirs(self.directory, exist_ok=True)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        close = np.asarray(close, dtype=np.float64)
+        order = np.argsort(dates, kind="stable")
+        for path, arr in zip(self._paths(symbol), (dates[order], close[order])):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+        with self._lock:
+            self._cache.pop(symbol, None)
+
+
+class FixturePriceProvider(PriceProvider):
+    """Провайдер на фикстурах в памяти — для офлайн-тестов и бенчмарков."""
+
+    name = "fixture"
+
+    def __init__(self, series: dict):
+        self._series = {
+            symbol: PriceSeries(
+                symbol, np.asarray(s.dates, dtype="datetime64[D]"), np.asarray(s.close, dtype=np.float64)
+            )
+            for symbol, s in series.items()
+        }
+
+    def history(self, symbol: str, start=None, end=None) -> PriceSeries:
+        try:
+            return self._series[symbol].between(start, end)
+        except KeyError:
+            raise KeyError(f"Нет фикстуры для {symbol}")
+
+    def symbols(self) -> list:
+        return sorted(self._series)
+
+    @classmethod
+    def synthetic(cls, symbols, start=DEFAULT_HISTORY_START, end=None, listings: dict = None):
+        """
+        Детерминированные синтетические ряды (геометрическое блуждание по рабочим дням).
+        listings: {symbol: 'YYYY-MM-DD'} — дата начала торгов символа.
+        """
+        end = to_day(end) if end is not None else np.datetime64(date.today(), "D")
+        all_days = np.arange(to_day(start), end, dtype="datetime64[D]")
+        all_days = all_days[np.is_busday(all_days)]
+        series = {}
+        for symbol in symbols:
+            days = all_days
+            if listings and symbol in listings:
+                days = days[days >= to_day(listings[symbol])]
+            rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+            steps = rng.normal(0.0003, 0.015, len(days))
+            series[symbol] = PriceSeries(symbol, days, 10.0 * np.exp(np.cumsum(steps)))
+        return cls(series)
+
+    @classmethod
+    def from_csv(cls, directory: str):
+        """Фикстуры из CSV: <dir>/<SYMBOL>.csv со столбцами Date,Close."""
+        series = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".csv"):
+                continue
+            raw = np.genfromtxt(os.path.join(directory, name), delimiter=",", names=True, dtype=None, encoding="utf-8")
+            symbol = name[:-4]
+            series[symbol] = PriceSeries(symbol, raw["Date"].astype("datetime64[D]"), raw["Close"].astype(np.float64))
+        return cls(series)
+
+
+class YFinancePriceProvider(PriceProvider):
+    """Сетевой провайдер (yfinance). Используется только для наполнения хранилища."""
+
+    name = "yfinance"
+
+    def history(self, symbol: str, start=None, end=None) -> PriceSeries:
+        from clients import get_market_data
+
+        hist = get_market_data().history(
+            symbol,
+            start=str(to_day(start or DEFAULT_HISTORY_START)),
+            end=str(to_day(end)) if end is not None else None,
+            interval="1d",
+        )
+        if hist.empty:
+            return PriceSeries(symbol, np.array([], dtype="datetime64[D]"), np.array([], dtype=np.float64))
+        dates = np.asarray(hist.index.strftime("%Y-%m-%d"), dtype="datetime64[D]")
+        return PriceSeries(symbol, dates, hist["Close"].to_numpy(dtype=np.float64))
+
+
+def build_store(symbols, source: PriceProvider = None, store: LocalPriceStore = None,
+                start=DEFAULT_HISTORY_START) -> dict:
+    """Скачать полную дневную историю символов в локальное хранилище. Возвращает {symbol: число баров}."""
+    source = source or YFinancePriceProvider()
+    store = store or LocalPriceStore()
+    written = {}
+    for symbol in symbols:
+        series = source.history(symbol, start=start)
+        if series.empty:
+            continue
+        store.write(symbol, series.dates, series.close)
+        written[symbol] = len(series)
+    return written
+
+
+_provider = None
+
+
+def get_price_provider() -> PriceProvider:
+    """Провайдер цен для пути запроса (по умолчанию — цепочка price_chain, начиная с локального хранилища)."""
+    global _provider
+    if _provider is None:
+        from price_chain import create_price_chain
+
+        _provider = create_price_chain()
+    return _provider
+
+
+def set_price_provider(provider: PriceProvider):
+    """Подменить провайдер цен (тесты, бенчмарки)."""
+    global _provider
+    _provider = provider
+
+
+if __name__ == "__main__":
+    from utils import STOCKS
+
+    for symbol, bars in build_store(sys.argv[1:] or list(STOCKS)).items():
+        print(f"{symbol}: {bars} bars")
@@ -0,0 +1,181 @@
+"""
+Сэмплирующий профайлер для живых воркеров (без перезапуска).
+
+Два режима, оба включает оператор (admin endpoint или сигнал):
+- capture: N секунд сэмплировать стеки всех потоков процесса;
+- slow requests: N секунд сэмплировать потоки запросов /webhook и /calculate
+  и сохранять стеки только тех запросов, что дольше порога.
+
+Результат — collapsed stacks ("frame;frame;frame count"), которые понимают
+flamegraph.pl, speedscope и inferno. Файлы пишутся в PROFILE_DIR.
+"""
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "fun-investor-profiles"))
+DEFAULT_INTERVAL = 0.005
+MAX_SECONDS = 300
+MAX_CAPTURES = 20
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame, root: str = None) -> str:
+    """Стек кадра от корня к листу в формате collapsed stacks."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    if root:
+        labels.append(root)
+    return ";".join(reversed(labels))
+
+
+def render(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Capture:
+    """Один сеанс профилирования; stacks заполняются фоновым потоком-сэмплером."""
+
+    def __init__(self, kind: str, seconds: float, threshold: float = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.seconds = seconds
+        self.threshold = threshold
+        self.stacks = Counter()
+        self.samples = 0
+        self.requests_kept = 0
+        self.started_at = time.time()
+        self.done = threading.Event()
+        self.path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{self.id}.folded")
+
+    def info(self) -> dict:
+        return {
+            "id": self.id, "kind": self.kind, "seconds": self.seconds, "threshold": self.threshold,
+            "samples": self.samples, "requests_kept": self.requests_kept, "done": self.done.is_set(),
+            "path": self.path, "pid": os.getpid(),
+        }
+
+    def save(self, stacks: Counter):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(render(stacks))
+
+
+class Profiler:
+    """Не больше одного сеанса одновременно на процесс."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.current = None
+        self.captures = {}
+        self._requests = {}  # thread id -> (root, started, Counter)
+        self._lock = threading.Lock()
+
+    @property
+    def slow_mode(self) -> bool:
+        capture = self.current
+        return capture is not None and capture.kind == "slow_requests" and not capture.done.is_set()
+
+    def start(self, seconds: float, threshold: float = None) -> Capture:
+        """Запустить сеанс: threshold=None — все потоки, иначе только запросы дольше threshold секунд."""
+        seconds = min(max(float(seconds), 0.1), MAX_SECONDS)
+        with self._lock:
+            if self.current is not None and not self.current.done.is_set():
+                raise RuntimeError(f"Профилирование уже идёт: {self.current.id}")
+            capture = Capture("capture" if threshold is None else "slow_requests", seconds, threshold)
+            self.current = capture
+            self.captures[capture.id] = capture
+            # результаты хранятся только для последних MAX_CAPTURES сеансов
+            while len(self.captures) > MAX_CAPTURES:
+                del self.captures[next(iter(self.captures))]
+        threading.Thread(target=self._run, args=(capture,), name="profiler", daemon=True).start()
+        return capture
+
+    def _run(self, capture: Capture):
+        me = threading.get_ident()
+        deadline = time.monotonic() + capture.seconds
+        try:
+            while time.monotonic() < deadline:
+                frames = sys._current_frames()
+                if capture.kind == "capture":
+                    for thread_id, frame in frames.items():
+                        if thread_id != me:
+                            capture.stacks[collapse(frame)] += 1
+                else:
+                    with self._lock:
+                        active = list(self._requests.items())
+                    sampled = [(thread_id, entry, collapse(frames[thread_id], entry[0]))
+                               for thread_id, entry in active if thread_id in frames]
+                    # Counter запроса меняется только под замком: request_finished забирает его под ним же
+                    with self._lock:
+                        for thread_id, entry, stack in sampled:
+                            if self._requests.get(thread_id) is entry:
+                                entry[2][stack] += 1
+                capture.samples += 1
+                time.sleep(self.interval)
+        finally:
+            with self._lock:
+                self._requests.clear()
+            try:
+                capture.save(self.stacks(capture))
+            except Exception as e:
+                logging.warning(f"Profile {capture.id} not saved to {capture.path}: {e}")
+            finally:
+                capture.done.set()
+
+    def stacks(self, capture: Capture) -> Counter:
+        """Копия стеков сеанса: request_finished дописывает их из потоков запросов."""
+        with self._lock:
+            return Counter(capture.stacks)
+
+    def request_started(self, root: str):
+        """Вызывается в потоке запроса; в обычном режиме — одна проверка флага."""
+        if self.slow_mode:
+            with self._lock:
+                self._requests[threading.get_ident()] = (root, time.perf_counter(), Counter())
+
+    def request_finished(self):
+        if not self._requests:
+            return
+        with self._lock:
+            entry = self._requests.pop(threading.get_ident(), None)
+            capture = self.current
+        if entry is None or capture is None:
+            return
+        _, started, stacks = entry
+        if time.perf_counter() - started >= capture.threshold:
+            with self._lock:
+                capture.stacks.update(stacks)
+                capture.requests_kept += 1
+
+
+_profiler = Profiler()
+
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+
+def install_signal_handler(signum=signal.SIGUSR2):
+    """kill -USR2 <pid> запускает capture на PROFILE_SIGNAL_SECONDS секунд (только из главного потока)."""
+    seconds = float(os.getenv("PROFILE_SIGNAL_SECONDS", "10"))
+
+    def handler(signo, frame):
+        try:
+            _profiler.start(seconds)
+        except RuntimeError:
+            pass
+
+    signal.signal(signum, handler)
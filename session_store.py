@@ -0,0 +1,367 @@
+"""
+Хранилища диалоговых сессий.
+
+Все бэкенды реализуют один интерфейс с атомарным read-modify-write по user_id:
+    store.update(user_id, fn)  # fn(session | None) -> (new_session | None, result)
+new_session = None удаляет сессию. Сессия — JSON-сериализуемый dict.
+
+memory://          — компактное ограниченное хранилище в процессе (один воркер): TTL простоя,
+                     лимиты числа сессий и байт с вытеснением LRU
+sqlite:///path.db  — SQLite в режиме WAL, общий для всех воркеров на хосте
+redis://host:6379  — Redis (WATCH/MULTI), для нескольких хостов
+
+Во всех бэкендах сессия без обновлений дольше SESSION_TTL секунд истекает.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from enum import IntEnum
+
+from metrics import Counter
+
+# Монотонные итоги для rate(); число живых сессий и байты — gauge session_store в main.py
+SESSIONS_REMOVED = Counter(
+    "session_store_removed_total", "Sessions removed from the in-process store per reason (expired, evicted)",
+    ["reason"],
+)
+
+
+class SessionStore:
+    """Интерфейс хранилища сессий."""
+
+    def get(self, user_id: str) -> dict:
+        raise NotImplementedError
+
+    def update(self, user_id: str, fn):
+        raise NotImplementedError
+
+    def delete(self, user_id: str):
+        self.update(user_id, lambda session: (None, None))
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Сессии в памяти процесса. Не разделяются между воркерами gunicorn."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.RLock()
+
+    def get(self, user_id):
+        session = self._sessions.get(user_id)
+        return dict(session) if session is not None else None
+
+    def update(self, user_id, fn):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            new_session, result = fn(dict(session) if session is not None else None)
+            if new_session is None:
+                self._sessions.pop(user_id, None)
+            else:
+                self._sessions[user_id] = new_session
+            return result
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class DialogState(IntEnum):
+    """Код состояния диалога вместо строки в каждой сессии."""
+
+    waiting_for_year = 0
+    waiting_for_habits = 1
+    waiting_for_daily_cost = 2
+    waiting_for_currency = 3
+    waiting_for_confirmation = 4
+
+
+# поле -> тип, при котором оно хранится в слоте; иначе поле уходит в extra (JSON)
+_SLOT_TYPES = {"year": int, "daily_spend": float, "habit": str, "currency": str}
+_ENTRY_OVERHEAD = 120  # узел OrderedDict и ссылки на него, оценка
+
+
+class _CompactSession:
+    __slots__ = ("state", "year", "daily_spend", "habit", "currency", "extra", "touched", "size")
+
+    @classmethod
+    def pack(cls, session: dict, user_id, now: float) -> "_CompactSession":
+        packed = cls()
+        rest = dict(session)
+        state = rest.pop("state", None)
+        packed.state = DialogState[state] if state in DialogState.__members__ else None
+        if state is not None and packed.state is None:
+            rest["state"] = state
+        for field, kind in _SLOT_TYPES.items():
+            value = rest.get(field)
+            if type(value) is kind:
+                del rest[field]
+            else:
+                value = None
+            setattr(packed, field, value)
+        if packed.currency is not None:
+            packed.currency = sys.intern(packed.currency)
+        packed.extra = json.dumps(rest, ensure_ascii=False).encode() if rest else None
+        packed.touched = now
+        packed.size = (_ENTRY_OVERHEAD + sys.getsizeof(packed) + sys.getsizeof(user_id)
+                       + (sys.getsizeof(packed.habit) if packed.habit is not None else 0)
+                       + (sys.getsizeof(packed.extra) if packed.extra is not None else 0))
+        return packed
+
+    def unpack(self) -> dict:
+        session = json.loads(self.extra) if self.extra is not None else {}
+        if self.state is not None:
+            session["state"] = self.state.name
+        for field in _SLOT_TYPES:
+            value = getattr(self, field)
+            if value is not None:
+                session[field] = value
+        return session
+
+
+class CompactSessionStore(SessionStore):
+    """
+    Сессии в памяти процесса в компактном виде (слоты, код состояния, числа вместо строк).
+    Сессия без обращений дольше ttl секунд истекает. При превышении max_entries или
+    max_bytes вытесняются давно не использованные сессии (LRU). Истёкшие удаляются
+    понемногу при каждом обращении (не больше sweep_batch за раз), без полного прохода.
+    """
+
+    def __init__(self, ttl: float = 24 * 60 * 60, max_entries: int = 100000, max_bytes: int = 64 * 1024 * 1024,
+                 sweep_batch: int = 8, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_batch = sweep_batch
+        self.clock = clock
+        self.bytes = 0
+        self.expired = 0
+        self.evicted = 0
+        self._sessions = OrderedDict()  # порядок — от давно не использованных к недавним
+        self._lock = threading.RLock()
+
+    def _remove(self, user_id):
+        packed = self._sessions.pop(user_id)
+        self.bytes -= packed.size
+
+    def _sweep(self, now: float):
+        for _ in range(self.sweep_batch):
+            if not self._sessions:
+                return
+            user_id, packed = next(iter(self._sessions.items()))
+            if now - packed.touched < self.ttl:
+                return
+            self._remove(user_id)
+            self.expired += 1
+            SESSIONS_REMOVED.inc(reason="expired")
+
+    def _live(self, user_id, now: float):
+        packed = self._sessions.get(user_id)
+        if packed is None:
+            return None
+        if now - packed.touched >= self.ttl:
+            self._remove(user_id)
+            self.expired += 1
+            SESSIONS_REMOVED.inc(reason="expired")
+            return None
+        packed.touched = now
+        self._sessions.move_to_end(user_id)
+        return packed
+
+    def get(self, user_id):
+        with self._lock:
+            now = self.clock()
+            self._sweep(now)
+            packed = self._live(user_id, now)
+            return packed.unpack() if packed is not None else None
+
+    def update(self, user_id, fn):
+        with self._lock:
+            now = self.clock()
+            self._sweep(now)
+            packed = self._live(user_id, now)
+            new_session, result = fn(packed.unpack() if packed is not None else None)
+            if packed is not None:
+                self._remove(user_id)
+            if new_session is not None:
+                packed = _CompactSession.pack(new_session, user_id, now)
+                self._sessions[user_id] = packed
+                self.bytes += packed.size
+                while len(self._sessions) > 1 and (
+                        len(self._sessions) > self.max_entries or self.bytes > self.max_bytes):
+                    self._remove(next(iter(self._sessions)))
+                    self.evicted += 1
+                    SESSIONS_REMOVED.inc(reason="evicted")
+            return result
+
+    def stats(self) -> dict:
+        return {"live": len(self._sessions), "bytes": self.bytes, "expired": self.expired, "evicted": self.evicted}
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Сессии в SQLite (WAL). update выполняется в транзакции BEGIN IMMEDIATE,
+    поэтому read-modify-write атомарен и между процессами.
+    Сессия, которую не обновляли дольше ttl секунд (updated_at — время последнего ответа
+    пользователя), считается отсутствующей; такие строки удаляются не чаще раза в purge_interval.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0, ttl: float = None, purge_interval: float = 300.0,
+                 clock=time.time):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.clock = clock
+        self._purged_at = float("-inf")
+        self._purge_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Соединение своё у каждого потока и процесса: после fork (gunicorn --preload) открывается заново
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _cutoff(self, now: float) -> float:
+        return now - self.ttl if self.ttl is not None else float("-inf")
+
+    def _purge(self, now: float):
+        if self.ttl is None:
+            return
+        with self._purge_lock:
+            if now - self._purged_at < self.purge_interval:
+                return
+            self._purged_at = now
+        self._conn().execute("DELETE FROM sessions WHERE updated_at < ?", (self._cutoff(now),))
+
+    def get(self, user_id):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE user_id = ? AND updated_at >= ?", (user_id, self._cutoff(self.clock())),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, user_id, fn):
+        now = self.clock()
+        self._purge(now)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE user_id = ? AND updated_at >= ?", (user_id, self._cutoff(now)),
+            ).fetchone()
+            new_session, result = fn(json.loads(row[0]) if row else None)
+            if new_session is None:
+                conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute(
+                    "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    (user_id, json.dumps(new_session, ensure_ascii=False), now),
+                )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (self._cutoff(self.clock()),)
+        ).fetchone()[0]
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Сессии в Redis. update — оптимистичная транзакция WATCH/MULTI/EXEC с повтором
+    при конфликте. client — redis.Redis или совместимый объект.
+    dedicated_db — в базе Redis только сессии: len считает DBSIZE, иначе — SCAN по префиксу.
+    """
+
+    def __init__(self, client, prefix: str = "session:", ttl: int = None, watch_error=None, max_retries: int = 50,
+                 dedicated_db: bool = False):
+        if watch_error is None:
+            from redis.exceptions import WatchError as watch_error
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.watch_error = watch_error
+        self.max_retries = max_retries
+        self.dedicated_db = dedicated_db
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id):
+        raw = self.client.get(self._key(user_id))
+        return json.loads(raw) if raw else None
+
+    def update(self, user_id, fn):
+        key = self._key(user_id)
+        for _ in range(self.max_retries):
+            pipe = self.client.pipeline()
+            try:
+                pipe.watch(key)
+                raw = pipe.get(key)
+                new_session, result = fn(json.loads(raw) if raw else None)
+                pipe.multi()
+                if new_session is None:
+                    pipe.delete(key)
+                else:
+                    pipe.set(key, json.dumps(new_session, ensure_ascii=False), ex=self.ttl)
+                pipe.execute()
+                return result
+            except self.watch_error:
+                continue
+            finally:
+                pipe.reset()
+        raise RuntimeError(f"Не удалось обновить сессию {user_id}: слишком много конфликтов")
+
+    def __len__(self):
+        if self.dedicated_db:
+            return self.client.dbsize()
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.prefix}*"))
+
+
+def create_session_store(url: str = None) -> SessionStore:
+    """Создать хранилище по URL (по умолчанию — переменная SESSION_STORE_URL или memory://)."""
+    url = url or os.getenv("SESSION_STORE_URL", "memory://")
+    ttl = float(os.getenv("SESSION_TTL", str(24 * 60 * 60)))
+    if url.startswith("memory://"):
+        return CompactSessionStore(
+            ttl=ttl,
+            max_entries=int(os.getenv("SESSION_MAX_ENTRIES", "100000")),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        import redis
+
+        return RedisSessionStore(
+            redis.Redis.from_url(url), ttl=max(1, int(ttl)),
+            dedicated_db=os.getenv("SESSION_REDIS_DEDICATED_DB", "1") == "1",
+        )
+    raise ValueError(f"Неизвестное хранилище сессий: {url}")
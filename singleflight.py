@@ -0,0 +1,138 @@
+"""
+Single-flight: одновременные одинаковые вызовы разделяют один запрос и его результат.
+
+SingleFlight объединяет вызовы внутри процесса (между потоками).
+FileSingleFlight дополнительно объединяет их между воркерами на одном хосте:
+лидер держит flock на файл ключа и сохраняет результат, остальные ждут замок
+и читают готовый результат.
+"""
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from metrics import Counter
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "singleflight_calls_total",
+    "History fetches issued upstream vs joined onto an in-flight call (coalesced, coalesced_remote)", ["result"],
+)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных вызовов между потоками процесса."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Выполнить fn(*args, **kwargs) или дождаться уже идущего вызова с тем же key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc(result="coalesced")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._lead(key, fn, args, kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _lead(self, key, fn, args, kwargs):
+        """Вызов лидера: реально выполняет fn."""
+        with self._lock:
+            self.issued += 1
+        SINGLE_FLIGHT_CALLS.inc(result="issued")
+        return fn(*args, **kwargs)
+
+    def stats(self) -> dict:
+        """issued — реально выполненные вызовы, coalesced — вызовы, получившие чужой результат."""
+        return {"issued": self.issued, "coalesced": self.coalesced}
+
+
+class FileSingleFlight(SingleFlight):
+    """
+    Объединение вызовов и между процессами. Результат лидера хранится ttl секунд
+    в <directory>/<hash>.result; ошибки не сохраняются — следующий воркер повторит вызов.
+    """
+
+    def __init__(self, directory: str, ttl: float = 5.0):
+        super().__init__()
+        self.directory = directory
+        self.ttl = ttl
+        self.coalesced_remote = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + ".lock", base + ".result"
+
+    def _read_fresh(self, path: str):
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl:
+                return False, None
+            with open(path, "rb") as f:
+                return True, pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+    def _lead(self, key, fn, args, kwargs):
+        lock_path, result_path = self._paths(key)
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                found, result = self._read_fresh(result_path)
+                if found:
+                    with self._lock:
+                        self.coalesced_remote += 1
+                    SINGLE_FLIGHT_CALLS.inc(result="coalesced_remote")
+                    return result
+                result = super()._lead(key, fn, args, kwargs)
+                tmp = f"{result_path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    pickle.dump(result, f)
+                os.replace(tmp, result_path)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["coalesced_remote"] = self.coalesced_remote
+        return stats
+
+
+def create_single_flight(directory: str = None) -> SingleFlight:
+    """FileSingleFlight, если задан каталог (SINGLEFLIGHT_DIR), иначе — только внутри процесса."""
+    directory = directory or os.getenv("SINGLEFLIGHT_DIR")
+    if directory:
+        return FileSingleFlight(directory, ttl=float(os.getenv("SINGLEFLIGHT_TTL", "5")))
+    return SingleFlight()
@@ -0,0 +1,193 @@
+"""
+Упреждающий расчёт: как только принят год, символ выбирается и считается в фоне.
+
+До подтверждения остаётся ещё три ответа пользователя (привычка, сумма, валюта). За это
+время фоновый поток выбирает акцию и считает результат в USD при daily_spend = 1 — одну
+валюту, а не все: total_invested, total_units и total_value линейны по daily_spend, остальные
+поля от него не зависят. Результат прикрепляется к сессии (session["speculation"]), и на
+подтверждении остаётся умножить на сумму и отрисовать ответ.
+
+Результат в USD подходит для USD и для валют без курсов (их расчёт тоже идёт без пересчёта).
+Для валюты с курсами взносы пересчитываются по курсу своего дня, поэтому на подтверждении
+считается только она — по уже выбранному символу (symbol()).
+
+Упреждение необязательно: если результата ещё нет, он устарел (SPECULATION_TTL) или
+относится к другому году, расчёт идёт как обычно. Повторный ввод года отменяет прежний
+расчёт; расчёты брошенных диалогов отменяются по TTL, а уже запущенные не прикрепляются
+к сессии, которой больше нет.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Counter
+
+ENABLED = os.getenv("SPECULATIVE_CALCULATION", "0") == "1"
+TTL = float(os.getenv("SPECULATION_TTL", "1800"))
+MAX_PENDING = int(os.getenv("SPECULATION_MAX_PENDING", "100"))
+LINEAR_FIELDS = ("total_invested", "total_units", "total_value")
+
+SPECULATIONS = Counter(
+    "speculations_total", "Speculative calculations per outcome (started, attached, used, missed, cancelled, skipped)",
+    ["outcome"],
+)
+
+
+def compute(year: int, provider=None) -> dict:
+    """Символ для года и результат calculate_investment в USD при daily_spend = 1."""
+    from calculator import calculate_investment
+    from utils import get_random_stock
+
+    symbol = get_random_stock(start_year=year)
+    unit = calculate_investment(year, 1.0, symbol, "USD", provider)
+    return {"year": year, "symbol": symbol, "unit": unit, "computed_at": time.time()}
+
+
+def _fresh(session: dict, now: float = None):
+    speculation = session.get("speculation")
+    now = time.time() if now is None else now
+    if not speculation or speculation["year"] != session["year"] or now - speculation["computed_at"] > TTL:
+        return None
+    return speculation
+
+
+def symbol(session: dict, now: float = None):
+    """Символ, выбранный упреждающим расчётом для года сессии, или None."""
+    speculation = _fresh(session, now)
+    return speculation["symbol"] if speculation else None
+
+
+def scale(session: dict, now: float = None):
+    """(symbol, результат для суммы и валюты сессии) из упреждающего расчёта или None."""
+    from fx import BASE_CURRENCY, get_fx_rates
+
+    speculation = _fresh(session, now)
+    currency = session["currency"]
+    if speculation is None or "error" in speculation["unit"]:
+        return None
+    if currency != BASE_CURRENCY and get_fx_rates().has(currency):
+        return None
+    result = dict(speculation["unit"])
+    for field in LINEAR_FIELDS:
+        if result[field] is not None:
+            result[field] *= session["daily_spend"]
+    result["fx_adjusted"] = currency == BASE_CURRENCY
+    return speculation["symbol"], result
+
+
+class _Pending:
+    __slots__ = ("future", "started_at")
+
+    def __init__(self, future, started_at: float):
+        self.future = future
+        self.started_at = started_at
+
+
+class Speculator:
+    """Фоновые упреждающие расчёты, не больше одного на пользователя."""
+
+    def __init__(self, max_workers: int = 2, max_pending: int = MAX_PENDING, ttl: float = TTL,
+                 provider=None, clock=time.monotonic):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.provider = provider
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        self._pending = {}  # user_id -> _Pending
+        self._lock = threading.Lock()
+
+    def start(self, store, user_id, year: int) -> bool:
+        """Запустить расчёт для принятого года; False, если очередь упреждения переполнена."""
+        self.sweep()
+        with self._lock:
+            self._cancel_locked(user_id)
+            if len(self._pending) >= self.max_pending:
+                SPECULATIONS.inc(outcome="skipped")
+                return False
+            pending = _Pending(None, self.clock())
+            self._pending[user_id] = pending
+            pending.future = self._executor.submit(self._run, store, user_id, year, pending)
+        SPECULATIONS.inc(outcome="started")
+        return True
+
+    def _current(self, user_id, pending: _Pending) -> bool:
+        return self._pending.get(user_id) is pending
+
+    def _run(self, store, user_id, year: int, pending: _Pending):
+        try:
+            session = store.get(user_id)
+            if not self._current(user_id, pending) or not session or session.get("year") != year:
+                SPECULATIONS.inc(outcome="skipped")
+                return
+            speculation = compute(year, self.provider)
+            if not self._current(user_id, pending):
+                SPECULATIONS.inc(outcome="cancelled")
+                return
+
+            def attach(session):
+                # Диалог могли начать заново или завершить, пока шёл расчёт
+                if session is None or session.get("year") != year or session["state"] == "waiting_for_year":
+                    return session, False
+                return {**session, "speculation": speculation}, True
+
+            SPECULATIONS.inc(outcome="attached" if store.update(user_id, attach) else "skipped")
+        except Exception as e:
+            logging.warning(f"Speculative calculation for {user_id} failed: {e}")
+        finally:
+            with self._lock:
+                if self._current(user_id, pending):
+                    del self._pending[user_id]
+
+    def _cancel_locked(self, user_id):
+        pending = self._pending.pop(user_id, None)
+        if pending is not None:
+            pending.future.cancel()
+            SPECULATIONS.inc(outcome="cancelled")
+
+    def cancel(self, user_id):
+        """Отменить расчёт пользователя: ещё не начатый не запустится, начатый не прикрепится."""
+        with self._lock:
+            self._cancel_locked(user_id)
+
+    def sweep(self) -> int:
+        """Отменить расчёты старше ttl (брошенные диалоги). Возвращает число отменённых."""
+        now = self.clock()
+        with self._lock:
+            stale = [user_id for user_id, p in self._pending.items() if now - p.started_at > self.ttl]
+            for user_id in stale:
+                self._cancel_locked(user_id)
+        return len(stale)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def wait(self, timeout: float = None):
+        """Дождаться всех запущенных расчётов (тесты, бенчмарки)."""
+        with self._lock:
+            futures = [p.future for p in self._pending.values()]
+        for future in futures:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+
+_speculator = None
+_speculator_lock = threading.Lock()
+
+
+def get_speculator() -> Speculator:
+    global _speculator
+    if _speculator is None:
+        with _speculator_lock:
+            if _speculator is None:
+                _speculator = Speculator(max_workers=int(os.getenv("SPECULATION_WORKERS", "2")))
+    return _speculator
+
+
+def set_speculator(speculator: Speculator):
+    """Подменить упреждение (тесты, бенчмарки); None — создать заново."""
+    global _speculator
+    _speculator = speculator
@@ -0,0 +1,158 @@
+"""
+Кэш метаданных акций (ticker.info) с TTL по полям и stale-while-revalidate.
+
+ticker.info — один из самых медленных вызовов yfinance. StockInfo загружает его
+лениво: запрос уходит только при чтении удалённого поля (sector, market_cap, ...).
+Статические поля (описание из STOCKS) отдаются сразу.
+"""
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import CACHE_REQUESTS
+
+# поле StockInfo -> (ключ ticker.info, значение по умолчанию)
+REMOTE_FIELDS = {
+    "name": ("longName", None),
+    "sector": ("sector", "Неизвестно"),
+    "industry": ("industry", "Неизвестно"),
+    "current_price": ("currentPrice", 0),
+    "market_cap": ("marketCap", 0),
+    "pe_ratio": ("trailingPE", 0),
+    "dividend_yield": ("dividendYield", 0),
+    "beta": ("beta", 0),
+}
+
+# TTL полей в секундах: цена меняется быстро, сектор — почти никогда
+FIELD_TTLS = {
+    "current_price": 15 * 60,
+    "market_cap": 60 * 60,
+    "pe_ratio": 60 * 60,
+    "dividend_yield": 24 * 60 * 60,
+    "beta": 24 * 60 * 60,
+    "name": 7 * 24 * 60 * 60,
+    "sector": 7 * 24 * 60 * 60,
+    "industry": 7 * 24 * 60 * 60,
+}
+
+# Сколько после истечения TTL ещё можно отдавать устаревшее значение, обновляя его в фоне
+STALE_FOR = 24 * 60 * 60
+
+
+def _fetch_info(symbol: str) -> dict:
+    from clients import get_market_data
+
+    return get_market_data().info(symbol)
+
+
+class MetadataCache:
+    """Кэш сырых ticker.info по символу; свежесть проверяется по TTL конкретного поля."""
+
+    def __init__(self, fetch=_fetch_info, ttls: dict = None, stale_for: float = STALE_FOR, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttls = ttls or FIELD_TTLS
+        self.stale_for = stale_for
+        self.clock = clock
+        self._entries = {}  # symbol -> (info, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stock-meta")
+
+    def _refresh(self, symbol: str):
+        with self._lock:
+            lock = self._symbol_locks.setdefault(symbol, threading.Lock())
+        with lock:
+            info = self.fetch(symbol)
+            self._entries[symbol] = (info, self.clock())
+            return info
+
+    def _refresh_in_background(self, symbol: str):
+        with self._lock:
+            if symbol in self._refreshing:
+                return
+            self._refreshing.add(symbol)
+
+        def run():
+            try:
+                self._refresh(symbol)
+            except Exception as e:
+                logging.warning(f"Stock info refresh failed for {symbol}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(symbol)
+
+        self._executor.submit(run)
+
+    def get(self, symbol: str, field: str):
+        """Значение поля: свежее, устаревшее (с фоновым обновлением) или загруженное синхронно."""
+        key, default = REMOTE_FIELDS[field]
+        entry = self._entries.get(symbol)
+        if entry is not None:
+            info, fetched_at = entry
+            age = self.clock() - fetched_at
+            ttl = self.ttls.get(field, 0)
+            if age < ttl:
+                CACHE_REQUESTS.inc(cache="stock_meta", result="fresh")
+                return info.get(key, default)
+            if age < ttl + self.stale_for:
+                CACHE_REQUESTS.inc(cache="stock_meta", result="stale")
+                self._refresh_in_background(symbol)
+                return info.get(key, default)
+        CACHE_REQUESTS.inc(cache="stock_meta", result="miss")
+        try:
+            info = self._refresh(symbol)
+        except Exception as e:
+            logging.warning(f"Stock info fetch failed for {symbol}: {e}")
+            if entry is None:
+                return default
+            info = entry[0]
+        return info.get(key, default)
+
+
+class StockInfo(Mapping):
+    """
+    Ленивое представление информации об акции с теми же ключами, что возвращал get_stock_info.
+    Удалённые поля читаются из MetadataCache только при обращении к ним.
+    """
+
+    def __init__(self, symbol: str, description: str, cache: MetadataCache = None):
+        self.symbol = symbol
+        self.description = description
+        self.cache = cache or get_metadata_cache()
+
+    def __getitem__(self, field):
+        if field == "description":
+            return self.description
+        if field not in REMOTE_FIELDS:
+            raise KeyError(field)
+        value = self.cache.get(self.symbol, field)
+        if field == "name" and value is None:
+            return self.symbol
+        return value
+
+    def __iter__(self):
+        yield "description"
+        yield from REMOTE_FIELDS
+
+    def __len__(self):
+        return len(REMOTE_FIELDS) + 1
+
+    def __repr__(self):
+        return f"StockInfo({self.symbol!r})"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Общий кэш метаданных процесса."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MetadataCache()
+    return _cache
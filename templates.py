@@ -0,0 +1,232 @@
+"""
+Скомпилированные шаблоны финального сообщения.
+
+Текст ответа состоит из статических частей (символ и описание акции, склонения привычки
+и её шутка, шутка про период) и числовых слотов (суммы, процент, год, блок сравнения, сноска).
+Статические части для пары (символ, найденная привычка, диапазон годов) подставляются один раз:
+получается строка формата, в которой остались только слоты. Она хранится в LRU-кэше,
+и на каждый ответ остаётся format_map с пятью значениями.
+
+Привычки и тексты собраны по локалям (LOCALES). Привычку ищет trie по основам слова
+(matchers.PhraseMatcher), поэтому число настроенных привычек на стоимость ответа не влияет;
+новые добавляются через register_habit.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from matchers import HABITS, PhraseMatcher
+from utils import format_currency
+
+MAX_TEMPLATES = int(os.getenv("MESSAGE_TEMPLATES_MAX", "4096"))
+
+# Словарь склонений и уникальных фраз для популярных привычек
+HABIT_DATA = {
+    "сигареты": {
+        "habit_acc": "сигареты",
+        "habit_prep": "на сигареты",
+        "joke": "Мог бы дышать полной грудью и купить себе яхту!"
+    },
+    "кофе": {
+        "habit_acc": "кофе",
+        "habit_prep": "на кофе",
+        "joke": "Мог бы открыть свою кофейню!"
+    },
+    "алкоголь": {
+        "habit_acc": "алкоголь",
+        "habit_prep": "на алкоголь",
+        "joke": "Мог бы купить виноградник и пить только своё!"
+    },
+    "девочки": {
+        "habit_acc": "девочек",
+        "habit_prep": "на девочек",
+        "joke": "Мог бы купить себе остров и пригласить всех!"
+    },
+    "фастфуд": {
+        "habit_acc": "фастфуд",
+        "habit_prep": "на фастфуд",
+        "joke": "Мог бы открыть свою бургерную!"
+    },
+    "сладкое": {
+        "habit_acc": "сладкое",
+        "habit_prep": "на сладкое",
+        "joke": "Мог бы построить шоколадную фабрику!"
+    }
+}
+
+# Поля layout: статические подставляются при компиляции, слоты ({year}, {daily}, ...) — на каждый ответ.
+# В текстах привычки {habit} — введённая пользователем привычка; в шутках про период {year} — слот.
+RU = {
+    "habits": HABIT_DATA,
+    "default_habit": {"habit_acc": "{habit}", "habit_prep": "на {habit}", "joke": "Мог бы инвестировать с умом!"},
+    # (год, до которого действует шутка); последняя — для всех остальных лет
+    "year_bands": [
+        (2000, "С {year} года ты мог бы стать легендой инвестиций!"),
+        (2010, "С {year} года ты бы уже мог купить квартиру!"),
+        (None, "С {year} года ты мог бы накопить на мечту!"),
+    ],
+    "layout": (
+        "💡 {symbol} ({description})\n\n"
+        "🚬 Вместо {habit_acc} ты мог бы инвестировать {daily} в день в {symbol} с {year} года.\n"
+        "💰 Сегодня у тебя было бы: {total_value}!\n\n"
+        "🔥 Вместо того чтобы потратить {total_invested} {habit_prep}, ты мог бы заработать +{missed_profit}!\n"
+        "📈 Это целых {profit_percent:.1f}% прибыли!\n\n"
+        "{ranking}"
+        "❗️ Не упусти возможность увеличить свой капитал! {joke} {year_joke}\n\n"
+        "🤓 Если хочешь быть умнее, чем ты был в {year} — углубись в инвестиции, следи за моим инстаграмом!\n\n"
+        "🚨 У тебя есть вредные привычки, которые съедают твои деньги. Пора задуматься!\n\n"
+        "{footer}"
+    ),
+    "ranking": (
+        "🏆 Среди {count} активов с {year} года лучше всех был {best} ({best_profit:+.1f}%), "
+        "хуже всех — {worst} ({worst_profit:+.1f}%)."
+    ),
+    "rank": " {symbol} — на {rank}-м месте.",
+    "footer": "*Все цифры примерные, расчёт основан только на динамике актива, без учёта валютных колебаний.*",
+    "footer_fx": "*Все цифры примерные: каждый взнос пересчитан в доллары по курсу {currency} на дату покупки.*",
+}
+
+LOCALES = {"ru": (RU, HABITS)}
+SLOTS = ("year", "daily", "total_value", "total_invested", "missed_profit", "profit_percent", "ranking", "footer")
+
+
+class _Slot:
+    """Поле, которое при компиляции остаётся полем формата (вместе со спецификатором)."""
+
+    __slots__ = ("field",)
+
+    def __init__(self, name: str):
+        self.field = name
+
+    def __format__(self, spec: str) -> str:
+        return "{" + self.field + (":" + spec if spec else "") + "}"
+
+
+_SLOT_VALUES = {name: _Slot(name) for name in SLOTS}
+
+
+def _escape(text: str) -> str:
+    return str(text).replace("{", "{{").replace("}", "}}")
+
+
+class MessageTemplates:
+    """Шаблоны одной локали: поиск привычки и диапазона годов, LRU скомпилированных сообщений."""
+
+    def __init__(self, locale: dict, matcher: PhraseMatcher, max_templates: int = MAX_TEMPLATES):
+        self.locale = locale
+        self.matcher = matcher
+        self.habits = dict(locale["habits"])
+        self.max_templates = max_templates
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register_habit(self, key: str, stems, habit_acc: str, habit_prep: str, joke: str):
+        """Добавить привычку: основы слова для поиска и её фразы."""
+        with self._lock:
+            self.habits[key] = {"habit_acc": habit_acc, "habit_prep": habit_prep, "joke": joke}
+            for stem in stems:
+                self.matcher.add(stem, key)
+            # Уже скомпилированные ответы могли взять для этих слов фразы по умолчанию
+            self._compiled.clear()
+
+    def habit_forms(self, habit: str):
+        """Ключ кэша и фразы привычки: найденная привычка или фразы по умолчанию с текстом пользователя."""
+        key = self.matcher.find(habit)
+        if key is not None and key in self.habits:
+            return key, self.habits[key]
+        forms = {field: text.format(habit=habit) for field, text in self.locale["default_habit"].items()}
+        return tuple(forms.values()), forms
+
+    def year_band(self, year: int) -> int:
+        bands = self.locale["year_bands"]
+        for i, (until, _) in enumerate(bands):
+            if until is None or year < until:
+                return i
+        return len(bands) - 1
+
+    def compile(self, symbol: str, description: str, forms: dict, band: int) -> str:
+        """Строка формата ответа, в которой остались только слоты SLOTS."""
+        static = {
+            "symbol": _escape(symbol),
+            "description": _escape(description),
+            "habit_acc": _escape(forms["habit_acc"]),
+            "habit_prep": _escape(forms["habit_prep"]),
+            "joke": _escape(forms["joke"]),
+            # шутка про период — текст локали, её {year} остаётся слотом
+            "year_joke": self.locale["year_bands"][band][1],
+        }
+        return self.locale["layout"].format_map({**static, **_SLOT_VALUES})
+
+    def template(self, symbol: str, description: str, habit: str, year: int) -> str:
+        # Ключ — от чего зависит compile: найденная привычка, а не введённый текст
+        habit_key, forms = self.habit_forms(habit)
+        band = self.year_band(year)
+        key = (symbol, description, habit_key, band)
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                return compiled
+        compiled = self.compile(symbol, description, forms, band)
+        with self._lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.max_templates:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def render(self, symbol, stock_info, habit, year, daily_spend, currency, total_value, total_invested,
+               missed_profit, profit_percent, fx_adjusted=False, comparison=None) -> str:
+        """Финальное сообщение: скомпилированный шаблон и числовые слоты."""
+        template = self.template(symbol, stock_info.get("description", symbol), habit, int(year))
+        if fx_adjusted and currency != "USD":
+            footer = self.locale["footer_fx"].format(currency=currency)
+        else:
+            footer = self.locale["footer"]
+        return template.format_map({
+            "year": year,
+            "daily": format_currency(daily_spend, currency),
+            "total_value": format_currency(total_value, currency),
+            "total_invested": format_currency(total_invested, currency),
+            "missed_profit": format_currency(missed_profit, currency),
+            "profit_percent": profit_percent,
+            "ranking": self.ranking(symbol, year, comparison),
+            "footer": footer,
+        })
+
+    def ranking(self, symbol, year, comparison) -> str:
+        """Место выбранной акции среди всех активов с того же года (см. cross_section)."""
+        if not comparison:
+            return ""
+        (best, best_profit), (worst, worst_profit) = comparison["best"], comparison["worst"]
+        text = self.locale["ranking"].format(
+            count=comparison["count"], year=year, best=best, best_profit=best_profit,
+            worst=worst, worst_profit=worst_profit,
+        )
+        if comparison["rank"]:
+            text += self.locale["rank"].format(symbol=symbol, rank=comparison["rank"])
+        return text + "\n\n"
+
+    def __len__(self):
+        return len(self._compiled)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_templates(locale: str = "ru") -> MessageTemplates:
+    templates = _templates.get(locale)
+    if templates is None:
+        with _templates_lock:
+            templates = _templates.get(locale)
+            if templates is None:
+                templates = _templates[locale] = MessageTemplates(*LOCALES[locale])
+    return templates
+
+
+def set_templates(templates: MessageTemplates, locale: str = "ru"):
+    """Подменить шаблоны локали (тесты, бенчмарки); None — создать заново."""
+    if templates is None:
+        _templates.pop(locale, None)
+    else:
+        _templates[locale] = templates
@@ -0,0 +1,38 @@
+import pytest
+
+import benchmarks
+import main
+from cross_section import set_price_matrix
+from growth_table import set_growth_table
+from history_index import set_history_index
+from price_store import set_price_provider
+
+
+@pytest.fixture
+def restore_globals():
+    sessions = main.user_sessions
+    yield
+    main.user_sessions = sessions
+    set_price_provider(None)
+    set_history_index(None)
+    set_growth_table(None)
+    set_price_matrix(None)
+
+
+def test_all_benchmarks_run_offline(restore_globals):
+    results = benchmarks.run(min_time=0.001, repeat=1)
+    assert set(results) == set(benchmarks.BENCHMARKS)
+    assert all(r["per_call_us"] > 0 for r in results.values())
+
+
+def test_compare_flags_only_slowdowns():
+    baseline = {"a": {"per_call_us": 10.0}, "b": {"per_call_us": 10.0}}
+    results = {"a": {"per_call_us": 12.0}, "b": {"per_call_us": 30.0}, "new": {"per_call_us": 1.0}}
+    assert [r[0] for r in benchmarks.compare(results, baseline, max_slowdown=1.25)] == ["b"]
+
+
+def test_cli_exit_code(tmp_path, restore_globals):
+    path = str(tmp_path / "baseline.json")
+    assert benchmarks.main(["-k", "format_currency", "--min-time", "0.001", "--save", path]) == 0
+    assert benchmarks.main(["-k", "format_currency", "--min-time", "0.001", "--compare", path,
+                            "--max-slowdown", "1000"]) == 0
@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+
+import bulk
+import main
+from calculator import calculate_investment
+from fx import FxRates
+from price_store import FixturePriceProvider, LocalPriceStore
+
+PROVIDER = FixturePriceProvider.synthetic(["AAPL", "TSLA"], start="1990-01-01", listings={"TSLA": "2010-06-29"})
+
+
+class CountingProvider:
+    def __init__(self, provider):
+        self.provider = provider
+        self.calls = []
+
+    def history(self, symbol, start=None, end=None):
+        self.calls.append(symbol)
+        return self.provider.history(symbol, start, end)
+
+
+def test_matches_calculate_investment_and_groups_by_symbol(tmp_path):
+    fx_rates = FxRates(LocalPriceStore(str(tmp_path)))
+    scenarios = [
+        {"id": i, "year": year, "daily_spend": spend, "symbol": symbol}
+        for i, (year, spend, symbol) in enumerate([
+            (1995, 10, "AAPL"), (2015, 300, "TSLA"), (2005, 42.5, "aapl"), (2015, 7, "AAPL"), (2012, 1, "TSLA"),
+        ])
+    ]
+    provider = CountingProvider(PROVIDER)
+    lines = [json.dumps(s) for s in scenarios]
+    results = list(bulk.run_bulk(lines, provider=provider, fx_rates=fx_rates))
+
+    assert sorted(provider.calls) == ["AAPL", "TSLA"]
+    assert [r["id"] for r in results] == [s["id"] for s in scenarios]
+    for scenario, result in zip(scenarios, results):
+        expected = calculate_investment(scenario["year"], scenario["daily_spend"], scenario["symbol"].upper(),
+                                        provider=PROVIDER)
+        for key in ("months", "total_invested", "total_value", "profit_percent", "cagr", "volatility"):
+            assert np.isclose(result[key], expected[key]), key
+
+
+def test_errors_are_reported_per_line_and_chunks_stream():
+    lines = [
+        json.dumps({"year": 2000, "daily_spend": 5, "symbol": "TSLA"}),
+        "not json",
+        "",
+        json.dumps({"year": 2000, "daily_spend": 5}),
+        json.dumps({"year": 2000, "daily_spend": 5, "symbol": "NOPE"}),
+        json.dumps({"year": 2001, "daily_spend": 5, "symbol": "AAPL"}),
+    ]
+    results = list(bulk.run_bulk(lines, provider=PROVIDER, chunk_size=2))
+    assert [r["line"] for r in results] == [1, 2, 4, 5, 6]
+    assert results[0]["total_value"] > 0  # история TSLA начинается позже 2000 года, как и в calculate_investment
+    assert all("error" in r for r in results[1:4])
+    assert "NOPE" in results[3]["error"]
+    assert results[4]["total_value"] > 0
+
+    limited = list(bulk.run_bulk(lines[-1:] * 5, provider=PROVIDER, chunk_size=2, max_scenarios=3))
+    assert len(limited) == 4 and "error" in limited[-1]
+
+
+def test_endpoint_streams_ndjson(monkeypatch):
+    from price_store import set_price_provider
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    set_price_provider(PROVIDER)
+    try:
+        client = main.app.test_client()
+        body = "\n".join(json.dumps({"year": 2010 + i, "daily_spend": 100, "symbol": "AAPL"}) for i in range(3))
+        assert client.post("/calculate/bulk", data=body).status_code == 403
+        response = client.post("/calculate/bulk", data=body, headers={"X-Admin-Token": "secret"})
+        assert response.mimetype == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [r["year"] for r in rows] == [2010, 2011, 2012]
+        assert all(r["total_value"] > 0 for r in rows)
+    finally:
+        set_price_provider(None)
+
+
+def test_scenarios_before_rates_start_are_not_converted(tmp_path):
+    store = LocalPriceStore(str(tmp_path))
+    dates = np.arange(np.datetime64("2000-01-03"), np.datetime64("2020-01-01"), 7)
+    store.write("RUB", dates, np.linspace(30, 90, len(dates)))
+    lines = [json.dumps({"year": y, "daily_spend": 10, "symbol": "AAPL", "currency": "RUB"}) for y in (1995, 2005)]
+    early, late = bulk.run_bulk(lines, provider=PROVIDER, fx_rates=FxRates(store))
+    assert early["fx_adjusted"] is False and late["fx_adjusted"] is True
+    usd = calculate_investment(1995, 10, "AAPL", provider=PROVIDER)
+    assert np.isclose(early["total_value"], usd["total_value"])
+
+
+def test_history_is_loaded_once_per_request_and_symbols_are_limited():
+    provider = CountingProvider(PROVIDER)
+    lines = [json.dumps({"year": 2000 + i, "daily_spend": 5, "symbol": "AAPL"}) for i in range(6)]
+    lines.append(json.dumps({"year": 2000, "daily_spend": 5, "symbol": "../ETC"}))
+    results = list(bulk.run_bulk(lines, provider=provider, chunk_size=2))
+    assert provider.calls == ["AAPL"]
+    assert all(r["total_value"] > 0 for r in results[:6])
+    assert "не поддерживается" in results[6]["error"]
+
+
+def test_unknown_currency_is_reported_per_line():
+    lines = [json.dumps({"year": 2010, "daily_spend": 5, "symbol": "AAPL", "currency": c}) for c in ("usd", "XYZ")]
+    ok, unknown = bulk.run_bulk(lines, provider=PROVIDER)
+    assert ok["currency"] == "USD" and ok["total_value"] > 0
+    assert "XYZ" in unknown["error"] and "total_value" not in unknown
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from clients import HttpClient, LLMClient, Upstream, UpstreamBusy, UpstreamTimeout
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            time.sleep(1.0)
+        self._reply({"path": self.path, "port": self.client_address[1]})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/chat/completions"):
+            self._reply({
+                "id": "chatcmpl-test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": payload["model"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "echo: " + payload["messages"][-1]["content"]},
+                }],
+            })
+        else:
+            self._reply(payload)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_http_client_reuses_connections(server):
+    client = HttpClient(server, timeout=2)
+    ports = {client.get_json("/fast")["port"] for _ in range(5)}
+    assert len(ports) == 1  # keep-alive: одно TCP-соединение
+    assert client.post_json("/echo", {"a": 1}) == {"a": 1}
+
+
+def test_http_client_deadline(server):
+    client = HttpClient(server, timeout=0.2)
+    with pytest.raises(UpstreamTimeout):
+        client.get_json("/slow")
+
+
+def test_async_variants(server):
+    client = HttpClient(server, timeout=2)
+
+    async def run():
+        return await asyncio.gather(*(client.aget_json(f"/fast?i={i}") for i in range(4)))
+
+    assert [r["path"] for r in asyncio.run(run())] == [f"/fast?i={i}" for i in range(4)]
+
+
+def test_upstream_bounds_concurrency():
+    upstream = Upstream("test", timeout=0.2, max_concurrency=1)
+    release = threading.Event()
+    threading.Thread(target=lambda: upstream.call(release.wait, timeout=2), daemon=True).start()
+    time.sleep(0.05)
+    with pytest.raises(UpstreamBusy):
+        upstream.call(lambda: 1)
+    release.set()
+    time.sleep(0.05)
+    assert upstream.call(lambda: 2) == 2
+
+
+def test_llm_client_against_local_server(server):
+    llm = LLMClient(api_key="test", base_url=server + "/v1", timeout=2)
+    messages = [{"role": "user", "content": "привет"}]
+    assert llm.chat(messages) == "echo: привет"
+    assert asyncio.run(llm.achat(messages)) == "echo: привет"
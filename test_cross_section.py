@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+
+import main
+from cross_section import PriceMatrix, get_price_matrix, set_price_matrix
+from dca import simulate
+from price_store import FixturePriceProvider, PriceSeries, set_price_provider
+
+LISTINGS = {"TSLA": "2010-06-29", "GOOGL": "2004-08-19"}
+SYMBOLS = ["AAPL", "MSFT", "TSLA", "GOOGL", "QQQ"]
+
+
+def fake_provider():
+    return FixturePriceProvider.synthetic(SYMBOLS, start="1990-01-01", end="2024-06-01", listings=LISTINGS)
+
+
+def test_matrix_dca_matches_single_symbol_simulation():
+    provider = fake_provider()
+    matrix = PriceMatrix.build(provider, SYMBOLS)
+    assert matrix.prices.shape == (len(SYMBOLS), len(matrix.months))
+    for year in (1990, 2005, 2015):
+        r = matrix.dca(year)
+        for i, symbol in enumerate(matrix.symbols):
+            part = provider.history(symbol, f"{year}-01-01")
+            expected = simulate(part.dates, part.close, 1.0, 12)
+            assert math.isclose(r["total_invested"][i], expected["total_invested"])
+            assert math.isclose(r["total_value"][i], expected["total_value"], rel_tol=1e-9)
+            assert math.isclose(r["profit_percent"][i], expected["profit_percent"], rel_tol=1e-9)
+
+
+def test_ranking_and_compare():
+    matrix = PriceMatrix.build(fake_provider(), SYMBOLS)
+    ranking = matrix.ranking(2000)
+    assert sorted(s for s, _ in ranking) == sorted(SYMBOLS)
+    assert [p for _, p in ranking] == sorted((p for _, p in ranking), reverse=True)
+
+    comparison = matrix.compare(2000, "TSLA")
+    assert comparison["count"] == len(SYMBOLS)
+    assert comparison["best"] == ranking[0] and comparison["worst"] == ranking[-1]
+    assert ranking[comparison["rank"] - 1][0] == "TSLA"
+    assert matrix.compare(2000, "UNKNOWN")["rank"] is None
+    assert matrix.ranking(2000) is ranking
+
+
+def test_symbols_without_history_after_year_are_not_ranked():
+    old = PriceSeries("OLD", np.array(["1995-01-03", "1999-12-30"], dtype="datetime64[D]"), np.array([1.0, 2.0]))
+    provider = FixturePriceProvider({"OLD": old, "AAPL": fake_provider().history("AAPL")})
+    matrix = PriceMatrix.build(provider, ["OLD", "AAPL", "MISSING"])
+    assert matrix.symbols == ["OLD", "AAPL"]
+    assert [s for s, _ in matrix.ranking(2010)] == ["AAPL"]
+    assert matrix.compare(2010, "AAPL") is None
+
+
+def test_final_message_includes_comparison():
+    set_price_provider(fake_provider())
+    set_price_matrix(None)
+    try:
+        message = main.build_final_answer({"year": 2012, "daily_spend": 300, "habit": "кофе", "currency": "USD"})
+        comparison = get_price_matrix().compare(2012)
+        best = comparison["best"][0]
+        assert f"лучше всех был {best}" in message
+        assert "-м месте" in message
+    finally:
+        set_price_provider(None)
+        set_price_matrix(None)
+
+
+def test_comparison_only_next_to_usd_result_from_the_same_source():
+    matrix = PriceMatrix.build(fake_provider(), SYMBOLS)
+    assert matrix.source == "fixture"
+    usd = {"freshness": "fixture", "fx_adjusted": True, "fallback": False}
+    assert matrix.comparable_with(usd, "USD")
+    assert not matrix.comparable_with(usd, "RUB")  # доходность в рублях, рейтинг в долларах
+    assert matrix.comparable_with({**usd, "fx_adjusted": False}, "KZT")
+    assert not matrix.comparable_with({**usd, "freshness": "live"}, "USD")
+    assert not matrix.comparable_with({**usd, "fallback": True}, "USD")
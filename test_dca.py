@@ -0,0 +1,49 @@
+import numpy as np
+
+from calculator import calculate_investment
+from dca import contribution_points, simulate
+from price_store import FixturePriceProvider
+
+PROVIDER = FixturePriceProvider.synthetic(["AAPL"], start="2000-01-01", end="2010-01-01")
+
+
+def test_monthly_matches_row_loop():
+    series = PROVIDER.history("AAPL")
+    result = simulate(series.dates, series.close, daily_spend=10, months=120)
+
+    months = series.dates.astype("datetime64[M]")
+    units = invested = 0.0
+    seen = set()
+    for month, price in zip(months, series.close):
+        if month in seen:
+            continue
+        seen.add(month)
+        units += 300 / price
+        invested += 300
+    assert invested == result["total_invested"] == 300 * 120
+    assert np.isclose(units, result["total_units"])
+    assert np.isclose(units * series.close[-1], result["total_value"])
+
+
+def test_weekly_points_start_each_week():
+    series = PROVIDER.history("AAPL")
+    points = contribution_points(series.dates, "weekly")
+    weekdays = (series.dates[points].astype(np.int64) + 3) % 7
+    assert weekdays[1:].max() <= 1  # понедельник, либо вторник после праздника
+    assert np.all(np.diff(series.dates[points]).astype(np.int64) >= 3)
+
+
+def test_daily_contributions_cover_calendar_days():
+    series = PROVIDER.history("AAPL", start="2005-01-01", end="2006-01-01")
+    result = simulate(series.dates, series.close, daily_spend=2, months=12, schedule="daily")
+    span = int((series.dates[-1] - series.dates[0]).astype(np.int64)) + 1
+    assert result["total_invested"] == 2 * span
+
+
+def test_linear_in_daily_spend():
+    one = calculate_investment(2003, 1, "AAPL", provider=PROVIDER, schedule="weekly")
+    many = calculate_investment(2003, 250, "AAPL", provider=PROVIDER, schedule="weekly")
+    assert set(one) == set(many)
+    assert np.isclose(many["total_value"], 250 * one["total_value"])
+    assert np.isclose(many["cagr"], one["cagr"])
+    assert one["fallback"] is False
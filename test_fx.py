@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import fx
+from calculator import calculate_investment
+from price_store import FixturePriceProvider, LocalPriceStore, PriceSeries
+
+PROVIDER = FixturePriceProvider.synthetic(["AAPL"], start="2000-01-01", end="2010-01-01")
+
+
+@pytest.fixture
+def rates(tmp_path):
+    store = LocalPriceStore(str(tmp_path))
+    dates = np.arange(np.datetime64("2000-01-03"), np.datetime64("2010-01-01"), 7)
+    # курс RUB растёт вдвое, курс EUR постоянный
+    store.write("RUB", dates, np.linspace(30, 60, len(dates)))
+    store.write("EUR", dates, np.full(len(dates), 0.9))
+    rates = fx.FxRates(store)
+    fx.set_fx_rates(rates)
+    yield rates
+    fx.set_fx_rates(None)
+
+
+def test_as_of_join_uses_last_known_rate(rates):
+    dates = np.array(["1999-12-31", "2000-01-03", "2000-01-09", "2000-01-10"], dtype="datetime64[D]")
+    got = rates.rates("RUB", dates)
+    series = rates.series("RUB")
+    assert np.allclose(got, [series.close[0], series.close[0], series.close[0], series.close[1]])
+    assert np.all(rates.rates("USD", dates) == 1)
+    assert rates.rates("KZT", dates) is None
+    assert rates.has("USD") and rates.has("RUB") and not rates.has("KZT")
+
+
+def test_contributions_converted_at_their_own_rate(rates):
+    usd = calculate_investment(2003, 100, "AAPL", currency="USD", provider=PROVIDER)
+    eur = calculate_investment(2003, 100, "AAPL", currency="EUR", provider=PROVIDER)
+    rub = calculate_investment(2003, 100, "AAPL", currency="RUB", provider=PROVIDER)
+    kzt = calculate_investment(2003, 100, "AAPL", currency="KZT", provider=PROVIDER)
+
+    # постоянный курс не меняет доходность, ослабление валюты трат её увеличивает
+    assert eur["fx_adjusted"] and np.isclose(eur["total_value"], usd["total_value"])
+    assert rub["fx_adjusted"] and rub["total_value"] > usd["total_value"]
+    assert rub["total_invested"] == usd["total_invested"]
+    assert kzt["fx_adjusted"] is False and np.isclose(kzt["total_value"], usd["total_value"])
+
+
+def test_refresh_appends_only_new_bars(tmp_path):
+    full = PriceSeries("USDRUB=X", np.arange(np.datetime64("2020-01-01"), np.datetime64("2020-02-01")),
+                       np.arange(31, dtype=np.float64) + 70)
+
+    class Source:
+        def __init__(self):
+            self.starts = []
+
+        def history(self, symbol, start=None, end=None):
+            assert symbol == fx.fx_symbol("RUB")
+            self.starts.append(str(start))
+            return full.between(start, self.until)
+
+    store = LocalPriceStore(str(tmp_path))
+    source = Source()
+    source.until = "2020-01-15"
+    assert fx.refresh_fx(["USD", "RUB"], source, store, start="2020-01-01") == {"RUB": 14}
+    source.until = None
+    assert fx.refresh_fx(["RUB"], source, store) == {"RUB": 17}
+    assert fx.refresh_fx(["RUB"], source, store) == {"RUB": 0}
+
+    assert source.starts == ["2020-01-01", "2020-01-15", "2020-02-01"]
+    stored = store.load("RUB")
+    assert np.array_equal(stored.dates, full.dates) and np.array_equal(stored.close, full.close)
+
+
+def test_contributions_before_rates_start_are_not_converted(rates):
+    assert rates.coverage("RUB")[0] == np.datetime64("2000-01-03")
+    assert rates.covers("RUB", "2000-01-01") and not rates.covers("RUB", "1999-06-01")
+    assert rates.covers("USD", "1970-01-01") and not rates.covers("KZT", "2005-01-01")
+
+    provider = FixturePriceProvider.synthetic(["AAPL"], start="1990-01-01", end="2010-01-01")
+    usd = calculate_investment(1995, 100, "AAPL", currency="USD", provider=provider)
+    rub = calculate_investment(1995, 100, "AAPL", currency="RUB", provider=provider)
+    assert rub["fx_adjusted"] is False and np.isclose(rub["total_value"], usd["total_value"])
+    assert calculate_investment(2001, 100, "AAPL", currency="RUB", provider=provider)["fx_adjusted"] is True
@@ -0,0 +1,47 @@
+import numpy as np
+
+import calculator
+from growth_table import GrowthTable, set_growth_table
+from price_store import FixturePriceProvider, set_price_provider
+
+SYMBOLS = ["AAPL", "TSLA"]
+PROVIDER = FixturePriceProvider.synthetic(SYMBOLS, start="1995-01-01", listings={"TSLA": "2010-06-29"})
+
+
+def test_save_and_load(tmp_path):
+    table = GrowthTable.build(SYMBOLS, PROVIDER)
+    table.save(str(tmp_path))
+    loaded = GrowthTable.load(str(tmp_path))
+    assert len(loaded) == len(table)
+    assert loaded.built_at == table.built_at
+    assert loaded.lookup("AAPL", 2001, 3.0) == table.lookup("AAPL", 2001, 3.0)
+
+
+def test_lookup_matches_engine():
+    table = GrowthTable.build(SYMBOLS, PROVIDER)
+    for symbol, year in [("AAPL", 1995), ("AAPL", 2015), ("TSLA", 2000), ("TSLA", 2020)]:
+        expected = calculator.calculate_investment(year, 42.5, symbol, provider=PROVIDER)
+        got = table.lookup(symbol, year, 42.5)
+        assert got.keys() == expected.keys()
+        for key in expected.keys() - {"freshness"}:
+            assert np.isclose(got[key], expected[key]), key
+    assert table.lookup("AAPL", 1980, 1.0) is not None  # история с первого доступного бара
+    assert table.lookup("GOOGL", 2001, 1.0) is None
+
+
+def test_calculator_answers_from_table_without_history():
+    set_growth_table(GrowthTable.build(SYMBOLS, PROVIDER))
+    set_price_provider(FixturePriceProvider({}))
+    try:
+        result = calculator.calculate_investment(2005, 10, "AAPL")
+        assert result["fallback"] is False
+        assert result["total_value"] > 0
+    finally:
+        set_growth_table(None)
+        set_price_provider(None)
+
+
+def test_stale_table_is_ignored():
+    table = GrowthTable.build(SYMBOLS, PROVIDER)
+    table.built_at = table.built_at.replace(year=table.built_at.year - 1)
+    assert table.lookup("AAPL", 2005, 1.0) is None
@@ -0,0 +1,41 @@
+import random
+
+import utils
+from history_index import HistoryIndex, set_history_index
+from price_store import FixturePriceProvider
+
+LISTINGS = {"TSLA": "2010-06-29", "NVDA": "1999-01-22"}
+
+
+def make_index():
+    provider = FixturePriceProvider.synthetic(["AAPL", "TSLA", "NVDA"], start="1990-01-01", listings=LISTINGS)
+    return HistoryIndex.build(provider)
+
+
+def test_index_roundtrip(tmp_path):
+    index = make_index()
+    path = str(tmp_path / "index.json")
+    index.save(path)
+    loaded = HistoryIndex.load(path)
+    assert loaded.entries == index.entries
+    assert loaded.refreshed_at == index.refreshed_at
+    assert str(loaded.entries["TSLA"][0]) >= "2010-06-29"
+
+
+def test_symbols_since_keeps_requested_order():
+    index = make_index()
+    assert index.symbols_since(2000, ["TSLA", "AAPL", "GOOGL"]) == ["TSLA", "AAPL"]
+    assert index.recent_symbols(["NVDA", "AAPL"]) == ["NVDA", "AAPL"]
+
+
+def test_get_random_stock_uses_index():
+    set_history_index(make_index())
+    try:
+        random.seed(1)
+        for _ in range(20):
+            assert utils.get_random_stock(start_year=1995) in ("AAPL", "TSLA", "NVDA")
+        set_history_index(HistoryIndex({}))
+        assert utils.get_random_stock_with_history(1995) is None
+        assert utils.get_random_stock(start_year=1995) == "AAPL"
+    finally:
+        set_history_index(None)
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import idempotency
+import main
+from idempotency import ResponseCache, delivery_id, delivery_key
+from session_store import MemorySessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_delivery_id_prefers_payload_then_headers():
+    assert delivery_id({"message": {"id": 17, "text": "да"}}) == "17"
+    assert delivery_id({"message": {"text": "да"}}, {"X-Delivery-Id": "abc"}) == "abc"
+    assert delivery_id({"message": {"text": "да"}}, {}) is None
+    # id запроса от прокси новый у каждого повтора — по нему не дедуплицируем
+    assert delivery_id({"message": {"text": "да"}}, {"X-Request-Id": "r1"}) is None
+
+
+def test_delivery_key_falls_back_to_text_window():
+    key, ttl = delivery_key("webhook", "u", "  да  ", None)
+    assert key == ("webhook", "u", "text", "да") and ttl == idempotency.WINDOW
+    key, ttl = delivery_key("webhook", "u", "да", "m1")
+    assert key == ("webhook", "u", "id", "m1") and ttl == idempotency.TTL
+
+
+def test_retry_replays_first_response_until_ttl():
+    clock, calls = FakeClock(), []
+    cache = ResponseCache(clock=clock)
+
+    def handle():
+        calls.append(1)
+        return f"answer {len(calls)}"
+
+    assert cache.run("k", 30, handle) == "answer 1"
+    clock.now = 29
+    assert cache.run("k", 30, handle) == "answer 1"
+    clock.now = 31
+    assert cache.run("k", 30, handle) == "answer 2"
+    assert len(calls) == 2
+
+
+def test_concurrent_duplicates_wait_for_in_flight_delivery():
+    cache, calls = ResponseCache(), []
+    barrier = threading.Barrier(6)
+    results = []
+
+    def handle():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    def deliver():
+        barrier.wait()
+        results.append(cache.run("k", 60, handle))
+
+    threads = [threading.Thread(target=deliver) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["result"] * 6
+    assert len(calls) == 1
+
+
+def test_errors_are_not_cached():
+    cache = ResponseCache()
+
+    def broken():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        cache.run("k", 60, broken)
+    assert cache.run("k", 60, lambda: "ok") == "ok"
+
+
+def test_cache_is_bounded():
+    cache = ResponseCache(maxsize=3)
+    for i in range(10):
+        cache.run(i, 60, lambda: i)
+    assert len(cache) == 3
+    assert cache.run(9, 60, lambda: "recomputed") == 9
+    assert cache.run(0, 60, lambda: "recomputed") == "recomputed"
+
+
+def test_webhook_retry_does_not_restart_dialog(monkeypatch):
+    monkeypatch.setattr(main, "user_sessions", MemorySessionStore())
+    idempotency.set_response_cache(ResponseCache())
+    client = main.app.test_client()
+
+    def send(text, message_id):
+        payload = {"message": {"id": message_id, "text": text}, "user": {"id": "retry-user"}}
+        return client.post("/webhook", json=payload).get_json()["messages"][0]["text"]
+
+    try:
+        first = send("2010", "m1")
+        assert main.user_sessions.get("retry-user")["state"] == "waiting_for_habits"
+        assert send("2010", "m1") == first
+        assert main.user_sessions.get("retry-user")["state"] == "waiting_for_habits"
+        # другое сообщение с тем же текстом — новая доставка
+        assert send("2010", "m2") != first
+    finally:
+        idempotency.set_response_cache(None)
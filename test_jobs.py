@@ -0,0 +1,225 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+import jobs
+import main
+import validation
+from jobs import JobQueue, JobRunner, QueueFull
+from session_store import MemorySessionStore
+
+
+def wait_for(queue, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} not finished")
+
+
+def thread_runner(queue, fn, **kwargs):
+    kwargs.setdefault("on_failure", None)
+    return JobRunner(queue, fn=fn, executor=ThreadPoolExecutor(max_workers=2), **kwargs)
+
+
+def test_queue_tracks_state_and_depth(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    queue.put("a", "u1", {"year": 2010})
+    queue.put("b", "u2", {"year": 2011})
+    queue.set_state("b", "running")
+    assert queue.depth() == {"queued": 1, "running": 1}
+    queue.set_state("a", "done", result="text")
+    job = queue.get("a")
+    assert job["state"] == "done" and job["result"] == "text" and job["payload"] == {"year": 2010}
+    assert queue.get("missing") is None
+    assert queue.purge(older_than=-1) == 1
+
+
+def test_runner_computes_and_notifies(tmp_path):
+    queue, delivered = JobQueue(str(tmp_path / "jobs.db")), []
+    runner = thread_runner(queue, lambda payload: f"answer for {payload['year']}",
+                           notify=lambda url, job: delivered.append((url, job)), callback_url="http://cb")
+    job = wait_for(queue, runner.submit("u1", {"year": 2010}))
+    assert job["state"] == "done" and job["result"] == "answer for 2010"
+    deadline = time.monotonic() + 5
+    while not delivered and time.monotonic() < deadline:
+        time.sleep(0.01)
+    url, view = delivered[0]
+    assert url == "http://cb" and view["text"] == "answer for 2010" and "payload" not in view
+    assert runner.pending == 0
+
+
+def test_failed_job_keeps_error(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+
+    def broken(payload):
+        raise ValueError("no prices")
+
+    job = wait_for(queue, thread_runner(queue, broken).submit("u1", {}))
+    assert job["state"] == "failed" and job["error"] == "no prices"
+
+
+def test_finished_jobs_past_retention_are_purged(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    runner = thread_runner(queue, lambda payload: "ok", retention=0.05, purge_interval=0)
+    old = wait_for(queue, runner.submit("u1", {}))["id"]
+    time.sleep(0.1)
+    new = wait_for(queue, runner.submit("u2", {}))["id"]
+    deadline = time.monotonic() + 5
+    while queue.get(old) is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.get(old) is None
+    assert queue.get(new)["state"] == "done"
+
+    # между чистками не чаще purge_interval
+    throttled = thread_runner(queue, lambda payload: "ok", retention=0, purge_interval=3600)
+    assert throttled.maybe_purge() == 1
+    wait_for(queue, throttled.submit("u3", {}))
+    assert throttled.maybe_purge() == 0 and queue.depth() == {"queued": 0, "running": 0}
+
+
+def test_backpressure_rejects_over_max_pending(tmp_path):
+    queue, release = JobQueue(str(tmp_path / "jobs.db")), threading.Event()
+    runner = thread_runner(queue, lambda payload: release.wait(5) and "ok", max_pending=1)
+    first = runner.submit("u1", {})
+    with pytest.raises(QueueFull):
+        runner.submit("u2", {})
+    release.set()
+    assert wait_for(queue, first)["state"] == "done"
+    assert wait_for(queue, runner.submit("u2", {}))["state"] == "done"
+
+
+def test_jobs_of_dead_process_are_recovered(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    JobQueue(path).put("orphan", "u1", {"year": 2001})
+    JobQueue(path)._conn().execute("UPDATE jobs SET owner = ?, state = 'running' WHERE id = 'orphan'", (dead.pid,))
+
+    queue = JobQueue(path)
+    runner = thread_runner(queue, lambda payload: str(payload["year"]))
+    assert runner.recover() == 1
+    assert wait_for(queue, "orphan")["result"] == "2001"
+    assert runner.recover() == 0
+
+
+def test_jobs_of_a_dead_process_with_a_reused_pid_are_recovered(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    # прежний воркер с тем же pid: другой boot id
+    queue.put("same-pid", "u1", {"year": 2002})
+    queue._conn().execute("UPDATE jobs SET owner_boot = 'previous', state = 'running' WHERE id = 'same-pid'")
+    # pid прежнего владельца занят живым процессом: решает аренда
+    for job_id, lease_until in (("expired", time.time() - 1), ("leased", time.time() + 60)):
+        queue.put(job_id, "u1", {"year": 2003})
+        queue._conn().execute(
+            "UPDATE jobs SET owner = ?, owner_boot = 'other', lease_until = ?, state = 'running' WHERE id = ?",
+            (os.getppid(), lease_until, job_id),
+        )
+    queue.put("mine", "u1", {"year": 2004})
+
+    assert sorted(queue.orphaned()) == ["expired", "same-pid"]
+    runner = thread_runner(queue, lambda payload: str(payload["year"]))
+    assert runner.recover() == 2
+    assert wait_for(queue, "same-pid")["result"] == "2002"
+    assert wait_for(queue, "expired")["result"] == "2003"
+    assert queue.get("leased")["state"] == "running"
+
+
+def test_owner_renews_its_leases(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lease=60)
+    queue.put("a", "u1", {})
+    queue.put("b", "u1", {})
+    queue.set_state("b", "done", result="ok")
+    lease = "SELECT lease_until FROM jobs WHERE id = ?"
+    queue._conn().execute("UPDATE jobs SET lease_until = 0")
+    assert queue.renew() == 1
+    assert queue._conn().execute(lease, ("a",)).fetchone()[0] > time.time() + 30
+    assert queue._conn().execute(lease, ("b",)).fetchone()[0] == 0
+
+
+def test_spawned_process_pool(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+    runner = JobRunner(queue, fn=json.dumps, executor=executor)
+    try:
+        assert wait_for(queue, runner.submit("u1", {"year": 2010}), timeout=30)["result"] == '{"year": 2010}'
+    finally:
+        executor.shutdown()
+
+
+@pytest.fixture
+def async_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "ENABLED", True)
+    monkeypatch.setattr(main, "user_sessions", MemorySessionStore())
+    validation.set_validator(validation.Validator())
+    yield JobQueue(str(tmp_path / "jobs.db"))
+    jobs.set_job_runner(None)
+    validation.set_validator(None)
+
+
+def confirm_dialog(user_id):
+    for text in ["2010", "кофе", "300", "рубли"]:
+        main.process_user_input(user_id, text)
+    return main.process_user_input(user_id, "да")
+
+
+def test_confirmation_is_acknowledged_delivered_and_polled(async_mode):
+    delivered = []
+    jobs.set_job_runner(thread_runner(async_mode, lambda session: f"💡 {session['habit']} {session['year']}",
+                                      notify=lambda url, job: delivered.append(job), callback_url="http://cb"))
+    client = main.app.test_client()
+    for text in ["2010", "кофе", "300", "рубли"]:
+        main.process_user_input("async-user", text)
+    body = client.post("/webhook", json={"message": {"text": "да"}, "user": {"id": "async-user"}}).get_json()
+    ack, job_id = body["messages"][0]["text"], body["job_id"]
+    assert ack.startswith("⏳") and job_id not in ack
+    wait_for(async_mode, job_id)
+
+    response = client.get(f"/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.get_json()["text"] == "💡 кофе 2010"
+    assert client.get("/jobs/unknown").status_code == 404
+    deadline = time.monotonic() + 5
+    while not delivered and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert delivered[0]["text"] == "💡 кофе 2010"
+
+
+def test_failed_job_restores_session(async_mode):
+    def broken(session):
+        raise ValueError("no prices")
+
+    jobs.set_job_runner(thread_runner(async_mode, broken, callback_url="http://cb", notify=None,
+                                      on_failure=jobs.restore_session))
+    ack = confirm_dialog("failing-user")
+    assert wait_for(async_mode, ack.job_id)["state"] == "failed"
+    deadline = time.monotonic() + 5
+    while main.user_sessions.get("failing-user") is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert main.user_sessions.get("failing-user")["state"] == "waiting_for_confirmation"
+
+
+def test_without_callback_confirmation_stays_synchronous(async_mode, monkeypatch):
+    jobs.set_job_runner(thread_runner(async_mode, lambda session: "never", callback_url=None))
+    monkeypatch.setattr(main, "build_final_answer", lambda session: f"sync {session['year']}")
+    assert confirm_dialog("sync-user") == "sync 2010"
+
+
+def test_full_queue_keeps_session_for_retry(async_mode):
+    release = threading.Event()
+    jobs.set_job_runner(thread_runner(async_mode, lambda session: release.wait(5) and "ok", max_pending=0,
+                                      callback_url="http://cb", notify=None))
+    try:
+        assert "ещё раз" in confirm_dialog("busy-user")
+        assert main.user_sessions.get("busy-user")["state"] == "waiting_for_confirmation"
+    finally:
+        release.set()
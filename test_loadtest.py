@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import idempotency
+import loadtest
+import main
+import validation
+from cross_section import set_price_matrix
+from growth_table import set_growth_table
+from history_index import set_history_index
+from price_store import set_price_provider
+
+
+@pytest.fixture
+def restore_globals():
+    sessions = main.user_sessions
+    yield
+    main.user_sessions = sessions
+    set_price_provider(None)
+    set_history_index(None)
+    set_growth_table(None)
+    set_price_matrix(None)
+    idempotency.set_response_cache(None)
+    validation.set_validator(None)
+
+
+def test_anonymize_hashes_user_and_masks_contacts():
+    record = loadtest.anonymize("manychat-42", "пиши на a@b.ru или +7 (999) 123-45-67, 2010", ts=1.0)
+    assert record["user"] != "manychat-42" and len(record["user"]) == 16
+    assert record["text"] == "пиши на <email> или <phone>, 2010"
+    assert loadtest.anonymize("manychat-42", "x")["user"] == record["user"]
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([7], 95) == 7
+    assert loadtest.percentile([], 50) == 0.0
+
+
+def test_synthetic_dialogs_are_deterministic_and_ordered():
+    records = loadtest.synthetic_dialogs(20, seed=1)
+    assert records == loadtest.synthetic_dialogs(20, seed=1)
+    assert len(records) == 100
+    assert [r["t"] for r in records] == sorted(r["t"] for r in records)
+
+
+def test_replay_reports_every_dialog_state(restore_globals):
+    loadtest.prepare_app()
+    report = loadtest.replay(loadtest.synthetic_dialogs(30), concurrency=4)
+    assert report["errors"] == 0
+    assert report["requests"] == 150
+    assert "waiting_for_year" in report["states"]
+    assert all(s["p50_ms"] <= s["p95_ms"] <= s["p99_ms"] <= s["max_ms"] for s in report["states"].values())
+    assert "req/s" in loadtest.format_report(report)
+
+
+def test_webhook_capture_replays(tmp_path, monkeypatch, restore_globals):
+    path = str(tmp_path / "capture.jsonl")
+    monkeypatch.setattr(loadtest, "CAPTURE_PATH", path)
+    loadtest.prepare_app()
+    client = main.app.test_client()
+    for i, text in enumerate(["2010", "кофе", "300", "рубли", "да"]):
+        client.post("/webhook", json={"message": {"id": i, "text": text}, "user": {"id": "real-user"}})
+
+    records = loadtest.load_records(path)
+    assert [r["text"] for r in records] == ["2010", "кофе", "300", "рубли", "да"]
+    assert "real-user" not in json.dumps(records)
+
+    monkeypatch.setattr(loadtest, "CAPTURE_PATH", None)
+    loadtest.prepare_app()
+    report = loadtest.replay(records, concurrency=1)
+    assert report["requests"] == 5 and report["errors"] == 0
+    assert report["states"]["waiting_for_confirmation"]["count"] == 1
@@ -0,0 +1,54 @@
+import pytest
+
+import main
+from matchers import (
+    CURRENCIES, is_confirmation, match_currency, match_currency_many, match_habit, parse_number_words,
+    parse_number_words_many,
+)
+
+
+@pytest.mark.parametrize("text, code", [
+    ("в долларах", "USD"), ("баксы", "USD"), ("рубли", "RUB"), ("белорусский рубль", "BYN"),
+    ("бел.рубль", "BYN"), ("белорусских рублей", "BYN"), ("гривны", "UAH"), ("юани", "CNY"),
+    ("EUR", "EUR"), ("€", "EUR"), ("не знаю", None),
+])
+def test_currency(text, code):
+    assert match_currency(text) == code
+
+
+def test_confirmation_is_whole_word():
+    assert is_confirmation("ок")
+    assert is_confirmation("Да, готов!")
+    assert not is_confirmation("около того")
+    assert not is_confirmation("когда-нибудь")
+
+
+@pytest.mark.parametrize("text, value", [
+    ("две тысячи пятьсот", 2500), ("полторы тысячи", 1500), ("сто двадцать пять", 125),
+    ("одна тысяча", 1000), ("тысячу", 1000), ("2 тысячи", 2000), ("one hundred twenty", 120),
+    ("five thousand three hundred", 5300), ("пятьсот рублей в день", 500), ("500", None), ("много", None),
+])
+def test_number_words(text, value):
+    assert parse_number_words(text) == value
+
+
+def test_habits_and_phrases():
+    assert match_habit("пачка сигарет в день") == "сигареты"
+    assert match_habit("пью кофе") == "кофе"
+    assert match_habit("игры") is None
+    assert CURRENCIES.find_all("рубли или доллары") == ["RUB", "USD"]
+
+
+def test_batch_api_matches_single_calls():
+    texts = ["рубли", "доллары", "рубли", "ничего"]
+    assert match_currency_many(texts) == [match_currency(t) for t in texts]
+    assert parse_number_words_many(["пятьсот", "две тысячи"]) == [500, 2000]
+
+
+def test_dialog_uses_matchers():
+    session = {"state": "waiting_for_confirmation", "year": 2005, "habit": "кофе", "daily_spend": 300,
+               "currency": "RUB"}
+    assert main.advance_dialog(dict(session), "около того")[0] is not None
+    assert main.advance_dialog(dict(session), "ок")[0] is None
+    session["state"] = "waiting_for_daily_cost"
+    assert main.advance_dialog(session, "две тысячи пятьсот")[0]["daily_spend"] == 2500
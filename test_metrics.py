@@ -0,0 +1,96 @@
+import multiprocessing
+import threading
+import time
+
+import main
+import metrics
+from session_store import MemorySessionStore
+
+
+def test_histogram_and_counter_render():
+    hist = metrics.Histogram("test_latency_seconds", "test", ["path"], buckets=(0.1, 1.0))
+    counter = metrics.Counter("test_events_total", "test", ["kind"])
+    hist.observe(0.05, path="a")
+    hist.observe(0.5, path="a")
+    hist.observe(5, path="a")
+    counter.inc(kind="x")
+    counter.inc(2, kind="x")
+
+    text = metrics.render()
+    assert 'test_latency_seconds_bucket{path="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{path="a",le="1.0"} 2' in text
+    assert 'test_latency_seconds_bucket{path="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{path="a"} 3' in text
+    assert 'test_events_total{kind="x"} 3' in text
+
+
+def _record_in_worker(directory, n):
+    metrics.METRICS_DIR = directory
+    metrics.REGISTRY.reset()
+    for _ in range(n):
+        metrics.CALCULATION_SECONDS.observe(0.01, path="normal")
+    metrics.REGISTRY.flush()
+
+
+def test_aggregates_across_processes(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    procs = [multiprocessing.Process(target=_record_in_worker, args=(directory, n)) for n in (3, 4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    monkeypatch.setattr(metrics, "METRICS_DIR", directory)
+    metrics.REGISTRY.reset()
+    text = metrics.render()
+    assert 'calculation_seconds_count{path="normal"} 7' in text
+
+
+def test_slow_gauge_is_evaluated_once_per_refresh_interval():
+    calls = []
+    gauge = metrics.Gauge("test_slow_gauge", "test", fn=lambda: calls.append(1) or len(calls), refresh=60)
+    for _ in range(3):
+        assert gauge.snapshot() == {"": 1}
+    assert len(calls) == 1
+    gauge.reset()
+    assert gauge.snapshot() == {"": 2}
+
+
+def test_request_threads_do_not_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "FLUSH_INTERVAL", 0.01)
+    registry, flushed = metrics.Registry(), threading.Event()
+    callers = []
+
+    def flush():
+        callers.append(threading.current_thread().name)
+        flushed.set()
+
+    monkeypatch.setattr(registry, "flush", flush)
+    for _ in range(3):
+        registry.maybe_flush()
+    assert flushed.wait(5)
+    assert set(callers) == {"metrics-flush"}
+
+
+def test_metrics_endpoint_reports_dialog_states(monkeypatch):
+    monkeypatch.setattr(main, "user_sessions", MemorySessionStore())
+    metrics.REGISTRY.reset()
+    client = main.app.test_client()
+    client.post("/webhook", json={"message": {"text": "2015"}, "user": {"id": "m1"}})
+    client.post("/webhook", json={"message": {"text": "кофе"}, "user": {"id": "m1"}})
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'dialog_step_seconds_count{state="waiting_for_year"} 1' in text
+    assert 'dialog_step_seconds_count{state="waiting_for_habits"} 1' in text
+    assert 'http_requests_total{endpoint="webhook",status="200"} 2' in text
+    assert "sessions_active 1" in text
+
+
+def test_observe_overhead_is_small():
+    hist = metrics.Histogram("test_overhead_seconds", "test", ["state"])
+    n = 20000
+    started = time.perf_counter()
+    for _ in range(n):
+        hist.observe(0.003, state="waiting_for_year")
+    assert (time.perf_counter() - started) / n < 20e-6
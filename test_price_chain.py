@@ -0,0 +1,129 @@
+import pytest
+
+from calculator import calculate_investment
+from clients import CircuitBreaker, CircuitOpen, Upstream, UpstreamBusy
+from price_chain import PriceUnavailable, TieredPriceProvider
+from price_store import FixturePriceProvider, LocalPriceStore
+
+FIXTURE = FixturePriceProvider.synthetic(["AAPL", "MSFT"], start="2015-01-01", end="2020-01-01")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyRemote:
+    """Удалённый провайдер за Upstream с breaker'ом; failing=True — сервис лежит."""
+
+    name = "flaky"
+
+    def __init__(self, clock, failing=False):
+        self.failing = failing
+        self.calls = 0
+        self.upstream = Upstream("test-flaky", timeout=2, max_concurrency=2,
+                                 breaker=CircuitBreaker(failure_threshold=2, base_backoff=10, clock=clock))
+
+    def _history(self, symbol):
+        self.calls += 1
+        if self.failing:
+            raise ConnectionError("upstream down")
+        return FIXTURE.history(symbol)
+
+    def history(self, symbol, start=None, end=None):
+        return self.upstream.call(self._history, symbol).between(start, end)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_chain(tmp_path, clock, remote):
+    local = FixturePriceProvider({"AAPL": FIXTURE.history("AAPL")})
+    return TieredPriceProvider(local, remote, LocalPriceStore(str(tmp_path)), cache_ttl=60, clock=clock)
+
+
+def test_tiers_in_order(tmp_path, clock):
+    remote = FlakyRemote(clock)
+    chain = make_chain(tmp_path, clock, remote)
+
+    assert chain.fetch("AAPL")[1] == "local"
+    assert remote.calls == 0
+    series, freshness = chain.fetch("MSFT", "2018-01-01")
+    assert freshness == "live" and str(series.dates[0]) >= "2018-01-01"
+    assert chain.fetch("MSFT")[1] == "cache"
+    assert remote.calls == 1
+
+
+def test_breaker_stops_calls_and_serves_last_known_good(tmp_path, clock):
+    remote = FlakyRemote(clock)
+    chain = make_chain(tmp_path, clock, remote)
+    chain.fetch("MSFT")
+
+    remote.failing = True
+    clock.now = 100  # кэш устарел
+    for _ in range(5):
+        series, freshness = chain.fetch("MSFT")
+        assert freshness == "last_known_good" and not series.empty
+    assert remote.calls == 1 + 2  # после двух ошибок breaker открыт и сервис не вызывается
+    assert remote.upstream.breaker.state == "open"
+
+    # После паузы — один пробный вызов; снова ошибка — пауза удваивается
+    clock.now = 111
+    chain.fetch("MSFT")
+    assert remote.calls == 4
+    assert remote.upstream.breaker.open_until == 111 + 20
+
+    remote.failing = False
+    clock.now = 132
+    assert chain.fetch("MSFT")[1] == "live"
+    assert remote.upstream.breaker.state == "closed"
+
+
+def test_snapshot_survives_restart(tmp_path, clock):
+    make_chain(tmp_path, clock, FlakyRemote(clock)).fetch("MSFT")
+
+    restarted = make_chain(tmp_path, clock, FlakyRemote(clock, failing=True))
+    assert restarted.fetch("MSFT")[1] == "last_known_good"
+    with pytest.raises(PriceUnavailable):
+        restarted.fetch("NOPE")
+
+
+def test_breaker_rejects_while_open(clock):
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=5, clock=clock)
+    upstream = Upstream("test-open", timeout=1, max_concurrency=1, breaker=breaker)
+    with pytest.raises(ZeroDivisionError):
+        upstream.call(lambda: 1 / 0)
+    with pytest.raises(CircuitOpen):
+        upstream.call(lambda: 1)
+    clock.now = 5
+    assert upstream.call(lambda: 1) == 1
+
+
+def test_busy_half_open_probe_does_not_stick_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=5, clock=clock)
+    upstream = Upstream("test-busy-probe", timeout=0.2, max_concurrency=1, breaker=breaker)
+    with pytest.raises(ZeroDivisionError):
+        upstream.call(lambda: 1 / 0)
+    clock.now = 5
+    upstream._slots.acquire()  # единственный слот занят: пробный вызов не доходит до сервиса
+    with pytest.raises(UpstreamBusy):
+        upstream.call(lambda: 1)
+    upstream._slots.release()
+    assert breaker.state == "half_open"
+    assert upstream.call(lambda: 1) == 1
+    assert breaker.state == "closed"
+
+
+def test_calculation_does_not_refetch_failing_source(clock):
+    remote = FlakyRemote(clock, failing=True)
+    result = calculate_investment(2016, 10, "MSFT", provider=TieredPriceProvider(None, remote, clock=clock))
+    assert remote.calls == 1
+    assert result["fallback"] is True and result["freshness"] == "unavailable"
+
+    chain = TieredPriceProvider(FIXTURE, None)
+    assert calculate_investment(2016, 10, "MSFT", provider=chain)["freshness"] == "local"
@@ -0,0 +1,97 @@
+import numpy as np
+
+from growth_table import GrowthTable
+from history_index import HistoryIndex
+from price_refresh import merge, refresh_all, refresh_prices
+from price_store import FixturePriceProvider, LocalPriceStore, PriceSeries
+
+
+class RecordingSource:
+    """Провайдер-источник, который запоминает запрошенные даты начала и число отданных баров."""
+
+    name = "recording"
+
+    def __init__(self, series: dict):
+        self.fixture = FixturePriceProvider(series)
+        self.requests = []
+
+    def history(self, symbol, start=None, end=None):
+        series = self.fixture.history(symbol, start, end)
+        self.requests.append((symbol, str(np.datetime64(start, "D")), len(series)))
+        return series
+
+
+def full_series(symbol="AAPL", end="2024-06-01"):
+    return FixturePriceProvider.synthetic([symbol], start="2015-01-01", end=end).history(symbol)
+
+
+def store_with(tmp_path, series: PriceSeries, upto: int) -> LocalPriceStore:
+    store = LocalPriceStore(str(tmp_path / "prices"), reload_interval=0)
+    store.write(series.symbol, series.dates[:upto], series.close[:upto])
+    return store
+
+
+def test_new_bars_are_appended_with_only_the_overlap_downloaded(tmp_path):
+    series = full_series()
+    store = store_with(tmp_path, series, len(series) - 20)
+    source = RecordingSource({"AAPL": series})
+
+    report = refresh_prices(["AAPL"], source, store, overlap=5)
+    assert report["AAPL"] == {"status": "appended", "bars": len(series), "downloaded": 25}
+    stored = store.load("AAPL")
+    assert np.array_equal(stored.dates, series.dates) and np.allclose(stored.close, series.close)
+
+    assert refresh_prices(["AAPL"], source, store, overlap=5)["AAPL"]["status"] == "unchanged"
+    assert all(bars <= 25 for _, _, bars in source.requests)
+
+
+def test_split_restates_stored_history_without_full_download(tmp_path):
+    series = full_series()
+    store = store_with(tmp_path, series, len(series) - 20)
+    # сплит 4:1 за 10 баров до конца: все более ранние скорректированные цены делятся на 4
+    split = len(series) - 10
+    adjusted = np.r_[series.close[:split] / 4, series.close[split:]]
+    source = RecordingSource({"AAPL": PriceSeries("AAPL", series.dates, adjusted)})
+
+    report = refresh_prices(["AAPL"], source, store, overlap=5)
+    assert report["AAPL"]["status"] == "restated"
+    assert report["AAPL"]["downloaded"] == 25
+    assert np.allclose(store.load("AAPL").close, adjusted)
+
+
+def test_inconsistent_overlap_falls_back_to_full_download(tmp_path):
+    series = full_series()
+    store = store_with(tmp_path, series, len(series) - 20)
+    noisy = series.close * np.linspace(0.9, 1.1, len(series))
+    source = RecordingSource({"AAPL": PriceSeries("AAPL", series.dates, noisy)})
+
+    report = refresh_prices(["AAPL"], source, store, overlap=5)
+    assert report["AAPL"] == {"status": "full", "bars": len(series), "downloaded": len(series)}
+    assert np.allclose(store.load("AAPL").close, noisy)
+
+
+def test_merge_rejects_prefix_that_is_not_restated_from_the_start():
+    series = full_series()
+    current = PriceSeries("AAPL", series.dates[-30:-10], series.close[-30:-10])
+    close = series.close[-15:].copy()
+    close[3] *= 2
+    assert merge(current, PriceSeries("AAPL", series.dates[-15:], close))[0] is None
+
+
+def test_refresh_all_updates_index_and_growth_rows_of_changed_symbols(tmp_path):
+    aapl, msft = full_series("AAPL"), full_series("MSFT")
+    store = store_with(tmp_path, aapl, len(aapl) - 20)
+    store.write("MSFT", msft.dates, msft.close)
+    index_path, table_dir = str(tmp_path / "index.json"), str(tmp_path / "tables")
+    HistoryIndex.build(store).save(index_path)
+    GrowthTable.build(store.symbols(), store).save(table_dir)
+
+    source = RecordingSource({"AAPL": aapl, "MSFT": msft})
+    report = refresh_all(["AAPL", "MSFT"], source, store, index_path=index_path, table_dir=table_dir)
+    assert report["AAPL"]["status"] == "appended" and report["MSFT"]["status"] == "unchanged"
+
+    assert HistoryIndex.load(index_path).entries["AAPL"][1] == aapl.dates[-1].item()
+    table = GrowthTable.load(table_dir)
+    expected = GrowthTable.build(["AAPL", "MSFT"], store)
+    for symbol in ("AAPL", "MSFT"):
+        assert np.isclose(table.lookup(symbol, 2016, 1)["total_value"], expected.lookup(symbol, 2016, 1)["total_value"])
@@ -0,0 +1,56 @@
+import numpy as np
+
+from calculator import calculate_investment
+from price_store import FixturePriceProvider, LocalPriceStore, build_store
+
+SYMBOLS = ["AAPL", "TSLA"]
+
+
+def make_fixture():
+    return FixturePriceProvider.synthetic(SYMBOLS, start="2000-01-01", listings={"TSLA": "2010-06-29"})
+
+
+def test_store_roundtrip_is_memory_mapped(tmp_path):
+    store = LocalPriceStore(str(tmp_path))
+    written = build_store(SYMBOLS, source=make_fixture(), store=store)
+    assert set(written) == set(SYMBOLS)
+    assert store.symbols() == sorted(SYMBOLS)
+
+    series = store.load("AAPL")
+    assert isinstance(series.close, np.memmap)
+    assert series.dates.dtype == np.dtype("datetime64[D]")
+    assert len(series) == written["AAPL"]
+
+
+def test_between_and_monthly():
+    series = make_fixture().history("AAPL", start="2020-01-01", end="2021-01-01")
+    assert str(series.dates[0]) >= "2020-01-01"
+    assert str(series.dates[-1]) < "2021-01-01"
+
+    monthly = series.monthly()
+    assert len(monthly) == 12
+    assert monthly.close[0] == series.close[series.dates < np.datetime64("2020-02-01")][-1]
+
+
+def test_missing_symbol_raises_key_error(tmp_path):
+    store = LocalPriceStore(str(tmp_path))
+    try:
+        store.history("NOPE")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("expected KeyError")
+
+
+def test_calculate_investment_uses_provider():
+    result = calculate_investment(start_year=2015, daily_spend=10, symbol="AAPL", provider=make_fixture())
+    assert result["fallback"] is False
+    assert result["total_invested"] > 0
+    assert result["total_value"] > 0
+
+
+def test_calculate_investment_without_data_returns_error():
+    result = calculate_investment(start_year=2015, daily_spend=10, symbol="NOPE", provider=make_fixture())
+    assert result["fallback"] is True
+    assert result["total_value"] is None
+    assert "error" in result
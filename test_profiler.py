@@ -0,0 +1,123 @@
+import threading
+import time
+
+import main
+import profiler
+
+
+def busy_loop_for_profiler(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_capture_collects_collapsed_stacks(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop_for_profiler, args=(stop,))
+    worker.start()
+    try:
+        capture = profiler.Profiler(interval=0.001).start(0.2)
+        assert capture.done.wait(5)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert capture.samples > 0
+    stacks = [s for s in capture.stacks if "busy_loop_for_profiler (test_profiler.py:" in s]
+    assert stacks
+    with open(capture.path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
+
+
+def test_only_one_capture_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    p = profiler.Profiler()
+    capture = p.start(0.2)
+    try:
+        p.start(0.2)
+        assert False, "second capture must be rejected"
+    except RuntimeError:
+        pass
+    assert capture.done.wait(5)
+
+
+def test_slow_request_mode_keeps_only_slow_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiler, "_profiler", profiler.Profiler(interval=0.001))
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    def fake_process(user_id, text):
+        if text == "slow":
+            time.sleep(0.15)
+        return "ok"
+    monkeypatch.setattr(main, "process_user_input", fake_process)
+
+    client = main.app.test_client()
+    assert client.post("/admin/profile?seconds=1").status_code == 403
+    response = client.post("/admin/profile?seconds=1&slower_than_ms=100", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 202
+    capture_id = response.get_json()["id"]
+
+    client.post("/calculate", json={"user_id": "u", "message": "fast"})
+    client.post("/calculate", json={"user_id": "u", "message": "slow"})
+
+    capture = profiler.get_profiler().captures[capture_id]
+    assert capture.done.wait(5)
+    assert capture.requests_kept == 1
+
+    response = client.get(f"/admin/profile/{capture_id}", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert text.startswith("POST /calculate;")
+    assert "fake_process (test_profiler.py:" in text
+
+
+def test_capture_finishes_when_saving_fails(tmp_path, monkeypatch):
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("")
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(blocker / "profiles"))
+    p = profiler.Profiler()
+    capture = p.start(0.1)
+    assert capture.done.wait(5)
+    # неудачное сохранение не блокирует следующий сеанс
+    assert p.start(0.1).done.wait(5)
+
+
+def test_requests_finish_while_the_sampler_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    p = profiler.Profiler(interval=0)
+    capture = p.start(0.5, threshold=0)
+    errors = []
+
+    def requests():
+        try:
+            while not capture.done.is_set():
+                p.request_started("POST /calculate")
+                busy_until = time.perf_counter() + 0.002
+                while time.perf_counter() < busy_until:
+                    sum(range(100))
+                p.request_finished()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=requests) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert capture.requests_kept > 0
+
+
+def test_only_recent_captures_are_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiler, "MAX_CAPTURES", 2)
+    p = profiler.Profiler()
+    ids = []
+    for _ in range(3):
+        capture = p.start(0.1)
+        assert capture.done.wait(5)
+        ids.append(capture.id)
+    assert list(p.captures) == ids[1:]
@@ -0,0 +1,266 @@
+import multiprocessing
+import threading
+
+import main
+from session_store import (CompactSessionStore, MemorySessionStore, RedisSessionStore, SQLiteSessionStore,
+                           create_session_store)
+
+
+class FakeWatchError(Exception):
+    pass
+
+
+class FakeRedis:
+    """Локальная замена Redis: GET/SET/DELETE, SCAN и транзакции WATCH/MULTI/EXEC."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def dbsize(self):
+        return len(self.data)
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        return [k for k in list(self.data) if k.startswith(prefix)]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.watched = {}
+        self.commands = None
+
+    def watch(self, key):
+        self.watched[key] = self.redis.versions.get(key, 0)
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def multi(self):
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append(("set", key, value))
+        self.redis.ttls[key] = ex
+
+    def delete(self, key):
+        self.commands.append(("delete", key, None))
+
+    def execute(self):
+        with self.redis.lock:
+            for key, version in self.watched.items():
+                if self.redis.versions.get(key, 0) != version:
+                    raise FakeWatchError(key)
+            for op, key, value in self.commands:
+                if op == "set":
+                    self.redis.data[key] = value
+                else:
+                    self.redis.data.pop(key, None)
+                self.redis.versions[key] = self.redis.versions.get(key, 0) + 1
+
+    def reset(self):
+        self.watched, self.commands = {}, None
+
+
+def increment(session):
+    session = session or {"n": 0}
+    session["n"] += 1
+    return session, session["n"]
+
+
+def check_store_contract(store):
+    assert store.get("u1") is None
+    assert store.update("u1", increment) == 1
+    assert store.update("u1", increment) == 2
+    assert store.get("u1") == {"n": 2}
+    assert "u1" in store and len(store) == 1
+    store.delete("u1")
+    assert store.get("u1") is None and len(store) == 0
+
+    threads = [threading.Thread(target=lambda: [store.update("u2", increment) for _ in range(50)]) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.get("u2") == {"n": 200}
+
+
+def test_memory_store():
+    check_store_contract(MemorySessionStore())
+
+
+def test_sqlite_store(tmp_path):
+    check_store_contract(SQLiteSessionStore(str(tmp_path / "sessions.db")))
+
+
+def test_redis_store_against_fake():
+    check_store_contract(RedisSessionStore(FakeRedis(), watch_error=FakeWatchError))
+
+
+def test_sqlite_store_expires_idle_sessions(tmp_path):
+    clock = FakeClock()
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=60, purge_interval=30, clock=clock)
+    store.update("stale", increment)
+    store.update("active", increment)
+    clock.now = 50
+    store.update("active", increment)
+    clock.now = 70
+    assert store.get("stale") is None and len(store) == 1
+    # устаревшая сессия в update — как отсутствующая
+    assert store.update("stale", increment) == 1
+    store.delete("stale")
+
+    clock.now = 200
+    store.update("fresh", increment)
+    rows = store._conn().execute("SELECT user_id FROM sessions").fetchall()
+    assert rows == [("fresh",)]
+
+
+def test_shared_stores_use_session_ttl(tmp_path, monkeypatch):
+    import sys
+    import types
+
+    monkeypatch.setenv("SESSION_TTL", "600")
+    assert create_session_store(f"sqlite:///{tmp_path}/sessions.db").ttl == 600
+
+    fake = FakeRedis()
+    redis_module = types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url: fake))
+    exceptions = types.SimpleNamespace(WatchError=FakeWatchError)
+    monkeypatch.setitem(sys.modules, "redis", redis_module)
+    monkeypatch.setitem(sys.modules, "redis.exceptions", exceptions)
+    store = create_session_store("redis://localhost:6379/1")
+    store.update("u1", increment)
+    assert fake.ttls == {"session:u1": 600}
+    # сессии в отдельной базе: число — DBSIZE, без SCAN
+    fake.scan_iter = None
+    assert store.dedicated_db and len(store) == 1
+
+
+def _bump_many(path, n):
+    store = SQLiteSessionStore(path)
+    for _ in range(n):
+        store.update("shared", increment)
+
+
+def test_sqlite_store_is_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    SQLiteSessionStore(path)
+    procs = [multiprocessing.Process(target=_bump_many, args=(path, 25)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert SQLiteSessionStore(path).get("shared") == {"n": 100}
+
+
+def test_dialog_runs_on_shared_store(tmp_path, monkeypatch):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(main, "user_sessions", store)
+    monkeypatch.setattr(main, "build_final_answer", lambda session: f"done {session['year']} {session['currency']}")
+
+    replies = [main.process_user_input("u", text) for text in ["2015", "кофе", "300", "евро"]]
+    assert store.get("u")["state"] == "waiting_for_confirmation"
+    assert replies[-1].startswith("Ты тратишь примерно 9000 EUR")
+    assert main.process_user_input("u", "да") == "done 2015 EUR"
+    assert store.get("u") is None
+
+
+def test_failed_calculation_keeps_session(monkeypatch):
+    store = MemorySessionStore()
+    monkeypatch.setattr(main, "user_sessions", store)
+    store.update("u", lambda s: ({"state": "waiting_for_confirmation", "year": 2015}, None))
+
+    def boom(session):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main, "build_final_answer", boom)
+    try:
+        main.process_user_input("u", "да")
+    except RuntimeError:
+        pass
+    assert store.get("u")["state"] == "waiting_for_confirmation"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_compact_store():
+    check_store_contract(CompactSessionStore())
+
+
+def test_compact_store_round_trips_dialog_sessions():
+    store = CompactSessionStore()
+    session = {"state": "waiting_for_confirmation", "year": 2010, "habit": "кофе", "daily_spend": 300.0,
+               "currency": "RUB", "speculation": {"symbol": "AAPL", "unit": {}}}
+    store.update("u", lambda s: (dict(session), None))
+    assert store.get("u") == session
+    odd = {"state": "custom", "year": "2010", "daily_spend": 300}
+    store.update("v", lambda s: (dict(odd), None))
+    assert store.get("v") == odd
+
+
+def test_compact_store_expires_idle_sessions():
+    clock = FakeClock()
+    store = CompactSessionStore(ttl=60, sweep_batch=2, clock=clock)
+    for i in range(5):
+        store.update(f"u{i}", lambda s: ({"state": "waiting_for_habits", "year": 2000}, None))
+    clock.now = 30
+    assert store.get("u4") is not None
+    clock.now = 70
+    assert store.get("u0") is None
+    # каждое обращение удаляет не больше sweep_batch истёкших сессий с начала очереди
+    assert store.stats()["expired"] == 2 and len(store) == 3
+    store.get("u4")
+    assert store.stats() == {"live": 1, "bytes": store.bytes, "expired": 4, "evicted": 0}
+
+
+def test_compact_store_evicts_least_recently_used():
+    store = CompactSessionStore(max_entries=3)
+    for i in range(3):
+        store.update(f"u{i}", lambda s: ({"state": "waiting_for_year"}, None))
+    store.get("u0")
+    store.update("u3", lambda s: ({"state": "waiting_for_year"}, None))
+    assert store.get("u1") is None and store.get("u0") is not None
+    assert store.stats()["evicted"] == 1
+
+    small = CompactSessionStore(max_bytes=2000)
+    for i in range(50):
+        small.update(f"user-{i}", lambda s: ({"state": "waiting_for_habits", "habit": "x" * 100}, None))
+    assert small.bytes <= 2000 and small.stats()["evicted"] == 50 - len(small)
+    small.delete("user-49")
+    assert small.bytes == sum(p.size for p in small._sessions.values())
+
+
+def test_removed_sessions_are_exported_as_counters(monkeypatch):
+    import main
+    import metrics
+    from session_store import SESSIONS_REMOVED
+
+    before = SESSIONS_REMOVED.snapshot().get("evicted", 0)
+    store = CompactSessionStore(max_entries=1)
+    for i in range(3):
+        store.update(f"u{i}", lambda s: ({"state": "waiting_for_year"}, None))
+    assert SESSIONS_REMOVED.snapshot()["evicted"] == before + 2
+
+    monkeypatch.setattr(main, "user_sessions", store)
+    text = metrics.render()
+    assert "# TYPE session_store_removed_total counter" in text
+    assert 'session_store{stat="live"} 1' in text and 'session_store{stat="evicted"}' not in text
+
+
+def test_default_memory_store_is_bounded():
+    assert isinstance(create_session_store("memory://"), CompactSessionStore)
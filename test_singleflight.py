@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import threading
+import time
+
+from clients import MarketDataClient
+from singleflight import SINGLE_FLIGHT_CALLS, FileSingleFlight, SingleFlight
+
+
+def run_concurrently(n, fn):
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        barrier.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    flight, calls = SingleFlight(), []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return "history"
+
+    assert run_concurrently(8, lambda: flight.do(("AAPL", "2020", "1d"), fetch)) == ["history"] * 8
+    assert len(calls) == 1
+    assert flight.stats() == {"issued": 1, "coalesced": 7}
+
+
+def test_calls_are_exported_as_counters():
+    import metrics
+
+    before = SINGLE_FLIGHT_CALLS.snapshot()
+    test_concurrent_callers_share_one_call()
+    after = SINGLE_FLIGHT_CALLS.snapshot()
+    assert after["issued"] == before.get("issued", 0) + 1
+    assert after["coalesced"] == before.get("coalesced", 0) + 7
+    assert "# TYPE singleflight_calls_total counter" in metrics.render()
+
+
+def test_file_single_flight_counts_remote_results(tmp_path):
+    first, second = FileSingleFlight(str(tmp_path), ttl=5), FileSingleFlight(str(tmp_path), ttl=5)
+    assert first.do("k", lambda: "v") == "v"
+    assert second.do("k", lambda: "w") == "v"
+    assert first.stats() == {"issued": 1, "coalesced": 0, "coalesced_remote": 0}
+    assert second.stats() == {"issued": 0, "coalesced": 0, "coalesced_remote": 1}
+
+
+def test_errors_are_shared_and_not_cached():
+    flight = SingleFlight()
+
+    def broken():
+        time.sleep(0.05)
+        raise RuntimeError("down")
+
+    def call():
+        try:
+            flight.do("k", broken)
+        except RuntimeError as e:
+            return str(e)
+
+    assert run_concurrently(4, call) == ["down"] * 4
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_market_data_history_is_coalesced(monkeypatch):
+    client = MarketDataClient(timeout=2, single_flight=SingleFlight())
+    calls = []
+
+    def fake_history(symbol, kwargs):
+        calls.append((symbol, kwargs["interval"]))
+        time.sleep(0.1)
+        return f"{symbol}:{kwargs['interval']}"
+
+    monkeypatch.setattr(client, "_history", fake_history)
+    results = run_concurrently(6, lambda: client.history("AAPL", start="2020-01-01", interval="1d"))
+    assert results == ["AAPL:1d"] * 6
+    assert calls == [("AAPL", "1d")]
+    assert client.history("AAPL", start="2020-01-01", interval="1mo") == "AAPL:1mo"
+
+
+def _fetch_in_process(directory, marker_dir, queue):
+    flight = FileSingleFlight(directory, ttl=5)
+
+    def fetch():
+        open(os.path.join(marker_dir, str(os.getpid())), "w").close()
+        time.sleep(0.2)
+        return {"bars": 42}
+
+    queue.put(flight.do(("MSFT", "1990", "1d"), fetch))
+
+
+def test_file_single_flight_across_processes(tmp_path):
+    markers = tmp_path / "markers"
+    markers.mkdir()
+    queue = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=_fetch_in_process, args=(str(tmp_path / "sf"), str(markers), queue))
+        for _ in range(4)
+    ]
+    for p in procs:
+        p.start()
+    results = [queue.get(timeout=10) for _ in procs]
+    for p in procs:
+        p.join()
+    assert results == [{"bars": 42}] * 4
+    assert len(os.listdir(markers)) == 1
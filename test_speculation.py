@@ -0,0 +1,141 @@
+import json
+import math
+import threading
+
+import numpy as np
+import pytest
+
+import benchmarks
+import fx
+import main
+import speculation
+import validation
+from calculator import calculate_investment
+from cross_section import set_price_matrix
+from growth_table import set_growth_table
+from history_index import set_history_index
+from price_store import LocalPriceStore, set_price_provider
+from session_store import MemorySessionStore
+from speculation import Speculator
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_market(monkeypatch):
+    benchmarks.use_fake_market()
+    monkeypatch.setattr(main, "user_sessions", MemorySessionStore())
+    validation.set_validator(validation.Validator())
+    yield
+    speculation.set_speculator(None)
+    validation.set_validator(None)
+    set_price_provider(None)
+    set_history_index(None)
+    set_growth_table(None)
+    set_price_matrix(None)
+
+
+def test_scaled_speculation_matches_direct_calculation(fake_market, tmp_path):
+    spec = speculation.compute(2005)
+    json.dumps(spec)  # сессия должна оставаться сериализуемой для SQLite и Redis
+    session = {"year": 2005, "daily_spend": 300.0, "currency": "USD", "speculation": spec}
+    fx.set_fx_rates(fx.FxRates(LocalPriceStore(str(tmp_path))))  # курсов нет ни по одной валюте
+    try:
+        for currency in ("USD", "KZT"):
+            symbol, result = speculation.scale({**session, "currency": currency})
+            direct = calculate_investment(2005, 300.0, symbol, currency)
+            for field in ("total_invested", "total_value", "profit_percent"):
+                assert math.isclose(result[field], direct[field], rel_tol=1e-9)
+            assert result["fx_adjusted"] is direct["fx_adjusted"]
+    finally:
+        fx.set_fx_rates(None)
+
+    assert speculation.scale({**session, "year": 2006}) is None
+    assert speculation.scale(session, now=spec["computed_at"] + speculation.TTL + 1) is None
+
+
+def test_currency_with_rates_is_calculated_for_the_speculated_symbol(fake_market, tmp_path):
+    store = LocalPriceStore(str(tmp_path))
+    dates = np.arange(np.datetime64("2000-01-03"), np.datetime64("2025-01-01"), 7)
+    store.write("RUB", dates, np.full(len(dates), 70.0))
+    fx.set_fx_rates(fx.FxRates(store))
+    try:
+        spec = speculation.compute(2005)
+        session = {"year": 2005, "daily_spend": 300.0, "currency": "RUB", "speculation": spec}
+        assert speculation.scale(session) is None
+        assert speculation.symbol(session) == spec["symbol"]
+        assert speculation.symbol({**session, "year": 2006}) is None
+    finally:
+        fx.set_fx_rates(None)
+
+
+def test_year_step_attaches_speculation_used_at_confirmation(fake_market, monkeypatch):
+    monkeypatch.setattr(speculation, "ENABLED", True)
+    speculator = Speculator()
+    speculation.set_speculator(speculator)
+
+    main.process_user_input("spec-user", "2010")
+    speculator.wait(10)
+    spec = main.user_sessions.get("spec-user")["speculation"]
+    assert spec["year"] == 2010 and spec["unit"]["total_value"] > 0
+
+    for text in ["кофе", "300", "доллары"]:
+        main.process_user_input("spec-user", text)
+    calls = []
+    monkeypatch.setattr(main, "calculate_investment", lambda *a, **k: calls.append(1))
+    reply = main.process_user_input("spec-user", "да")
+    assert reply.startswith(f"💡 {spec['symbol']}")
+    assert calls == []
+
+
+def test_restart_cancels_previous_speculation(fake_market, monkeypatch):
+    gate, computed = threading.Event(), []
+    speculator = Speculator(max_workers=1)
+
+    def slow_compute(year, provider=None):
+        gate.wait(5)
+        computed.append(year)
+        return {"year": year, "symbol": "AAPL", "unit": {}, "computed_at": 0}
+
+    monkeypatch.setattr(speculation, "compute", slow_compute)
+    store = MemorySessionStore()
+    store.update("u", lambda s: ({"state": "waiting_for_habits", "year": 2001}, None))
+    store.update("blocker", lambda s: ({"state": "waiting_for_habits", "year": 1999}, None))
+    speculator.start(store, "blocker", 1999)  # занимает единственный поток
+    speculator.start(store, "u", 2001)
+    speculator.start(store, "u", 2001)  # повторный ввод года: первый расчёт отменён до запуска
+    gate.set()
+    speculator.wait(5)
+    assert computed == [1999, 2001]
+    assert "speculation" in store.get("u")
+
+
+def test_abandoned_speculations_are_swept(monkeypatch):
+    clock, gate = FakeClock(), threading.Event()
+    monkeypatch.setattr(speculation, "compute", lambda *a, **k: gate.wait(5))
+    speculator = Speculator(max_workers=1, ttl=60, clock=clock)
+    store = MemorySessionStore()
+    for user_id in ("a", "b"):
+        store.update(user_id, lambda s: ({"state": "waiting_for_habits", "year": 2000}, None))
+        speculator.start(store, user_id, 2000)
+    assert speculator.pending() == 2
+    clock.now = 61
+    assert speculator.sweep() == 2
+    assert speculator.pending() == 0
+    gate.set()
+
+
+def test_speculation_is_not_attached_to_finished_dialog(fake_market):
+    store = MemorySessionStore()
+    store.update("u", lambda s: ({"state": "waiting_for_habits", "year": 2003}, None))
+    speculator = Speculator()
+    speculator.start(store, "u", 2003)
+    store.update("u", lambda s: (None, None))
+    speculator.wait(10)
+    assert store.get("u") is None
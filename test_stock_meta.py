@@ -0,0 +1,70 @@
+import time
+
+from stock_meta import MetadataCache, StockInfo
+from utils import get_stock_info
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingFetch:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, symbol):
+        self.calls += 1
+        return {"longName": f"{symbol} Inc.", "sector": "Technology", "currentPrice": 100 + self.calls}
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_static_fields_do_not_fetch():
+    fetch = CountingFetch()
+    info = StockInfo("AAPL", "Apple", MetadataCache(fetch))
+    assert info.get("description", "AAPL") == "Apple"
+    assert info["description"] == "Apple"
+    assert fetch.calls == 0
+    assert info["sector"] == "Technology"
+    assert info["name"] == "AAPL Inc."
+    assert fetch.calls == 1
+
+
+def test_per_field_ttl_and_stale_while_revalidate():
+    fetch, clock = CountingFetch(), Clock()
+    cache = MetadataCache(fetch, ttls={"current_price": 10, "sector": 1000}, stale_for=100, clock=clock)
+    assert cache.get("AAPL", "current_price") == 101
+
+    clock.now = 50  # цена устарела, но в пределах stale_for: отдаём старое и обновляем в фоне
+    assert cache.get("AAPL", "sector") == "Technology"
+    assert cache.get("AAPL", "current_price") == 101
+    assert wait_for(lambda: fetch.calls == 2)
+    assert wait_for(lambda: cache.get("AAPL", "current_price") == 102)
+
+    clock.now = 500  # дальше stale_for — синхронная загрузка
+    assert cache.get("AAPL", "current_price") == 103
+
+
+def test_fetch_error_falls_back_to_defaults():
+    def broken(symbol):
+        raise RuntimeError("upstream down")
+
+    info = StockInfo("AAPL", "Apple", MetadataCache(broken))
+    assert info["sector"] == "Неизвестно"
+    assert info["name"] == "AAPL"
+    assert info["market_cap"] == 0
+
+
+def test_get_stock_info_is_lazy():
+    info = get_stock_info("TSLA")
+    assert info.get("description").startswith("Tesla")
+    assert get_stock_info("NOPE")["description"] == "Нет описания"
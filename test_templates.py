@@ -0,0 +1,144 @@
+import pytest
+
+import main
+from matchers import HABIT_STEMS, PhraseMatcher
+from templates import RU, MessageTemplates
+
+INFO = {"description": "Apple {Inc}"}
+COMPARISON = {"count": 12, "best": ("NVDA", 2345.67), "worst": ("T", -12.3), "rank": 3}
+
+# Вывод generate_final_message до перехода на шаблоны: эталон, а не пересчёт тем же кодом
+GOLDEN = [
+    (
+        ("AAPL", INFO, "пью кофе", 2005, 300, "RUB", 2500000, 1200000, 1300000, 108.34, False, None),
+        (
+            "💡 AAPL (Apple {Inc})\n"
+            "\n"
+            "🚬 Вместо кофе ты мог бы инвестировать 300 RUB в день в AAPL с 2005 года.\n"
+            "💰 Сегодня у тебя было бы: 2\xa0500\xa0000 RUB!\n"
+            "\n"
+            "🔥 Вместо того чтобы потратить 1\xa0200\xa0000 RUB на кофе, ты мог бы заработать +1\xa0300\xa0000 "
+            "RUB!\n"
+            "📈 Это целых 108.3% прибыли!\n"
+            "\n"
+            "❗️ Не упусти возможность увеличить свой капитал! Мог бы открыть свою кофейню! С 2005 года "
+            "ты бы уже мог купить квартиру!\n"
+            "\n"
+            "🤓 Если хочешь быть умнее, чем ты был в 2005 — углубись в инвестиции, следи за моим инстаграмом!\n"
+            "\n"
+            "🚨 У тебя есть вредные привычки, которые съедают твои деньги. Пора задуматься!\n"
+            "\n"
+            "*Все цифры примерные, расчёт основан только на динамике актива, без учёта валютных колебаний.*"
+        ),
+    ),
+    (
+        ("AAPL", INFO, "игры {0}", 1995, 12.5, "EUR", 2500000.5, 1200000, 1300000.5, 108.34, True, COMPARISON),
+        (
+            "💡 AAPL (Apple {Inc})\n"
+            "\n"
+            "🚬 Вместо игры {0} ты мог бы инвестировать 12.50 EUR в день в AAPL с 1995 года.\n"
+            "💰 Сегодня у тебя было бы: 2\xa0500\xa0000.50 EUR!\n"
+            "\n"
+            "🔥 Вместо того чтобы потратить 1\xa0200\xa0000 EUR на игры {0}, ты мог бы заработать "
+            "+1\xa0300\xa0000.50 EUR!\n"
+            "📈 Это целых 108.3% прибыли!\n"
+            "\n"
+            "🏆 Среди 12 активов с 1995 года лучше всех был NVDA (+2345.7%), хуже всех — T (-12.3%). "
+            "AAPL — на 3-м месте.\n"
+            "\n"
+            "❗️ Не упусти возможность увеличить свой капитал! Мог бы инвестировать с умом! С 1995 года "
+            "ты мог бы стать легендой инвестиций!\n"
+            "\n"
+            "🤓 Если хочешь быть умнее, чем ты был в 1995 — углубись в инвестиции, следи за моим инстаграмом!\n"
+            "\n"
+            "🚨 У тебя есть вредные привычки, которые съедают твои деньги. Пора задуматься!\n"
+            "\n"
+            "*Все цифры примерные: каждый взнос пересчитан в доллары по курсу EUR на дату покупки.*"
+        ),
+    ),
+    (
+        ("MSFT", {}, "пачка сигарет", 2015, 7, "USD", 1500, 1000, 500, 50.0, True, {**COMPARISON, "rank": None}),
+        (
+            "💡 MSFT (MSFT)\n"
+            "\n"
+            "🚬 Вместо сигареты ты мог бы инвестировать 7 USD в день в MSFT с 2015 года.\n"
+            "💰 Сегодня у тебя было бы: 1\xa0500 USD!\n"
+            "\n"
+            "🔥 Вместо того чтобы потратить 1\xa0000 USD на сигареты, ты мог бы заработать +500 USD!\n"
+            "📈 Это целых 50.0% прибыли!\n"
+            "\n"
+            "🏆 Среди 12 активов с 2015 года лучше всех был NVDA (+2345.7%), хуже всех — T (-12.3%).\n"
+            "\n"
+            "❗️ Не упусти возможность увеличить свой капитал! Мог бы дышать полной грудью и купить "
+            "себе яхту! С 2015 года ты мог бы накопить на мечту!\n"
+            "\n"
+            "🤓 Если хочешь быть умнее, чем ты был в 2015 — углубись в инвестиции, следи за моим инстаграмом!\n"
+            "\n"
+            "🚨 У тебя есть вредные привычки, которые съедают твои деньги. Пора задуматься!\n"
+            "\n"
+            "*Все цифры примерные, расчёт основан только на динамике актива, без учёта валютных колебаний.*"
+        ),
+    ),
+    (
+        ("TSLA", INFO, "девочки", 2010, 1000, "KZT", 10, 20, -10, -50.0, False, None),
+        (
+            "💡 TSLA (Apple {Inc})\n"
+            "\n"
+            "🚬 Вместо девочек ты мог бы инвестировать 1\xa0000 KZT в день в TSLA с 2010 года.\n"
+            "💰 Сегодня у тебя было бы: 10 KZT!\n"
+            "\n"
+            "🔥 Вместо того чтобы потратить 20 KZT на девочек, ты мог бы заработать +-10 KZT!\n"
+            "📈 Это целых -50.0% прибыли!\n"
+            "\n"
+            "❗️ Не упусти возможность увеличить свой капитал! Мог бы купить себе остров и пригласить "
+            "всех! С 2010 года ты мог бы накопить на мечту!\n"
+            "\n"
+            "🤓 Если хочешь быть умнее, чем ты был в 2010 — углубись в инвестиции, следи за моим инстаграмом!\n"
+            "\n"
+            "🚨 У тебя есть вредные привычки, которые съедают твои деньги. Пора задуматься!\n"
+            "\n"
+            "*Все цифры примерные, расчёт основан только на динамике актива, без учёта валютных колебаний.*"
+        ),
+    ),
+]
+
+
+def ru_templates(**kwargs):
+    return MessageTemplates(RU, PhraseMatcher(HABIT_STEMS, prefix=True), **kwargs)
+
+
+@pytest.mark.parametrize("args, expected", GOLDEN)
+def test_rendered_message_matches_pre_template_output(args, expected):
+    assert main.generate_final_message(*args) == expected
+    # второй вызов берёт шаблон из кэша
+    assert main.generate_final_message(*args) == expected
+
+
+def test_templates_are_compiled_once_per_habit_and_year_band():
+    templates = ru_templates(max_templates=2)
+    for year in (2011, 2015, 2020):
+        templates.render("AAPL", INFO, "кофе", year, 1, "USD", 1, 1, 0, 0.0)
+    assert len(templates) == 1
+    templates.render("AAPL", INFO, "кофе", 2001, 1, "USD", 1, 1, 0, 0.0)
+    templates.render("MSFT", INFO, "кофе", 2001, 1, "USD", 1, 1, 0, 0.0)
+    assert len(templates) == 2
+
+
+def test_phrasings_of_one_habit_share_a_template():
+    templates = ru_templates()
+    for habit in ("кофе", "пью кофе", "Кофе каждое утро", "капучино и кофе"):
+        assert "Вместо кофе" in templates.render("AAPL", INFO, habit, 2015, 1, "USD", 1, 1, 0, 0.0)
+    assert len(templates) == 1
+    # для ненайденной привычки ключ — её фразы, так что одинаковый текст тоже берётся из кэша
+    for _ in range(2):
+        templates.render("AAPL", INFO, "игры", 2015, 1, "USD", 1, 1, 0, 0.0)
+    assert len(templates) == 2
+
+
+def test_registered_habit_is_matched_and_rendered():
+    templates = ru_templates()
+    before = templates.render("AAPL", INFO, "играю в приставку", 2010, 1, "USD", 1, 1, 0, 0.0)
+    assert "Вместо играю в приставку" in before
+    templates.register_habit("игры", ["игр", "приставк"], "игры", "на игры", "Мог бы купить студию!")
+    after = templates.render("AAPL", INFO, "играю в приставку", 2010, 1, "USD", 1, 1, 0, 0.0)
+    assert "Вместо игры" in after and "Мог бы купить студию!" in after
@@ -0,0 +1,117 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+import validation
+from clients import LLMClient
+from session_store import MemorySessionStore
+
+ITEM_RE = re.compile(r'^(\d+)\. этап "(\w+)" \(.*\): (".*")$')
+
+
+def judge(stage, text):
+    text = text.lower()
+    if "злот" in text:
+        return {"is_valid": False, "reason": "Злотые не поддерживаются", "suggestion": "Выбери, например, EUR"}
+    if stage == "habit" and "qwerty" in text:
+        return {"is_valid": False, "reason": "Это не похоже на привычку", "suggestion": "Например: кофе"}
+    if stage == "year" and "двухтысяч" in text:
+        return {"is_valid": True, "reason": "", "suggestion": "", "value": 2000}
+    return {"is_valid": True, "reason": "", "suggestion": ""}
+
+
+class StubModel(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    prompts = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        items = []
+        for line in payload["messages"][-1]["content"].splitlines():
+            n, stage, text = ITEM_RE.match(line).groups()
+            items.append({"id": int(n), **judge(stage, json.loads(text))})
+        StubModel.prompts.append(len(items))
+        body = json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": payload["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(items, ensure_ascii=False)}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def llm():
+    StubModel.prompts = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubModel)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield LLMClient(api_key="test", base_url=f"http://127.0.0.1:{httpd.server_address[1]}/v1", timeout=5)
+    httpd.shutdown()
+
+
+def test_rules_answer_without_llm(llm):
+    validator = validation.Validator(llm)
+    assert validator.validate("year", "с 2010 года")["value"] == 2010
+    assert validator.validate("year", "в 95-м")["is_valid"] is False
+    assert validator.validate("amount", "две тысячи")["value"] == 2000
+    assert validator.validate("currency", "в рублях")["value"] == "RUB"
+    assert validator.validate("habit", "нет")["is_valid"] is False
+    assert StubModel.prompts == []
+
+
+def test_unknown_input_escalates_once_then_hits_cache(llm):
+    validator = validation.Validator(llm)
+    first = validator.validate("currency", "Злотые!")
+    assert first["is_valid"] is False and first["source"] == "llm"
+    again = validator.validate("currency", "  злотые ")
+    assert again["source"] == "cache" and again["reason"] == first["reason"]
+    assert StubModel.prompts == [1]
+
+
+def test_concurrent_validations_share_one_prompt(llm):
+    validator = validation.Validator(batcher=validation.LLMBatcher(llm, window=0.2))
+    results = {}
+
+    def run(i):
+        results[i] = validator.validate("habit", f"хобби номер {i}")
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert StubModel.prompts == [5]
+    assert all(r["is_valid"] is True for r in results.values())
+
+
+def test_token_budget_stops_llm_calls(llm):
+    batcher = validation.LLMBatcher(llm, window=0, budget=validation.TokenBudget(10))
+    verdict = validation.Validator(batcher=batcher).validate("currency", "злотые")
+    assert verdict["is_valid"] is None and verdict["source"] == "budget"
+    assert StubModel.prompts == []
+
+
+def test_dialog_uses_verdicts(llm, monkeypatch):
+    monkeypatch.setattr(main, "user_sessions", MemorySessionStore())
+    validation.set_validator(validation.Validator(batcher=validation.LLMBatcher(llm, window=0)))
+    try:
+        assert main.process_user_input("u", "в двухтысячном").startswith("Хорошо")
+        assert main.user_sessions.get("u")["year"] == 2000
+        assert main.process_user_input("u", "qwerty") == "Это не похоже на привычку. Например: кофе"
+        assert main.process_user_input("u", "кофе").startswith("Сколько")
+        assert main.process_user_input("u", "300").startswith("В какой валюте")
+        assert main.process_user_input("u", "злотые") == "Злотые не поддерживаются. Выбери, например, EUR"
+        assert main.process_user_input("u", "евро").startswith("Ты тратишь")
+    finally:
+        validation.set_validator(None)
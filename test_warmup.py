@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import main
+import warmup
+from history_index import set_history_index
+from price_store import FixturePriceProvider, set_price_provider
+from utils import STOCKS
+
+
+def test_importing_main_does_not_load_heavy_modules():
+    code = (
+        "import sys, main; "
+        "print(','.join(m for m in ('numpy', 'pandas', 'yfinance', 'openai') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+
+def test_readiness_follows_warmup():
+    client = main.app.test_client()
+    set_price_provider(FixturePriceProvider.synthetic(list(STOCKS), start="2015-01-01"))
+    warmup.reset()
+    try:
+        assert client.get("/health/live").status_code == 200
+        assert client.get("/health").status_code == 200
+        assert client.get("/health/ready").status_code == 503
+
+        status = warmup.warmup()
+        assert status["ready"] is True
+        assert set(status["steps"]) == {"imports", "prices", "history_index", "growth_table", "fx", "cross_section"}
+
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.get_json()["ready"] is True
+        assert warmup.warmup()["finished_at"] == status["finished_at"]  # повторный вызов — no-op
+    finally:
+        set_price_provider(None)
+        set_history_index(None)
+        warmup.reset()
@@ -0,0 +1,294 @@
+"""
+Валидация ответов пользователя: сначала дешёвые правила, LLM — только для непонятного.
+
+Уровни:
+1. детерминированные правила по этапу диалога (matchers, регулярные выражения);
+2. кэш вердиктов LLM по нормализованному вводу (LRU с TTL);
+3. LLM: несколько ожидающих проверок уходят одним промптом, число одновременных
+   промптов и токенов в минуту ограничено.
+
+Вердикт: {"is_valid": True/False/None, "reason", "suggestion", "value", "source"}.
+is_valid=None — проверить не удалось (LLM выключен, бюджет исчерпан, ошибка): диалог
+тогда решает сам, как без валидации.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime
+
+from matchers import is_confirmation, match_currency, match_habit, parse_number_words, tokenize
+from metrics import CACHE_REQUESTS, Counter
+
+VALIDATIONS = Counter("validations_total", "Input validations per dialog stage and deciding tier", ["stage", "source"])
+
+STAGE_DESCRIPTIONS = {
+    "year": "год начала инвестиций от 1970 до текущего; value — год числом",
+    "habit": "краткое описание вредной привычки (курение, кофе, сладкое...); value — привычка одним-двумя словами",
+    "amount": "сумма трат в день, положительное число; value — число",
+    "currency": "реальная валюта (рубли, доллары, евро, тенге, драм, USD...); value — ISO-код",
+}
+
+# состояние диалога (main.advance_dialog) -> этап проверки
+STATE_STAGES = {
+    "waiting_for_year": "year",
+    "waiting_for_habits": "habit",
+    "waiting_for_daily_cost": "amount",
+    "waiting_for_currency": "currency",
+    "waiting_for_confirmation": "confirmation",
+}
+
+NEGATIVE_WORDS = {"нет", "не", "no", "неа", "ничего", "никакой", "никакая"}
+MAX_TOKENS_PER_ITEM = 60
+
+
+def normalize(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+def _verdict(is_valid, reason: str = "", suggestion: str = "", value=None, source: str = "rules") -> dict:
+    return {"is_valid": is_valid, "reason": reason, "suggestion": suggestion, "value": value, "source": source}
+
+
+def check_rules(stage: str, text: str):
+    """Вердикт по правилам или None, если правила не могут классифицировать ввод."""
+    tokens = tokenize(text)
+    if not tokens:
+        return _verdict(False, "Пустой ответ")
+    if stage == "year":
+        years = [int(t) for t in tokens if t.isdigit() and len(t) == 4]
+        if years:
+            year = years[0]
+            if 1970 <= year <= datetime.now().year:
+                return _verdict(True, value=year)
+            return _verdict(False, f"Год должен быть от 1970 до {datetime.now().year}", "Например: 2010")
+        if any(t[0].isdigit() for t in tokens):
+            return _verdict(False, "Год нужно указать четырьмя цифрами", "Например: 2010")
+        return None
+    if stage == "habit":
+        if match_habit(text):
+            return _verdict(True, value=match_habit(text))
+        if set(tokens) <= NEGATIVE_WORDS or len(text.strip()) < 2 or text.strip().isdigit():
+            return _verdict(False, "Опиши привычку чуть подробнее", "Например: курение, кофе, сладкое")
+        return None
+    if stage == "amount":
+        numbers = [t for t in tokens if t[0].isdigit()]
+        value = float(numbers[0].replace(",", ".")) if numbers else parse_number_words(text)
+        if value is None:
+            return None
+        if value <= 0:
+            return _verdict(False, "Сумма должна быть больше нуля", "Например: 500")
+        return _verdict(True, value=value)
+    if stage == "currency":
+        code = match_currency(text)
+        return _verdict(True, value=code) if code else None
+    if stage == "confirmation":
+        if is_confirmation(text):
+            return _verdict(True)
+        return _verdict(False) if set(tokens) & NEGATIVE_WORDS else None
+    return _verdict(True)
+
+
+class VerdictCache:
+    """LRU вердиктов LLM по (stage, нормализованный ввод) с TTL."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 24 * 60 * 60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.clock() - entry[1] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, verdict: dict):
+        with self._lock:
+            self._entries[key] = (verdict, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenBudget:
+    """Не больше tokens_per_minute оценочных токенов за скользящую минуту."""
+
+    def __init__(self, tokens_per_minute: int, clock=time.monotonic):
+        self.tokens_per_minute = tokens_per_minute
+        self.clock = clock
+        self._spent = []  # (время, токены)
+        self._lock = threading.Lock()
+
+    def try_spend(self, tokens: int) -> bool:
+        with self._lock:
+            now = self.clock()
+            self._spent = [(t, n) for t, n in self._spent if now - t < 60]
+            if sum(n for _, n in self._spent) + tokens > self.tokens_per_minute:
+                return False
+            self._spent.append((now, tokens))
+            return True
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 3 + 1
+
+
+def build_prompt(items: list) -> list:
+    """Сообщения для одного промпта с несколькими проверками [(stage, text), ...]."""
+    lines = [
+        f'{i}. этап "{stage}" ({STAGE_DESCRIPTIONS[stage]}): {json.dumps(text, ensure_ascii=False)}'
+        for i, (stage, text) in enumerate(items, 1)
+    ]
+    return [
+        {"role": "system", "content": (
+            "Ты валидируешь ответы пользователей финансового бота. Для каждого пункта верни объект "
+            '{"id": номер, "is_valid": true/false, "reason": "...", "suggestion": "...", "value": ...}. '
+            "Отвечай только JSON-массивом таких объектов."
+        )},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+
+
+def parse_response(content: str, count: int) -> list:
+    """Вердикты по порядку пунктов; None для пунктов, которых нет в ответе."""
+    verdicts = [None] * count
+    try:
+        data = json.loads(content[content.find("["):content.rfind("]") + 1])
+    except ValueError:
+        return verdicts
+    for item in data if isinstance(data, list) else []:
+        try:
+            i = int(item["id"]) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= i < count and isinstance(item.get("is_valid"), bool):
+            verdicts[i] = _verdict(item["is_valid"], str(item.get("reason") or ""),
+                                   str(item.get("suggestion") or ""), item.get("value"), "llm")
+    return verdicts
+
+
+class LLMBatcher:
+    """
+    Собирает проверки, пришедшие в течение window секунд, в один промпт (до max_batch штук).
+    Первый поток в окне — лидер: он ждёт окно и отправляет пачку, остальные ждут свои Future.
+    """
+
+    def __init__(self, llm, max_batch: int = 8, window: float = 0.02, max_concurrency: int = 2,
+                 budget: TokenBudget = None, timeout: float = 5.0):
+        self.llm = llm
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self.budget = budget or TokenBudget(int(os.getenv("VALIDATION_TOKENS_PER_MINUTE", "20000")))
+        self.prompts = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._pending = []
+        self._collecting = False
+        self._lock = threading.Lock()
+
+    def submit(self, stage: str, text: str) -> Future:
+        future = Future()
+        with self._lock:
+            self._pending.append((stage, text, future))
+            leader = not self._collecting
+            self._collecting = True
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._collecting = False
+            for i in range(0, len(batch), self.max_batch):
+                self._send(batch[i:i + self.max_batch])
+        return future
+
+    def _send(self, batch: list):
+        items = [(stage, text) for stage, text, _ in batch]
+        messages = build_prompt(items)
+        tokens = sum(estimate_tokens(m["content"]) for m in messages) + MAX_TOKENS_PER_ITEM * len(items)
+        if not self.budget.try_spend(tokens):
+            verdicts = [_verdict(None, source="budget")] * len(batch)
+        elif not self._slots.acquire(timeout=self.timeout):
+            verdicts = [_verdict(None, source="busy")] * len(batch)
+        else:
+            try:
+                self.prompts += 1
+                content = self.llm.chat(messages, timeout=self.timeout, temperature=0,
+                                        max_tokens=MAX_TOKENS_PER_ITEM * len(items))
+                verdicts = [v or _verdict(None, source="error") for v in parse_response(content, len(items))]
+            except Exception as e:
+                logging.warning(f"LLM validation failed: {e}")
+                verdicts = [_verdict(None, source="error")] * len(batch)
+            finally:
+                self._slots.release()
+        for (_, _, future), verdict in zip(batch, verdicts):
+            future.set_result(verdict)
+
+
+class Validator:
+    def __init__(self, llm=None, cache: VerdictCache = None, batcher: LLMBatcher = None):
+        self.cache = cache or VerdictCache()
+        self.batcher = batcher or (LLMBatcher(llm) if llm is not None else None)
+
+    def validate(self, stage: str, text: str) -> dict:
+        """Вердикт по этапу диалога (year, habit, amount, currency, confirmation)."""
+        verdict = check_rules(stage, text) if stage else _verdict(True)
+        if verdict is None:
+            verdict = self._escalate(stage, text)
+        VALIDATIONS.inc(stage=stage or "none", source=verdict["source"])
+        return verdict
+
+    def _escalate(self, stage: str, text: str) -> dict:
+        if self.batcher is None or stage not in STAGE_DESCRIPTIONS:
+            return _verdict(None, source="none")
+        key = (stage, normalize(text))
+        cached = self.cache.get(key)
+        CACHE_REQUESTS.inc(cache="validation", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return {**cached, "source": "cache"}
+        try:
+            verdict = self.batcher.submit(stage, text).result(timeout=self.batcher.timeout + self.batcher.window)
+        except FutureTimeout:
+            return _verdict(None, source="error")
+        if verdict["source"] == "llm":
+            self.cache.put(key, verdict)
+        return verdict
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_validator() -> Validator:
+    """Валидатор процесса. LLM подключается, если задан OPENAI_API_KEY и VALIDATION_LLM не равен 0."""
+    global _validator
+    if _validator is None:
+        with _validator_lock:
+            if _validator is None:
+                llm = None
+                if os.getenv("OPENAI_API_KEY") and os.getenv("VALIDATION_LLM", "1") != "0":
+                    from clients import get_llm
+
+                    llm = get_llm()
+                _validator = Validator(llm)
+    return _validator
+
+
+def set_validator(validator: Validator):
+    """Подменить валидатор (тесты); None — создать заново по окружению."""
+    global _validator
+    _validator = validator
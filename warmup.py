@@ -0,0 +1,89 @@
+"""
+Прогрев процесса: загрузка тяжёлых модулей и данных до первого запроса.
+
+warmup() безопасен до fork (gunicorn --preload): он не запускает потоков и не
+открывает сетевых соединений, а только импортирует модули и открывает mmap-файлы
+хранилища. Воркеры наследуют всё это copy-on-write. Повторный вызов ничего не делает.
+"""
+import logging
+import threading
+import time
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_status = {"started_at": None, "finished_at": None, "duration": None, "steps": {}, "warnings": []}
+
+
+def _step(name: str, fn):
+    started = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        _status["warnings"].append(f"{name}: {e}")
+        logging.warning(f"Warmup step {name} failed: {e}")
+        result = None
+    _status["steps"][name] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def _load_prices(symbols):
+    from price_store import get_price_provider
+
+    # Только локальный уровень цепочки: до fork нельзя открывать сетевые соединения
+    provider = get_price_provider()
+    provider = getattr(provider, "local", None) or provider
+    loaded = 0
+    for symbol in symbols:
+        try:
+            provider.history(symbol)
+            loaded += 1
+        except KeyError:
+            _status["warnings"].append(f"prices: нет данных по {symbol}")
+    return loaded
+
+
+def _load_fx():
+    from fx import get_fx_rates
+
+    rates = get_fx_rates()
+    return sum(rates.series(currency) is not None for currency in rates.store.symbols())
+
+
+def warmup(symbols=None) -> dict:
+    """Выполнить прогрев (один раз на процесс) и отметить процесс готовым к трафику."""
+    with _lock:
+        if _ready.is_set():
+            return status()
+        from utils import STOCKS
+
+        symbols = list(symbols or STOCKS)
+        _status["started_at"] = time.time()
+        started = time.perf_counter()
+
+        _step("imports", lambda: [__import__(m) for m in ("numpy", "dca", "growth_table", "history_index")])
+        _step("prices", lambda: _load_prices(symbols))
+        _step("history_index", lambda: __import__("history_index").get_history_index())
+        _step("growth_table", lambda: __import__("growth_table").get_growth_table())
+        _step("fx", _load_fx)
+        _step("cross_section", lambda: len(__import__("cross_section").get_price_matrix().symbols))
+
+        _status["duration"] = round(time.perf_counter() - started, 4)
+        _status["finished_at"] = time.time()
+        _ready.set()
+        logging.info(f"Warmup finished in {_status['duration']} s")
+        return status()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def status() -> dict:
+    return {"ready": _ready.is_set(), **_status, "steps": dict(_status["steps"]), "warnings": list(_status["warnings"])}
+
+
+def reset():
+    """Сбросить готовность (тесты)."""
+    with _lock:
+        _ready.clear()
+        _status.update(started_at=None, finished_at=None, duration=None, steps={}, warnings=[])